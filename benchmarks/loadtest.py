@@ -0,0 +1,491 @@
+"""Load test of a local server with many concurrent sessions.
+
+Starts `python -m pharmq serve` on localhost, the way it is deployed, opens
+`--clients` websocket connections to it, and has each one click through
+questions like a student would, as a user of its own. Reports how long
+sessions took to start, how long answers took to show, what the server's
+processes used in memory and CPU, and how many sessions failed.
+
+    python -m benchmarks.loadtest --clients 50 --mode pool --output load.json
+
+Memory and CPU are read from `/proc`, so they are only reported on Linux.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+import aiohttp
+
+from pharmq.utils.data_loader import STATE_DIR_ENV
+
+from .startup import ROOT
+from .suite import git_commit
+
+# How to start the server in each mode
+MODES = {
+    "process": ["pharmq", "serve"],
+    "pool": ["pharmq", "serve", "--pool"],
+    "single-process": ["pharmq", "serve", "--single-process"],
+}
+
+# Large enough for the whole quiz to fit, like a laptop browser window
+SCREEN_SIZE = (120, 40)
+
+CATEGORY = "Category: ".encode()
+FEEDBACK = "orrect!".encode()  # "Correct!" or "Incorrect!"
+
+OPTIONS = [f"option-main-{index}" for index in range(4)]
+NEXT = "next"
+
+
+@dataclass
+class ClientResult:
+    """What one simulated student saw."""
+
+    spawn_ms: float | None = None
+    answer_ms: list[float] = field(default_factory=list)
+    failure: str | None = None
+
+
+class SessionFailed(Exception):
+    """A session closed or stopped responding."""
+
+    def __init__(self, reason: str) -> None:
+        super().__init__(reason)
+        self.reason = reason
+
+
+def percentiles(samples: list[float]) -> dict[str, float] | None:
+    """50th, 90th, 95th and 99th percentiles and maximum of samples."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    summary = {
+        f"p{p}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+        for p in (50, 90, 95, 99)
+    }
+    summary["max"] = ordered[-1]
+    return summary
+
+
+async def next_frame(
+    websocket: aiohttp.ClientWebSocketResponse, timeout: float
+) -> bytes:
+    """Wait for the session to draw something, and return what it drew."""
+    while True:
+        try:
+            message = await websocket.receive(timeout=timeout)
+        except asyncio.TimeoutError:
+            raise SessionFailed("timeout") from None
+        if message.type == aiohttp.WSMsgType.BINARY:
+            return message.data
+        if message.type in (
+            aiohttp.WSMsgType.CLOSE,
+            aiohttp.WSMsgType.CLOSED,
+            aiohttp.WSMsgType.ERROR,
+        ):
+            raise SessionFailed("closed")
+
+
+def question_drawn(frame: bytes) -> bool:
+    """Whether a frame shows a question not yet answered."""
+    return CATEGORY in frame and FEEDBACK not in frame
+
+
+def answer_drawn(frame: bytes) -> bool:
+    """Whether a frame shows the feedback to an answer."""
+    return FEEDBACK in frame
+
+
+async def wait_for(
+    websocket: aiohttp.ClientWebSocketResponse,
+    drawn: Callable[[bytes], bool],
+    timeout: float,
+) -> float:
+    """Read output until a frame is `drawn`, and return when it came.
+
+    A pool worker's first output is only terminal modes, and sessions keep
+    repainting the screen for a while after a change, so the time is taken
+    to the first frame that shows what is looked for, rather than to the
+    first frame or to when output stops. Each screen update is sent in one
+    frame, which may repeat what was on screen before the change.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        frame = await next_frame(websocket, max(0.0, deadline - time.monotonic()))
+        if drawn(frame):
+            return time.monotonic()
+
+
+async def drain(websocket: aiohttp.ClientWebSocketResponse) -> None:
+    """Read what the session has drawn so far, so it is not taken as new."""
+    try:
+        while True:
+            await next_frame(websocket, 0.01)
+    except SessionFailed as error:
+        if error.reason != "timeout":
+            raise
+
+
+async def click(
+    websocket: aiohttp.ClientWebSocketResponse,
+    position: tuple[int, int],
+    drawn: Callable[[bytes], bool],
+    timeout: float,
+) -> float:
+    """Click at a position, and return milliseconds until its effect is drawn."""
+    await drain(websocket)
+    # A left button press and release, as SGR mouse reports, from 1
+    x, y = position[0] + 1, position[1] + 1
+    press = f"\x1b[<0;{x};{y}M\x1b[<0;{x};{y}m"
+    start = time.monotonic()
+    await websocket.send_str(json.dumps(["stdin", press]))
+    return (await wait_for(websocket, drawn, timeout) - start) * 1000
+
+
+async def locate_buttons(workdir: Path) -> dict[str, tuple[int, int]]:
+    """Where the quiz's buttons are on the screen, found by running it headless.
+
+    The quiz is laid out the same whatever the question, so the places
+    found once do for every session.
+    """
+    from pharmq.app import DrugQuizApp
+    from pharmq.models.settings import SettingsStore
+    from pharmq.utils.progress import ProgressStore
+    from pharmq.widgets.quiz import QuizQuestionWidget
+
+    progress = ProgressStore(workdir / "progress.db")
+    app = DrugQuizApp(
+        progress=progress, settings_store=SettingsStore(workdir / "settings")
+    )
+    async with app.run_test(size=SCREEN_SIZE) as pilot:
+        while app.query_one(QuizQuestionWidget).question is None:
+            await pilot.pause()
+        positions = {}
+        for button in [*OPTIONS, NEXT]:
+            region = app.query_one(f"#{button}").region
+            positions[button] = (
+                region.x + region.width // 2,
+                region.y + region.height // 2,
+            )
+    progress.close()
+    return positions
+
+
+async def run_client(
+    connector: aiohttp.BaseConnector,
+    url: str,
+    buttons: dict[str, tuple[int, int]],
+    delay: float,
+    answers: int,
+    think: float,
+    timeout: float,
+    rng: random.Random,
+) -> ClientResult:
+    """Open the page, connect, answer `answers` questions, and disconnect."""
+    await asyncio.sleep(delay)
+    result = ClientResult()
+    width, height = SCREEN_SIZE
+    try:
+        # A browser of its own, given a user id by the index page. Cookies
+        # for an IP address are only kept by an unsafe jar.
+        async with aiohttp.ClientSession(
+            connector=connector,
+            connector_owner=False,
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+        ) as session:
+            async with session.get(url) as response:
+                await response.read()
+            start = time.monotonic()
+            async with session.ws_connect(
+                f"{url}/ws?width={width}&height={height}"
+            ) as ws:
+                drawn = await wait_for(ws, question_drawn, timeout)
+                result.spawn_ms = (drawn - start) * 1000
+
+                for _ in range(answers):
+                    await asyncio.sleep(think * rng.uniform(0.5, 1.5))
+                    option = buttons[rng.choice(OPTIONS)]
+                    result.answer_ms.append(
+                        await click(ws, option, answer_drawn, timeout)
+                    )
+                    await click(ws, buttons[NEXT], question_drawn, timeout)
+    except SessionFailed as error:
+        result.failure = error.reason
+    except (aiohttp.ClientError, OSError):
+        result.failure = "connect"
+    return result
+
+
+def process_tree(pid: int) -> list[int]:
+    """A process and all its descendants."""
+    children: dict[int, list[int]] = {}
+    for stat_path in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            stat = stat_path.read_text()
+        except OSError:
+            continue
+        # The command name may contain spaces, but not ")"
+        ppid = int(stat.rpartition(")")[2].split()[1])
+        children.setdefault(ppid, []).append(int(stat_path.parent.name))
+
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children.get(parent, ()))
+    return tree
+
+
+def tree_usage(pid: int) -> tuple[int, float]:
+    """RSS in bytes and CPU seconds of a process tree.
+
+    CPU time of exited sessions is counted once their parent has reaped them.
+    """
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    ticks = os.sysconf("SC_CLK_TCK")
+    rss = 0
+    cpu = 0
+    for member in process_tree(pid):
+        try:
+            stat = Path(f"/proc/{member}/stat").read_text().rpartition(")")[2].split()
+            statm = Path(f"/proc/{member}/statm").read_text().split()
+        except OSError:
+            continue
+        # utime, stime, cutime and cstime
+        cpu += sum(int(value) for value in stat[11:15])
+        rss += int(statm[1]) * page_size
+    return rss, cpu / ticks
+
+
+class UsageSampler:
+    """Samples a server's memory and CPU use in the background."""
+
+    INTERVAL = 0.25
+
+    def __init__(self, pid: int) -> None:
+        self.pid = pid
+        self.enabled = sys.platform == "linux"
+        self.baseline_rss, self.start_cpu = self.sample()
+        self.peak_rss = self.baseline_rss
+        self._task: asyncio.Task | None = None
+
+    def sample(self) -> tuple[int, float]:
+        return tree_usage(self.pid) if self.enabled else (0, 0.0)
+
+    async def _run(self) -> None:
+        while True:
+            rss, _cpu = await asyncio.to_thread(self.sample)
+            self.peak_rss = max(self.peak_rss, rss)
+            await asyncio.sleep(self.INTERVAL)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, clients: int, elapsed: float) -> dict | None:
+        if self._task is not None:
+            self._task.cancel()
+        if not self.enabled:
+            return None
+        rss, cpu = await asyncio.to_thread(self.sample)
+        self.peak_rss = max(self.peak_rss, rss)
+        cpu_seconds = cpu - self.start_cpu
+        mib = 1024 * 1024
+        return {
+            "baseline_rss_mib": self.baseline_rss / mib,
+            "peak_rss_mib": self.peak_rss / mib,
+            "rss_per_session_mib": (self.peak_rss - self.baseline_rss) / clients / mib,
+            "cpu_seconds": cpu_seconds,
+            "cpu_cores": cpu_seconds / elapsed,
+        }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(
+    mode: str, port: int, workdir: Path, extra_args: list[str]
+) -> subprocess.Popen:
+    """Run the server on localhost, with its files in `workdir`."""
+    url = f"http://127.0.0.1:{port}"
+    env = {
+        **os.environ,
+        "PYTHONPATH": str(ROOT),
+        # Answers and settings of the simulated students, kept apart
+        STATE_DIR_ENV: str(workdir),
+        # Sessions are started as `python3`, which must be this interpreter
+        "PATH": os.pathsep.join(
+            [os.path.dirname(sys.executable), os.environ.get("PATH", "")]
+        ),
+    }
+    log = open(workdir / "server.log", "wb")
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", *MODES[mode],
+            "--host", "127.0.0.1", "--port", str(port), "--public-url", url,
+            *extra_args,
+        ],  # fmt: skip
+        cwd=workdir,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_until_up(
+    session: aiohttp.ClientSession, url: str, server: subprocess.Popen, timeout: float
+) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with status {server.returncode}")
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"Server did not come up within {timeout} seconds")
+
+
+async def load_test(args: argparse.Namespace, workdir: Path) -> dict:
+    buttons = await locate_buttons(workdir)
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    server = start_server(args.mode, port, workdir, args.server_args)
+    try:
+        async with aiohttp.TCPConnector(limit=0) as connector:
+            async with aiohttp.ClientSession(
+                connector=connector, connector_owner=False
+            ) as session:
+                await wait_until_up(session, url, server, args.timeout)
+            # Let a pool fill up before it is measured
+            await asyncio.sleep(args.warmup)
+
+            sampler = UsageSampler(server.pid)
+            sampler.start()
+            rng = random.Random(args.seed)
+            start = time.monotonic()
+            results = await asyncio.gather(
+                *(
+                    run_client(
+                        connector,
+                        url,
+                        buttons,
+                        args.ramp * index / args.clients,
+                        args.answers,
+                        args.think,
+                        args.timeout,
+                        random.Random(rng.random()),
+                    )
+                    for index in range(args.clients)
+                )
+            )
+            elapsed = time.monotonic() - start
+            usage = await sampler.stop(args.clients, elapsed)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+    failures = Counter(result.failure for result in results if result.failure)
+    return {
+        "clients": args.clients,
+        "completed": sum(result.failure is None for result in results),
+        "failures": dict(failures),
+        "elapsed_seconds": elapsed,
+        "spawn_ms": percentiles(
+            [result.spawn_ms for result in results if result.spawn_ms is not None]
+        ),
+        "answer_ms": percentiles(
+            [sample for result in results for sample in result.answer_ms]
+        ),
+        "usage": usage,
+    }
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"{report['completed']}/{report['clients']} sessions completed"
+        f" in {report['elapsed_seconds']:.1f} s"
+    )
+    for reason, count in report["failures"].items():
+        print(f"  failed ({reason}): {count}")
+    for name in ("spawn_ms", "answer_ms"):
+        summary = report[name]
+        if summary is not None:
+            values = "  ".join(f"{key} {value:8.1f}" for key, value in summary.items())
+            print(f"{name:<10} {values}")
+    usage = report["usage"]
+    if usage is not None:
+        print(
+            f"RSS {usage['peak_rss_mib']:.0f} MiB at peak"
+            f" ({usage['rss_per_session_mib']:.1f} MiB per session),"
+            f" CPU {usage['cpu_seconds']:.1f} s ({usage['cpu_cores']:.2f} cores)"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--mode", choices=MODES, default="process")
+    parser.add_argument("--answers", type=int, default=5, help="questions per client")
+    parser.add_argument("--think", type=float, default=1.0, help="seconds per answer")
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds to connect all")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds before start")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path)
+    parser.add_argument(
+        "server_args",
+        nargs=argparse.REMAINDER,
+        help="passed on to `pharmq serve`, after --",
+    )
+    args = parser.parse_args()
+    if args.server_args[:1] == ["--"]:
+        args.server_args = args.server_args[1:]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            report = asyncio.run(load_test(args, Path(workdir)))
+        except RuntimeError as error:
+            print(error)
+            print((Path(workdir) / "server.log").read_text(errors="replace")[-2000:])
+            sys.exit(1)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "mode": args.mode,
+        "server_args": args.server_args,
+        **report,
+    }
+    print_report(report)
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
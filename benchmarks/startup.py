@@ -0,0 +1,88 @@
+"""Start-up budget check for `pharmq.app`.
+
+Each measurement runs in a fresh interpreter, so nothing is cached between
+runs. Exits with status 1 if the median of any measurement is over budget.
+
+    python -m benchmarks.startup
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+# Import time of `pharmq.app` itself, on top of Textual
+IMPORT_SCRIPT = """
+import time
+import textual.app, textual.widgets
+
+start = time.perf_counter()
+import pharmq.app
+print((time.perf_counter() - start) * 1000)
+"""
+
+# Process start to the first question on screen, in a headless session
+FIRST_PAINT_SCRIPT = """
+import asyncio
+import time
+
+start = time.perf_counter()
+from pharmq.app import DrugQuizApp
+from pharmq.widgets.quiz import QuizQuestionWidget
+
+
+async def main():
+    app = DrugQuizApp()
+    async with app.run_test() as pilot:
+        # Settings are read in a worker before the first question is shown
+        while app.query_one(QuizQuestionWidget).question is None:
+            await pilot.pause(0.001)
+        print((time.perf_counter() - start) * 1000)
+
+
+asyncio.run(main())
+"""
+
+
+def measure(script: str, runs: int) -> float:
+    """Median milliseconds reported by a script over fresh interpreters."""
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        samples.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget", type=float, default=60, help="ms")
+    parser.add_argument("--first-paint-budget", type=float, default=1000, help="ms")
+    args = parser.parse_args()
+
+    checks = [
+        ("import pharmq.app", IMPORT_SCRIPT, args.import_budget),
+        ("time to first paint", FIRST_PAINT_SCRIPT, args.first_paint_budget),
+    ]
+
+    failed = False
+    for name, script, budget in checks:
+        elapsed = measure(script, args.runs)
+        status = "ok" if elapsed <= budget else "OVER BUDGET"
+        failed |= elapsed > budget
+        print(f"{name:<22} {elapsed:8.1f} ms  (budget {budget:.0f} ms)  {status}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Headless benchmark suite for quiz latency, throughput and memory.
+
+Drives `DrugQuizApp` through Textual's `run_test` and writes the results to
+a JSON file, so runs on different commits can be compared.
+
+    python -m benchmarks.suite --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .startup import FIRST_PAINT_SCRIPT, ROOT, measure
+
+DECK_SIZES = (10, 1_000, 100_000)
+
+# Large enough for the whole quiz, "Next Question" included, to be clickable
+SCREEN_SIZE = (120, 40)
+
+# Peak RSS of a process that runs one session and answers a few questions
+SESSION_RSS_SCRIPT = """
+import asyncio
+import resource
+import sys
+
+from pharmq.app import DrugQuizApp
+from pharmq.models.settings import SettingsStore
+from pharmq.utils.progress import ProgressStore
+from pharmq.widgets.quiz import QuizQuestionWidget
+
+
+async def main():
+    progress = ProgressStore("progress.db")
+    app = DrugQuizApp(progress=progress, settings_store=SettingsStore("settings"))
+    async with app.run_test(size=(120, 40)) as pilot:
+        for _ in range(10):
+            # The first question waits for settings, read in a worker
+            while (question := app.query_one(QuizQuestionWidget).question) is None:
+                await pilot.pause()
+            await pilot.click(f"#option_{question.answer_index}")
+            await pilot.click("#next")
+        app.query_one("TabbedContent").active = "categories-tab"
+        await pilot.pause(0.5)
+    progress.close()
+
+
+asyncio.run(main())
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+# Kilobytes on Linux, bytes on macOS
+print(peak / 1024 if sys.platform != "darwin" else peak / 1024 / 1024)
+"""
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    """Median, 95th percentile and maximum of samples."""
+    ordered = sorted(samples)
+    return {
+        "median": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1],
+    }
+
+
+async def click_to_feedback(rounds: int, workdir: Path) -> list[float]:
+    """Milliseconds from clicking an option to the answer being handled.
+
+    Timed from the `Click` event being dispatched to
+    `QuizQuestionWidget.Answered`, which `option_clicked` posts once the
+    feedback is shown, so the pilot's own waiting is left out.
+    """
+    from textual import events
+
+    from pharmq.app import DrugQuizApp
+    from pharmq.models.settings import SettingsStore
+    from pharmq.utils.progress import ProgressStore
+    from pharmq.widgets.quiz import QuizQuestionWidget
+
+    clicked_at: list[float] = []
+    answered_at: list[float] = []
+
+    def message_hook(message) -> None:
+        if isinstance(message, events.Click):
+            clicked_at.append(time.perf_counter())
+        elif isinstance(message, QuizQuestionWidget.Answered):
+            answered_at.append(time.perf_counter())
+
+    progress = ProgressStore(workdir / "progress.db")
+    app = DrugQuizApp(
+        progress=progress, settings_store=SettingsStore(workdir / "settings")
+    )
+    samples = []
+    async with app.run_test(size=SCREEN_SIZE, message_hook=message_hook) as pilot:
+        for _ in range(rounds):
+            # The first question waits for settings, read in a worker
+            while (question := app.query_one(QuizQuestionWidget).question) is None:
+                await pilot.pause()
+            option = random.randrange(len(question.options))
+
+            clicked_at.clear()
+            answered_at.clear()
+            await pilot.click(f"#option_{option}")
+            while not answered_at:
+                await pilot.pause()
+            samples.append((answered_at[0] - clicked_at[0]) * 1000)
+
+            await pilot.click("#next")
+    progress.close()
+    return samples
+
+
+def synthetic_category(n_rows: int, seed: int = 0):
+    """A deck of `n_rows` rows with four fields and some repeated answers."""
+    from pharmq.models.category import Category
+    from pharmq.models.columnar import ColumnarTable
+
+    rng = random.Random(seed)
+    n_answers = max(4, n_rows * 3 // 4)
+    fields = ["Mechanism", "Clinical use", "Adverse effect", "Notes"]
+    rows = [
+        {
+            "Drug": f"Drug {rng.randrange(n_answers)}",
+            **{field: f"{field} {rng.randrange(n_rows)}" for field in fields},
+        }
+        for _ in range(n_rows)
+    ]
+    return Category(
+        id=f"synthetic_{n_rows}",
+        data=ColumnarTable.from_rows(["Drug", *fields], rows),
+        fields=fields,
+        answer_field="Drug",
+    )
+
+
+def generate_throughput(n_rows: int, duration: float) -> dict[str, float]:
+    """Index build time and `generate_question` calls per second on a deck."""
+    from pharmq.models.quiz import QuizGenerator
+
+    category = synthetic_category(n_rows)
+
+    start = time.perf_counter()
+    generator = QuizGenerator({category.id: category})
+    index_ms = (time.perf_counter() - start) * 1000
+
+    count = 0
+    start = time.perf_counter()
+    deadline = start + duration
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            generator.generate_question()
+        count += 100
+    elapsed = time.perf_counter() - start
+
+    return {"index_ms": index_ms, "questions_per_second": count / elapsed}
+
+
+def session_rss(runs: int, workdir: Path) -> list[float]:
+    """Peak RSS in MiB of fresh processes that each run one session."""
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", SESSION_RSS_SCRIPT],
+            cwd=workdir,
+            env={**os.environ, "PYTHONPATH": str(ROOT)},
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        samples.append(float(result.stdout.strip().splitlines()[-1]))
+    return samples
+
+
+def git_commit() -> str | None:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", type=Path, default=Path("benchmark-results.json"))
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes")
+    parser.add_argument("--rounds", type=int, default=50, help="questions answered")
+    parser.add_argument("--duration", type=float, default=1.0, help="seconds per deck")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DECK_SIZES)
+    args = parser.parse_args()
+
+    results: dict = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+
+    results["time_to_first_question_ms"] = measure(FIRST_PAINT_SCRIPT, args.runs)
+    print(f"time to first question  {results['time_to_first_question_ms']:8.1f} ms")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        latency = summarize(asyncio.run(click_to_feedback(args.rounds, Path(workdir))))
+        results["click_to_feedback_ms"] = latency
+        print(
+            f"click to feedback       {latency['median']:8.2f} ms"
+            f"  (p95 {latency['p95']:.2f} ms)"
+        )
+
+        if sys.platform != "win32":
+            rss = session_rss(args.runs, Path(workdir))
+            results["session_peak_rss_mib"] = summarize(rss)
+            print(f"session peak RSS        {statistics.median(rss):8.1f} MiB")
+
+    results["generate_question"] = {}
+    for n_rows in args.sizes:
+        throughput = generate_throughput(n_rows, args.duration)
+        results["generate_question"][str(n_rows)] = throughput
+        print(
+            f"generate_question {n_rows:>7} rows"
+            f"  {throughput['questions_per_second']:10.0f} q/s"
+            f"  (index {throughput['index_ms']:.1f} ms)"
+        )
+
+    args.output.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,228 @@
-from textual_serve.server import Server
-
-# Server("uv run -m pharmq.app").serve()
-Server(
-    "python3 -m pharmq.app",
-    host="0.0.0.0",
-    port=7414,
-    public_url="https://pharmq.onrender.com",
-).serve()
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import BinaryIO
+
+from .utils.data_loader import DATA_DIR
+
+
+def serve(args: argparse.Namespace) -> None:
+    """Serve the quiz app over the web."""
+    options = dict(host=args.host, port=args.port, public_url=args.public_url)
+
+    metrics_dir = None
+    if args.metrics:
+        from .utils import metrics
+
+        # Before the app is imported, so its hot paths get instrumented;
+        # session processes write their metrics to `metrics_dir`
+        metrics_dir = tempfile.mkdtemp(prefix="pharmq-metrics-")
+        metrics.enable(metrics_dir)
+
+    if args.distractors != "random":
+        from .models.distractors import DISTRACTORS_ENV
+
+        # Read by the app in this process and in session processes alike
+        os.environ[DISTRACTORS_ENV] = args.distractors
+    if args.cross_category:
+        from .models.distractors import CROSS_CATEGORY_ENV
+
+        os.environ[CROSS_CATEGORY_ENV] = "1"
+
+    shared_dataset = None
+    if args.shared_memory:
+        from .utils.data_loader import load_csv_data
+        from .utils.shared_dataset import SHARED_DATASET_ENV, publish_dataset
+
+        # Session processes inherit the environment and attach by name
+        shared_dataset = publish_dataset(DATA_DIR, load_csv_data())
+        os.environ[SHARED_DATASET_ENV] = shared_dataset.name
+
+    if args.pool:
+        from .server.pool import PooledServer
+
+        server = PooledServer(pool_min=args.pool_min, pool_max=args.pool_max, **options)
+    elif args.single_process:
+        from .server.single_process import SingleProcessServer
+
+        server = SingleProcessServer(**options)
+    else:
+        from .server.process import ProcessServer
+
+        # Server("uv run -m pharmq.app").serve()
+        server = ProcessServer(**options)
+
+    if args.metrics:
+        from .server.metrics import instrument_server
+
+        instrument_server(server)
+
+    try:
+        server.serve()
+    finally:
+        if shared_dataset is not None:
+            shared_dataset.close()
+            shared_dataset.unlink()
+        if metrics_dir is not None:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def build_snapshot(args: argparse.Namespace) -> None:
+    """Compile the data directory into a snapshot."""
+    from .utils.data_loader import read_csv_dir
+    from .utils.snapshot import write_snapshot
+
+    categories = read_csv_dir(args.data_dir)
+    path = write_snapshot(args.data_dir, categories)
+    rows = sum(len(category.data) for category in categories.values())
+    print(f"Wrote {len(categories)} categories ({rows} rows) to {path}")
+
+
+def export(args: argparse.Namespace) -> None:
+    """Write generated questions to a file, or to standard output."""
+    from .utils.export import default_workers, export_questions
+
+    seed = random.randrange(2**32) if args.seed is None else args.seed
+    categories = set(args.category) if args.category else None
+    start = time.perf_counter()
+
+    def write(out: BinaryIO) -> None:
+        export_questions(
+            out,
+            args.count,
+            seed,
+            fmt=args.format,
+            workers=args.workers or default_workers(),
+            categories=categories,
+            data_dir=args.data_dir,
+            distractors=args.distractors,
+            cross_category=args.cross_category,
+        )
+
+    try:
+        if args.output == "-":
+            write(sys.stdout.buffer)
+        else:
+            # Written aside and moved into place once complete, so a failed
+            # or interrupted export leaves an existing file as it was
+            path = Path(args.output)
+            tmp_path = path.with_name(path.name + ".tmp")
+            try:
+                with open(tmp_path, "wb") as out:
+                    write(out)
+                os.replace(tmp_path, path)
+            finally:
+                tmp_path.unlink(missing_ok=True)
+    except ValueError as e:
+        sys.exit(f"Error exporting questions: {e}")
+    # Progress goes to stderr, so it does not mix with questions on stdout
+    print(
+        f"Wrote {args.count} questions (seed {seed}) to "
+        f"{'stdout' if args.output == '-' else args.output} "
+        f"in {time.perf_counter() - start:.1f} s",
+        file=sys.stderr,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="pharmq")
+    subparsers = parser.add_subparsers(dest="command")
+
+    serve_parser = subparsers.add_parser("serve", help="serve the app (default)")
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=7414)
+    serve_parser.add_argument("--public-url", default="https://pharmq.onrender.com")
+    mode = serve_parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--pool",
+        action="store_true",
+        help="attach sessions to pre-started warm workers",
+    )
+    mode.add_argument(
+        "--single-process",
+        action="store_true",
+        help="run all sessions in this process, sharing one dataset",
+    )
+    serve_parser.add_argument(
+        "--shared-memory",
+        action="store_true",
+        help="load the dataset once and share it with session processes",
+    )
+    serve_parser.add_argument(
+        "--distractors",
+        choices=["random", "similar"],
+        default="random",
+        help="draw wrong answers at random, or the most similar ones first",
+    )
+    serve_parser.add_argument(
+        "--cross-category",
+        action="store_true",
+        help="fill in wrong answers from other categories in too small ones",
+    )
+    serve_parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="time hot paths and serve them in Prometheus format at /metrics",
+    )
+    serve_parser.add_argument(
+        "--pool-min", type=int, default=4, help="warm workers to keep idle"
+    )
+    serve_parser.add_argument(
+        "--pool-max", type=int, default=128, help="maximum live workers"
+    )
+    serve_parser.set_defaults(func=serve)
+
+    snapshot_parser = subparsers.add_parser(
+        "build-snapshot", help="compile the CSV data into a snapshot"
+    )
+    snapshot_parser.add_argument("--data-dir", default=DATA_DIR)
+    snapshot_parser.set_defaults(func=build_snapshot)
+
+    export_parser = subparsers.add_parser(
+        "export", help="write generated questions to JSON Lines, CSV or Anki"
+    )
+    export_parser.add_argument(
+        "-n", "--count", type=int, default=100, help="questions to write"
+    )
+    export_parser.add_argument(
+        "-f", "--format", choices=["jsonl", "csv", "anki"], default="jsonl"
+    )
+    export_parser.add_argument(
+        "-o", "--output", default="-", help="file to write, or - for stdout"
+    )
+    export_parser.add_argument(
+        "--seed",
+        type=int,
+        help="the same seed gives the same output; random if not given",
+    )
+    export_parser.add_argument(
+        "--workers",
+        type=int,
+        help="processes generating questions, one per CPU by default; "
+        "does not change the output",
+    )
+    export_parser.add_argument(
+        "--category",
+        action="append",
+        help="only ask about this category; may be repeated",
+    )
+    export_parser.add_argument("--data-dir", default=DATA_DIR)
+    export_parser.add_argument(
+        "--distractors", choices=["random", "similar"], default="random"
+    )
+    export_parser.add_argument("--cross-category", action="store_true")
+    export_parser.set_defaults(func=export)
+
+    args = parser.parse_args()
+    if args.command is None:
+        args = parser.parse_args(["serve"])
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,47 @@
+import asyncio
 import random
-from typing import Dict
+import threading
+from collections import deque
+from functools import cached_property
+from typing import TYPE_CHECKING, Dict, NamedTuple
 
+from rich.console import RenderableType
 from rich.text import Text
-from textual import on
+from textual import on, work
 from textual.app import App, ComposeResult
-from textual.containers import Container, ScrollableContainer
+from textual.containers import Container
+from textual.css.query import NoMatches
 from textual.reactive import reactive
 from textual.widgets import (
     Button,
-    DataTable,
-    Footer,
     Header,
-    Label,
     Static,
     TabbedContent,
     TabPane,
 )
+from textual.worker import get_current_worker
 
-from pharmq.models.quiz import QuizGenerator
-from pharmq.models.settings import Settings
+# Imported where they are used, so that importing the app stays quick
+if TYPE_CHECKING:
+    from .models.scheduler import Scheduler
+    from .models.search import SearchIndex
+    from .models.settings import Settings, SettingsStore
+    from .utils.data_watcher import DataChange, DataWatcher
+    from .utils.progress import ProgressStore
+    from .widgets.categories import CategoryTable
+
+from pharmq.models.quiz import QuizGenerator, QuizQuestion
 from pharmq.widgets.quiz_option import QuizOptionWidget
-from pharmq.widgets.settings import CategorySelect, SettingsButton, SettingsModal
+from pharmq.widgets.settings import CategorySelect
 
 from .models.category import Category
 from .utils.data_loader import load_csv_data
-from .widgets.categories import CategoryTable
-from .widgets.quiz import QuizQuestionWidget, create_characteristics_table
+from .utils import metrics
+from .widgets.quiz import (
+    CachedCharacteristicsTable,
+    QuizQuestionWidget,
+    characteristics_table_cache,
+)
 
 # def on_button_pressed(self, event: Button.Pressed) -> None:
 #     """Handle button presses."""
@@ -36,23 +52,139 @@ from .widgets.quiz import QuizQuestionWidget, create_characteristics_table
 #         return
 
 
+class PreparedQuestion(NamedTuple):
+    """A question with its renderables built, ready to be shown."""
+
+    question: QuizQuestion
+    category_text: Text
+    characteristics_table: RenderableType
+
+
 class DrugQuizApp(App):
     """A quiz application for drug-related questions."""
 
     CSS_PATH = "styles.tcss"
 
+    PREFETCH_SIZE = 4
+    """Number of questions to keep prepared ahead of "Next Question"."""
+
+    DATA_POLL_INTERVAL = 2.0
+    """Seconds between checks of the data directory for edited files."""
+
+    METRICS_DUMP_INTERVAL = 5.0
+    """Seconds between writes of this session's metrics for the server."""
+
     current_question = reactive(None)
     current_answer = reactive(None)
     current_category = reactive(None)
     all_options = reactive([])
     question_answered = reactive(False)
-    categories: Dict[str, Category] = load_csv_data()
-
-    quiz_generator = QuizGenerator(categories)
 
     selected_categories: reactive[set[str] | None] = reactive(None)
     # debug_selected_categories = reactive(None, always_update=True, recompose=True)
 
+    def __init__(
+        self,
+        categories: Dict[str, Category] | None = None,
+        quiz_generator: QuizGenerator | None = None,
+        progress: "ProgressStore | None" = None,
+        settings_store: "SettingsStore | None" = None,
+        search_index: "SearchIndex | None" = None,
+        user: str | None = None,
+        rng: random.Random | None = None,
+        **kwargs,
+    ) -> None:
+        """
+        Args:
+            categories: Categories to quiz on, or None to load the data directory.
+            quiz_generator: A generator over `categories` to share with other
+                sessions, or None to build one on first use.
+            progress: A store to record answers in, shared with other
+                sessions, or None to open the default one on first answer.
+            settings_store: Where settings are kept, shared with other
+                sessions, or None to use the default one.
+            search_index: A full-text index over `categories` to share with
+                other sessions, or None to build one.
+            user: Who answers and settings are kept for, or None for the
+                local user.
+            rng: Where this session's random choices come from, or None for a
+                fresh `random.Random()`. Seed it, or save and restore its
+                state, to replay the session's questions, up to the first
+                change of categories or reload of the data: these discard
+                the questions prepared ahead, and how many were prepared by
+                then, drawing from `rng`, depends on timing.
+        """
+        super().__init__(**kwargs)
+        self._categories = categories
+        if quiz_generator is not None:
+            self.quiz_generator = quiz_generator
+        self._owns_progress = progress is None
+        if progress is not None:
+            self.progress = progress
+        self._owns_settings_store = settings_store is None
+        if settings_store is not None:
+            self.settings_store = settings_store
+        if search_index is not None:
+            self.search_index = search_index
+        if user is None:
+            from .utils.progress import DEFAULT_USER
+
+            user = DEFAULT_USER
+        self.user = user
+        self.rng = random.Random() if rng is None else rng
+        # Questions are prepared by the prefetch worker and the main thread,
+        # so each takes its draws from `rng` in one go
+        self._rng_lock = threading.Lock()
+        # Sessions given their data by a server have reloads pushed to them;
+        # others start watching the data directory once mounted
+        self._watch_data = categories is None
+        self.data_watcher: "DataWatcher | None" = None
+
+        self.prefetched: deque[PreparedQuestion] = deque()
+        # Bumped whenever prefetched questions go stale
+        self.prefetch_generation = 0
+
+    @property
+    def categories(self) -> Dict[str, Category]:
+        """All categories, loaded on first access."""
+        if self._categories is None:
+            self._categories = load_csv_data()
+        return self._categories
+
+    @cached_property
+    def quiz_generator(self) -> QuizGenerator:
+        from .models.distractors import distractor_options
+
+        return QuizGenerator(self.categories, **distractor_options())
+
+    @cached_property
+    def progress(self) -> "ProgressStore":
+        """Where this session's answers are recorded."""
+        from .utils.progress import ProgressStore
+
+        return ProgressStore()
+
+    @cached_property
+    def settings_store(self) -> "SettingsStore":
+        """Where this session's settings are kept."""
+        from .models.settings import SettingsStore
+
+        return SettingsStore()
+
+    @cached_property
+    def search_index(self) -> "SearchIndex":
+        """Full-text index for the search box of the category tables."""
+        from .models.search import SearchIndex
+
+        return SearchIndex(self.categories)
+
+    @cached_property
+    def scheduler(self) -> "Scheduler":
+        """Spaced-repetition schedule of this session."""
+        from .models.scheduler import Scheduler
+
+        return Scheduler(self.categories, rng=self.rng)
+
     def compose(self) -> ComposeResult:
         """Create child widgets for the app."""
         # with Header():
@@ -63,8 +195,8 @@ class DrugQuizApp(App):
         with TabbedContent() as tabs:
             with TabPane("Quiz", id="quiz-tab"):
                 yield Container(QuizQuestionWidget(), id="quiz")
-            with TabPane("Categories", id="categories-tab"):
-                yield CategoryTable(self.categories)
+            # Filled in by `mount_category_table` when first needed
+            yield TabPane("Categories", id="categories-tab")
 
     def on_mount(self) -> None:
         """Generate the first question when the app starts."""
@@ -73,7 +205,35 @@ class DrugQuizApp(App):
                 Text("No data files found in ./data directory", style="bold red")
             )
             return
-        self.generate_question()
+        self.load_settings()
+        self.build_search_index()
+
+        if self._watch_data:
+            self.watch_data()
+        if metrics.exporting():
+            self.set_interval(self.METRICS_DUMP_INTERVAL, metrics.dump)
+
+    async def on_unmount(self) -> None:
+        """Write out recorded answers and settings before exiting."""
+        # Stores shared by a server outlive the session
+        if self._owns_progress and "progress" in self.__dict__:
+            await asyncio.to_thread(self.progress.close)
+        if self._owns_settings_store and "settings_store" in self.__dict__:
+            await asyncio.to_thread(self.settings_store.flush)
+        metrics.dump()
+
+    @on(TabbedContent.TabActivated, pane="#categories-tab")
+    async def mount_category_table(self) -> "CategoryTable":
+        """Mount the category tables the first time they are shown."""
+        from .widgets.categories import CategoryTable
+
+        pane = self.query_one("#categories-tab", TabPane)
+        try:
+            return pane.query_one(CategoryTable)
+        except NoMatches:
+            category_table = CategoryTable(self.categories, self.search_index)
+            await pane.mount(category_table)
+            return category_table
 
     @on(CategorySelect.Updated)
     def update_categories(self, ev: CategorySelect.Updated):
@@ -82,47 +242,174 @@ class DrugQuizApp(App):
         self.debug_selected_categories = ",".join(ev.categories)
         # self.query_one("#dbg", Label).update(self.debug_selected_categories)
 
+        settings = self.settings_store.get(self.user)
+        settings.selected_categories = (
+            None if ev.categories >= set(self.categories) else set(ev.categories)
+        )
+        self.settings_store.update(self.user, settings)
+
+        # Questions prepared for the old selection must not be shown
+        self.drop_prefetched()
+        self.prefetch_questions()
+
+    def prepare_question(self, selected_categories: set[str] | None) -> PreparedQuestion:
+        """Generate a question and build everything needed to show it."""
+        quiz_generator = self.quiz_generator
+        # The generator's lock keeps a reload from landing between drawing a
+        # card and asking it
+        with self._rng_lock, quiz_generator.lock:
+            card = self.scheduler.next_card(
+                quiz_generator.available_categories(selected_categories)
+            )
+            if card is not None and not quiz_generator.has_row(*card):
+                # Scheduled from data reloaded since; forgotten on refresh
+                card = None
+            if card is None:
+                # Every card is out already, e.g. prepared ahead from a tiny deck
+                question = quiz_generator.generate_question(
+                    selected_categories, self.rng
+                )
+            else:
+                question = quiz_generator.question_for(*card, self.rng)
+            title = self.categories[question.category_name].title
+
+        category_text = Text("Category: ", style="grey50")
+        category_text.append(title, style="grey70")
+
+        # characteristics_table = create_characteristics_table(row, category.fields)
+        characteristics_table = CachedCharacteristicsTable(question)
+        return PreparedQuestion(question, category_text, characteristics_table)
+
+    @work(thread=True, exclusive=True, group="prefetch")
+    def prefetch_questions(self) -> None:
+        """Fill the prefetch buffer in the background."""
+        worker = get_current_worker()
+        generation = self.prefetch_generation
+        selected_categories = self.selected_categories
+
+        while not worker.is_cancelled and len(self.prefetched) < self.PREFETCH_SIZE:
+            prepared = self.prepare_question(selected_categories)
+            if not self.call_from_thread(self.store_prefetched, prepared, generation):
+                break
+
+    def store_prefetched(self, prepared: PreparedQuestion, generation: int) -> bool:
+        """Add a prefetched question to the buffer, unless it went stale."""
+        if generation != self.prefetch_generation:
+            self.requeue(prepared.question)
+            return False
+        if len(self.prefetched) < self.PREFETCH_SIZE:
+            self.prefetched.append(prepared)
+        else:
+            self.requeue(prepared.question)
+        return True
+
+    def drop_prefetched(self) -> None:
+        """Discard prefetched questions, giving their cards back."""
+        self.prefetch_generation += 1
+        while self.prefetched:
+            self.requeue(self.prefetched.popleft().question)
+
+    def requeue(self, question: QuizQuestion) -> None:
+        """Give back the card of a question that will not be shown."""
+        self.scheduler.requeue(question.category_name, question.row_index)
+
     def generate_question(self) -> None:
-        """Generate a new question from a random category."""
+        """Show the next question, from the prefetch buffer if possible."""
         self.question_answered = False
 
-        question = self.quiz_generator.generate_question(self.selected_categories)
+        if self.prefetched:
+            question, category_text, characteristics_table = self.prefetched.popleft()
+        else:
+            question, category_text, characteristics_table = self.prepare_question(
+                self.selected_categories
+            )
 
         quiz_widget = self.query_one(QuizQuestionWidget)
         quiz_widget.set_question(question)
 
-        category_text = Text("Category: ", style="grey50")
-        category_text.append(
-            self.categories[question.category_name].title, style="grey70"
-        )
         self.query_one("#category", Static).update(category_text)
-
-        # Create and update table display
-        # characteristics_table = create_characteristics_table(row, category.fields)
-        characteristics_table = create_characteristics_table(question.characteristics)
         self.query_one("#question", Static).update(characteristics_table)
         self.query_one("#feedback", Static).update("")
         self.query_one("#next", Button).disabled = True
 
+        self.prefetch_questions()
+
+    @work(thread=True, exclusive=True, group="settings")
+    def load_settings(self) -> None:
+        """Read the user's settings and answers off the UI thread, then ask."""
+        settings = self.settings_store.get(self.user)
+        self.scheduler.seed(self.progress.answers(self.user))
+        self.call_from_thread(self.apply_settings, settings)
+
+    def apply_settings(self, settings: "Settings") -> None:
+        self.selected_categories = settings.selected_categories
+        self.generate_question()
+
+    @work(thread=True, exclusive=True, group="search-index")
+    def build_search_index(self) -> None:
+        """Index the data for searching, so the first search does not wait."""
+        self.search_index.build()
+
+    @work(thread=True, exclusive=True, group="data")
+    def watch_data(self) -> None:
+        """Note the data files as they are now, then poll them for edits."""
+        from .utils.data_watcher import DataWatcher
+
+        self.data_watcher = DataWatcher()
+        self.call_from_thread(
+            self.set_interval, self.DATA_POLL_INTERVAL, self.poll_data
+        )
+
+    @work(thread=True, exclusive=True, group="data")
+    def poll_data(self) -> None:
+        """Check the data directory for edited files in the background."""
+        assert self.data_watcher is not None
+        change = self.data_watcher.poll()
+        if change is not None:
+            self.call_from_thread(self.apply_data_change, change)
+
+    async def apply_data_change(self, change: "DataChange") -> None:
+        """Swap reloaded categories in and rebuild only their indexes."""
+        self.quiz_generator.apply_changes(change.changed, change.removed)
+        self.search_index.apply_changes(change.changed, change.removed)
+        await self.refresh_data(change)
+
+    async def refresh_data(self, change: "DataChange") -> None:
+        """Update this session after categories were reloaded."""
+        for category_name in change.names:
+            characteristics_table_cache.discard_category(category_name)
+            self.scheduler.forget_category(category_name)
+
+        self.drop_prefetched()
+        self.prefetch_questions()
+        self.build_search_index()
+
+        # Rebuilt from the new data the next time the tab is shown
+        pane = self.query_one("#categories-tab", TabPane)
+        await pane.remove_children()
+        if self.query_one(TabbedContent).active == "categories-tab":
+            await self.mount_category_table()
+
     @on(QuizOptionWidget.Linked)
-    def link_option(self, event: QuizOptionWidget.Linked) -> None:
+    async def link_option(self, event: QuizOptionWidget.Linked) -> None:
         """Link a QuizOption to the correct index."""
 
         tabs = self.query_one(TabbedContent)
         tabs.active = "categories-tab"
+        category_table = await self.mount_category_table()
 
         option = event.option
-        table = self.query_one(f"#category-table-{option.category_name}", DataTable)
-
-        table.scroll_visible(duration=0.75)
-        table.move_cursor(row=option.row_index, scroll=True)
+        await category_table.show_row(option.category_name, option.row_index)
 
     @on(QuizQuestionWidget.Answered)
     def check_answer(self, event: QuizQuestionWidget.Answered):
         self.question_answered = True
 
-        # Enable next question button
-        self.query_one("#next", Button).disabled = False
+        question = event.question
+        self.scheduler.review(question.category_name, question.row_index, event.correct)
+        self.progress.record(
+            self.user, question.category_name, question.row_index, event.correct
+        )
 
     def on_button_pressed(self, event: Button.Pressed) -> None:
         """Handle button presses."""
@@ -137,5 +424,9 @@ class DrugQuizApp(App):
 
 
 if __name__ == "__main__":
-    app = DrugQuizApp()
+    import os
+
+    from .utils.progress import DEFAULT_USER, USER_ENV
+
+    app = DrugQuizApp(user=os.environ.get(USER_ENV, DEFAULT_USER))
     app.run()
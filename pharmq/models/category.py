@@ -1,4 +1,4 @@
-from typing import NamedTuple
+from typing import Mapping, NamedTuple, Sequence
 
 # class Subgroup(NamedTuple):
 #     category_id: str
@@ -15,7 +15,7 @@ class Category(NamedTuple):
     # subgroups: list[Subgroup]
     id: str
     # data: pd.DataFrame
-    data: list[dict[str, str]]
+    data: Sequence[Mapping[str, str]]
     fields: list[str]
     answer_field: str
 
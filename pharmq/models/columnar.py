@@ -0,0 +1,134 @@
+"""Compact, column-oriented storage for the rows of a category.
+
+A `csv.DictReader` row is a dict of its own, keyed by the header strings, and
+holds its own copy of every value. `ColumnarTable` instead keeps one array of
+small integer codes per field, and every distinct value once in a
+`StringPool`. Rows are `ColumnarRow` views, made on access, that look up
+their values by code, so a row costs a few bytes per field however it is
+used.
+
+Equal values have equal codes, so code that compares values, such as
+`QuizGenerator`, can compare the codes instead.
+"""
+
+import threading
+from array import array
+from typing import Callable, Iterable, Iterator, Mapping, Sequence
+
+
+class StringPool:
+    """Distinct strings, each stored once and known by an integer code.
+
+    Code 0 stands for a missing value and reads back as None, as
+    `csv.DictReader` gives for short rows. Tables sharing a pool share codes,
+    and values repeated across them are stored once.
+    """
+
+    def __init__(self) -> None:
+        self.values: list[str | None] = [None]
+        self.codes: dict[str, int] = {}
+        # Held while a table is interned, for pools shared between threads
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __getitem__(self, code: int) -> str | None:
+        return self.values[code]
+
+    def intern(self, value: str | None) -> int:
+        """The code of a value, adding it to the pool if it is new."""
+        if value is None:
+            return 0
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def _typecode(n_codes: int) -> str:
+    """The smallest unsigned array type that holds codes below `n_codes`."""
+    if n_codes <= 1 << 8:
+        return "B"
+    if n_codes <= 1 << 16:
+        return "H"
+    return "I"
+
+
+class ColumnarTable(Sequence["ColumnarRow"]):
+    """The rows of one category, stored as one sequence of codes per field.
+
+    `decode` turns a code back into its value, or None for a missing value.
+    """
+
+    def __init__(
+        self,
+        header: list[str],
+        columns: Sequence[Sequence[int]],
+        decode: Callable[[int], str | None],
+    ) -> None:
+        self.header = header
+        self.columns = dict(zip(header, columns))
+        self.decode = decode
+        self._length = len(columns[0]) if columns else 0
+
+    @classmethod
+    def from_rows(
+        cls,
+        header: list[str],
+        rows: Iterable[Mapping[str, str | None]],
+        pool: StringPool | None = None,
+    ) -> "ColumnarTable":
+        """Store rows, such as those of a `csv.DictReader`, by column."""
+        pool = StringPool() if pool is None else pool
+        intern = pool.intern
+        codes: list[list[int]] = [[] for _ in header]
+        with pool.lock:
+            for row in rows:
+                for column, field in zip(codes, header):
+                    column.append(intern(row.get(field)))
+            typecode = _typecode(len(pool))
+
+        columns = [array(typecode, column) for column in codes]
+        return cls(header, columns, pool.values.__getitem__)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("row index out of range")
+        return ColumnarRow(self, index)
+
+    def column(self, field: str) -> list[str | None]:
+        """All values of one field, in row order."""
+        decode = self.decode
+        return [decode(code) for code in self.columns[field]]
+
+
+class ColumnarRow(Mapping[str, str]):
+    """A single row of a `ColumnarTable`, like a `csv.DictReader` row."""
+
+    __slots__ = ("table", "index")
+
+    def __init__(self, table: ColumnarTable, index: int) -> None:
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, field: str) -> str:
+        table = self.table
+        return table.decode(table.columns[field][self.index])  # type: ignore[return-value]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.table.header)
+
+    def __len__(self) -> int:
+        return len(self.table.header)
+
+    def __repr__(self) -> str:
+        return f"ColumnarRow({dict(self)!r})"
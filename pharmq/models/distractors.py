@@ -0,0 +1,312 @@
+"""Hard distractors: wrong answers whose rows read like the right one's.
+
+Uniformly drawn wrong answers are usually easy to rule out. `SimilarAnswers`
+ranks, once per version of each data file, every answer of a category by how
+much its characteristics look like every other answer's, and keeps the `K`
+most similar. A question then draws its wrong answers from that short list
+with one lookup.
+
+Similarity is the cosine of TF-IDF weighted character trigrams, which works
+the same for English and Chinese text. It is computed with NumPy over the
+sparse vectors, a block of answers at a time, pairing up only answers that
+share a trigram, and saved in a `<category>.similar.npz` file next to the CSV
+file it was computed from.
+
+Needs NumPy, from the `batch` extra.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Sequence
+
+from .search import fold
+
+if TYPE_CHECKING:
+    import numpy as np
+
+    from .quiz import QuizGenerator
+
+DISTRACTORS_ENV = "PHARMQ_DISTRACTORS"
+"""Set to "similar" by `serve --distractors similar` for the sessions."""
+
+CROSS_CATEGORY_ENV = "PHARMQ_CROSS_CATEGORY"
+"""Set to "1" by `serve --cross-category` for the sessions."""
+
+VERSION = 1
+"""Bumped when rankings change, so cached ones are computed again."""
+
+PAIR_CHUNK = 1 << 22
+"""Characters, or pairs of postings, that `top_similar` handles at once."""
+
+
+class SimilarAnswers:
+    """The most similar other answers of every answer, per category."""
+
+    K = 6
+    """Similar answers kept per answer: twice the wrong options of a question,
+    so questions about the same answer still vary."""
+
+    MAX_DF = 64
+    """Trigrams in more answers than this are too common to tell them apart."""
+
+    def __init__(self, data_dir: str | os.PathLike | None = None) -> None:
+        """
+        Args:
+            data_dir: Where the CSV files are, to cache the rankings next to
+                them, or None to compute them in memory every time.
+        """
+        self.data_dir = None if data_dir is None else Path(data_dir)
+        self._lock = threading.Lock()
+        # category -> (answer code -> position, position -> similar answer codes)
+        self._similar: dict[str, tuple[dict[int, int], "np.ndarray"]] = {}
+
+    def similar(
+        self, generator: "QuizGenerator", category_name: str, answer: int
+    ) -> Sequence[int]:
+        """Codes of the answers most like `answer`, most similar first."""
+        ranking = self._similar.get(category_name)
+        if ranking is None:
+            with self._lock:
+                ranking = self._similar.get(category_name)
+                if ranking is None:
+                    ranking = self._similar[category_name] = self._rank(
+                        generator, category_name
+                    )
+        positions, similar = ranking
+        position = positions.get(answer)
+        if position is None:  # a ranking of data being reloaded
+            return []
+        codes = similar[position]
+        return codes[codes >= 0].tolist()
+
+    def prepare(self, generator: "QuizGenerator") -> None:
+        """Rank the answers of all categories now, rather than on first use."""
+        for category_name, answers in list(generator.answers.items()):
+            if answers:
+                self.similar(generator, category_name, answers[0])
+
+    def forget(self, category_name: str) -> None:
+        """Drop the ranking of a category that was reloaded or removed."""
+        self._similar.pop(category_name, None)
+
+    def _rank(
+        self, generator: "QuizGenerator", category_name: str
+    ) -> tuple[dict[int, int], "np.ndarray"]:
+        import numpy as np
+
+        answers = generator.answers[category_name]
+        documents = answer_documents(generator, category_name)
+        path = self.cache_path(category_name)
+        digest = self._digest(generator, category_name, documents)
+        neighbors = self._load(path, digest, len(answers))
+        if neighbors is None:
+            neighbors = top_similar(documents, self.K, self.MAX_DF)
+            if path is not None:
+                self._save(path, digest, neighbors)
+
+        codes = np.asarray(answers, dtype=np.int64)
+        similar = np.where(neighbors >= 0, codes[neighbors], -1)
+        return {code: i for i, code in enumerate(answers)}, similar
+
+    def cache_path(self, category_name: str) -> Path | None:
+        """Where the ranking of a category is saved, if anywhere."""
+        if self.data_dir is None:
+            return None
+        return self.data_dir / f"{category_name}.similar.npz"
+
+    def _digest(
+        self, generator: "QuizGenerator", category_name: str, documents: list[str]
+    ) -> bytes:
+        """A hash of everything the ranking depends on, to tell if it is stale."""
+        decode = generator.tables[category_name].decode
+        digest = hashlib.sha256(f"{VERSION}:{self.K}:{self.MAX_DF}".encode())
+        for answer, document in zip(generator.answers[category_name], documents):
+            digest.update(f"\0{decode(answer)}\0{document}".encode())
+        return digest.digest()
+
+    def _load(self, path: Path | None, digest: bytes, n_answers: int):
+        if path is None:
+            return None
+        import numpy as np
+
+        try:
+            with np.load(path) as cached:
+                if cached["digest"].tobytes() != digest:
+                    return None
+                neighbors = cached["neighbors"]
+        except (OSError, KeyError, ValueError):
+            return None
+        if neighbors.shape != (n_answers, self.K):
+            return None
+        return neighbors
+
+    def _save(self, path: Path, digest: bytes, neighbors: "np.ndarray") -> None:
+        import numpy as np
+
+        # Unique per writer, as session processes may compute it at once
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp.npz")
+        try:
+            np.savez(
+                tmp_path, digest=np.frombuffer(digest, np.uint8), neighbors=neighbors
+            )
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error saving similar answers to {path}: {e}")
+
+
+def distractor_options() -> dict:
+    """`QuizGenerator` arguments for drawing wrong answers as `serve` was told."""
+    options: dict = {"cross_category": os.environ.get(CROSS_CATEGORY_ENV) == "1"}
+    if os.environ.get(DISTRACTORS_ENV) == "similar":
+        from ..utils.data_loader import DATA_DIR
+
+        options["similar_answers"] = SimilarAnswers(DATA_DIR)
+    return options
+
+
+def answer_documents(generator: "QuizGenerator", category_name: str) -> list[str]:
+    """What the rows of each answer say, as one text per answer."""
+    category = generator.categories[category_name]
+    table = generator.tables[category_name]
+    decode = table.decode
+    columns = [table.columns[field] for field in category.fields]
+    answer_rows = generator.answer_rows[category_name]
+
+    documents = []
+    for answer in generator.answers[category_name]:
+        values = (
+            decode(column[row]) for row in answer_rows[answer] for column in columns
+        )
+        text = " ".join(value for value in values if value)
+        documents.append(re.sub(r"\s+", " ", fold(text)))
+    return documents
+
+
+def top_similar(documents: list[str], k: int, max_df: int = SimilarAnswers.MAX_DF):
+    """The `k` most similar other documents of each, by TF-IDF trigram cosine.
+
+    Returns an (n, k) int32 array of document positions, most similar first,
+    padded with -1 where a document shares no useful trigram with another.
+    """
+    import numpy as np
+
+    n = len(documents)
+    neighbors = np.full((n, k), -1, dtype=np.int32)
+    doc, term, weight, df = _trigram_vectors(documents)
+
+    # Only trigrams shared by a few documents pair them up
+    keep = (df[term] >= 2) & (df[term] <= max_df)
+    doc, term, weight = doc[keep], term[keep], weight[keep]
+    if not len(doc):
+        return neighbors
+
+    # Postings: the documents of each trigram, and its weight in each
+    by_term = np.argsort(term, kind="stable")
+    posting_doc, posting_weight = doc[by_term], weight[by_term]
+    term_start = np.searchsorted(term[by_term], np.arange(len(df)))
+
+    # Documents are scored a block at a time against all others, with blocks
+    # sized so that each pairs up about `PAIR_CHUNK` postings. Entries are in
+    # document order, so a block is a slice of them
+    pairings = df[term]
+    work = np.cumsum(np.bincount(doc, weights=pairings, minlength=n))
+    doc_ends = np.searchsorted(work, np.arange(PAIR_CHUNK, work[-1], PAIR_CHUNK))
+    entry_ends = np.searchsorted(doc, doc_ends)
+    for start, end in zip([0, *entry_ends.tolist()], [*entry_ends.tolist(), len(doc)]):
+        if start == end:
+            continue
+        counts = pairings[start:end]
+        offsets = np.cumsum(counts) - counts
+        postings = np.repeat(term_start[term[start:end]] - offsets, counts)
+        postings += np.arange(len(postings))
+        source = np.repeat(doc[start:end], counts).astype(np.int64)
+        target = posting_doc[postings]
+        scores = np.repeat(weight[start:end], counts) * posting_weight[postings]
+        other = source != target
+        keys, inverse = np.unique(
+            source[other] * n + target[other], return_inverse=True
+        )
+        scores = np.bincount(inverse, weights=scores[other])
+        source, target = keys // n, keys % n
+
+        # Best first for every document. Cosines are in [0, 1], so they sort
+        # as 32-bit fractions below the document; ties stay in target order
+        fraction = ((1 - np.clip(scores, 0, 1)) * 0xFFFFFFFF).astype(np.int64)
+        order = np.argsort(source << 32 | fraction, kind="stable")
+        source, target = source[order], target[order]
+        rank = np.arange(len(source)) - np.searchsorted(source, source)
+        best = rank < k
+        neighbors[source[best], rank[best]] = target[best]
+    return neighbors
+
+
+def _trigram_counts(documents: list[str]):
+    """How often each trigram is in each document, in runs of documents.
+
+    Trigrams are hashed to 32 bits, which merges the odd pair of trigrams but
+    lets a (document, trigram) entry be sorted as a single integer. Runs are
+    about `PAIR_CHUNK` characters long, so the per-character arrays stay
+    small. Yields (document, trigram hash, count) entries in document order.
+    """
+    import numpy as np
+
+    start = 0
+    while start < len(documents):
+        end, size = start, 0
+        while end < len(documents) and (end == start or size < PAIR_CHUNK):
+            size += len(documents[end]) + 1
+            end += 1
+        run = documents[start:end]
+
+        text = "\0".join(run) + "\0"
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        lengths = np.fromiter((len(document) + 1 for document in run), np.int64)
+        position_doc = np.repeat(np.arange(len(run), dtype=np.int64), lengths)
+
+        # Three 21-bit code points, then the top bits of a multiplicative hash
+        grams = codes[:-2].astype(np.uint64) << np.uint64(42)
+        grams |= codes[1:-1].astype(np.uint64) << np.uint64(21)
+        grams |= codes[2:]
+        grams *= np.uint64(0x9E3779B97F4A7C15)
+        grams >>= np.uint64(32)
+        # Trigrams across the separator between two documents do not count
+        valid = (codes[:-2] != 0) & (codes[1:-1] != 0) & (codes[2:] != 0)
+        entries = position_doc[:-2][valid] << 32 | grams[valid].astype(np.int64)
+
+        entries.sort()
+        first = np.flatnonzero(np.diff(entries, prepend=-1))
+        tf = np.diff(first, append=len(entries))
+        entries = entries[first]
+        yield (
+            (entries >> 32).astype(np.int32) + start,
+            (entries & 0xFFFFFFFF).astype(np.uint32),
+            tf.astype(np.int32),
+        )
+        start = end
+
+
+def _trigram_vectors(documents: list[str]):
+    """Unit-length TF-IDF trigram vectors as (doc, term, weight) entries, and
+    the number of documents with each term."""
+    import numpy as np
+
+    runs = list(_trigram_counts(documents))
+    empty = np.zeros(0, np.int32)
+    doc = np.concatenate([run[0] for run in runs] or [empty])
+    grams = np.concatenate([run[1] for run in runs] or [empty.astype(np.uint32)])
+    tf = np.concatenate([run[2] for run in runs] or [empty])
+    del runs
+
+    vocabulary = np.sort(grams)
+    vocabulary = vocabulary[np.diff(vocabulary, prepend=vocabulary[:1] + 1) != 0]
+    term = np.searchsorted(vocabulary, grams).astype(np.int32)
+    del grams
+
+    df = np.bincount(term, minlength=len(vocabulary))
+    idf = np.log((1 + len(documents)) / (1 + df)) + 1
+    weight = (1 + np.log(tf)) * idf[term]
+    norm = np.sqrt(np.bincount(doc, weights=weight**2, minlength=len(documents)))
+    return doc, term, weight / norm[doc], df
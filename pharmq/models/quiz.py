@@ -1,8 +1,16 @@
 import random
+import threading
 from dataclasses import dataclass
-from typing import List, Tuple
+from typing import TYPE_CHECKING, List, Sequence
 
+from ..utils.metrics import timed
 from .category import Category
+from .columnar import ColumnarTable
+
+if TYPE_CHECKING:
+    import numpy as np
+
+    from .distractors import SimilarAnswers
 
 
 @dataclass
@@ -30,49 +38,222 @@ class QuizQuestion:
 class QuizGenerator:
     """Quiz generation logic."""
 
-    def __init__(self, categories: dict[str, Category]):
+    def __init__(
+        self,
+        categories: dict[str, Category],
+        similar_answers: "SimilarAnswers | None" = None,
+        cross_category: bool = False,
+        rng: random.Random | None = None,
+    ):
+        """
+        Args:
+            categories: The categories to ask about.
+            similar_answers: Rankings to draw hard wrong answers from, or None
+                to draw wrong answers uniformly.
+            cross_category: Whether categories with too few answers for
+                distinct options borrow wrong answers from other categories.
+            rng: Where random choices come from, or None for a fresh
+                `random.Random()`. For the same data, questions depend only
+                on its state, so seeding it, or saving and restoring it with
+                `getstate` and `setstate`, replays them exactly. Callers that
+                share a generator, such as sessions, pass their own `rng` to
+                each call instead.
+        """
         self.categories = categories
+        self.similar_answers = similar_answers
+        self.cross_category = cross_category
+        self.rng = random.Random() if rng is None else rng
+        # Held while a question is generated and while reloaded data is
+        # swapped in, so threads sharing the generator never see half of a
+        # reload. Reentrant, as generating calls the other public methods
+        self.lock = threading.RLock()
 
-    def generate_question(
+        # Indexes built once, so a question costs the same for any deck size.
+        # Answers are string codes of the category's table, so comparing two
+        # answers compares integers
+        self.category_names: list[str] = list(categories)
+        self.tables: dict[str, ColumnarTable] = {}  # category -> coded rows
+        self.answers: dict[str, list[int]] = {}  # category -> distinct answers
+        self.answer_rows: dict[str, dict[int, list[int]]] = {}  # answer -> rows
+        self._batch_index: dict[str, "BatchIndex"] = {}  # for `generate_batch`
+        self._answer_index: "AnswerIndex | None" = None  # for `cross_category`
+        for category_name in self.category_names:
+            self.index_category(category_name)
+
+    def index_category(self, category_name: str) -> None:
+        """Build the answer indexes of a category."""
+        category = self.categories[category_name]
+        table = category.data
+        if not isinstance(table, ColumnarTable):
+            table = ColumnarTable.from_rows(
+                [category.answer_field, *category.fields], table
+            )
+
+        answer_rows: dict[int, list[int]] = {}
+        for idx, answer in enumerate(table.columns[category.answer_field]):
+            answer_rows.setdefault(answer, []).append(idx)
+
+        self.tables[category_name] = table
+        self.answer_rows[category_name] = answer_rows
+        self.answers[category_name] = list(answer_rows)
+        self._batch_index.pop(category_name, None)
+
+    def apply_changes(
+        self, changed: dict[str, Category], removed: Sequence[str] = ()
+    ) -> None:
+        """Swap in reloaded categories, re-indexing only those that changed."""
+        with self.lock:
+            # Rankings are of the old answers, and are ranked again on use
+            if self.similar_answers is not None:
+                for category_name in [*removed, *changed]:
+                    self.similar_answers.forget(category_name)
+
+            for category_name in removed:
+                self.categories.pop(category_name, None)
+                self.tables.pop(category_name, None)
+                self.answer_rows.pop(category_name, None)
+                self.answers.pop(category_name, None)
+                self._batch_index.pop(category_name, None)
+
+            self.categories.update(changed)
+            for category_name in changed:
+                self.index_category(category_name)
+            self.category_names = list(self.categories)
+
+    def has_row(self, category_name: str, row_idx: int) -> bool:
+        """Whether a row is in the data, e.g. a card scheduled before a reload."""
+        category = self.categories.get(category_name)
+        return category is not None and 0 <= row_idx < len(category.data)
+
+    def sample_distractors(
+        self,
+        category_name: str,
+        answer: int,
+        k: int,
+        rng: random.Random | None = None,
+    ) -> list[int]:
+        """Pick codes of `k` wrong answers from a category, distinct if possible.
+
+        With `similar_answers`, they are drawn from the answers most similar
+        to the right one first, so they are harder to rule out.
+        """
+        rng = self.rng if rng is None else rng
+        answers = self.answers[category_name]
+
+        if len(answers) - 1 >= k:
+            chosen: list[int] = []
+            if self.similar_answers is not None:
+                similar = self.similar_answers.similar(self, category_name, answer)
+                chosen = rng.sample(similar, min(k, len(similar)))
+
+            # Rejection sampling: with at least k other answers, this takes a
+            # bounded expected number of draws, whatever the deck size
+            while len(chosen) < k:
+                candidate = rng.choice(answers)
+                if candidate != answer and candidate not in chosen:
+                    chosen.append(candidate)
+            return chosen
+
+        # If not enough unique options, allow duplicates
+        others = [candidate for candidate in answers if candidate != answer]
+        return others + rng.choices(others or [answer], k=k - len(others))
+
+    def answer_index(self) -> "AnswerIndex":
+        """The distinct answers of all categories, built once per dataset."""
+        index = self._answer_index
+        # `apply_changes` replaces `category_names`, which makes the index stale
+        if index is None or index.category_names is not self.category_names:
+            index = AnswerIndex(self.category_names, [], {}, [])
+            for category_name in index.category_names:
+                decode = self.tables[category_name].decode
+                for code in self.answers[category_name]:
+                    text = decode(code)
+                    if not text:
+                        continue
+                    answer_id = index.ids.get(text)
+                    if answer_id is None:
+                        answer_id = index.ids[text] = len(index.texts)
+                        index.texts.append(text)
+                        index.sources.append([])
+                    index.sources[answer_id].append((category_name, code))
+            self._answer_index = index
+        return index
+
+    def sample_other_categories(
+        self, exclude: set[str], k: int, rng: random.Random | None = None
+    ) -> list[tuple[str, int]]:
+        """Pick `k` wrong answers from all categories, distinct if possible.
+
+        Answers are drawn from `answer_index` rather than category by
+        category, so this costs the same however many categories there are.
+        Returns (category, answer code) pairs, none of whose texts are in
+        `exclude`, and fewer than `k` if there are not that many answers.
+        """
+        rng = self.rng if rng is None else rng
+        index = self.answer_index()
+        texts = index.texts
+        eligible = len(texts) - sum(text in index.ids for text in exclude)
+
+        if eligible > k:
+            # Rejection sampling, as in `sample_distractors`
+            picked: list[int] = []
+            while len(picked) < k:
+                answer_id = rng.randrange(len(texts))
+                if answer_id not in picked and texts[answer_id] not in exclude:
+                    picked.append(answer_id)
+        else:
+            picked = [i for i, text in enumerate(texts) if text not in exclude]
+
+        # An answer of several categories is shown as from one of them
+        return [rng.choice(index.sources[answer_id]) for answer_id in picked]
+
+    def available_categories(
         self, selected_categories: set[str] | None = None
-    ) -> QuizQuestion:
-        """Generate a new question from available categories."""
-        # Filter categories
+    ) -> list[str]:
+        """Names of the selected categories, or of all if none are selected."""
         available_categories = (
-            set(self.categories.keys())
+            self.category_names
             if selected_categories is None
-            else selected_categories & set(self.categories.keys())
+            else [name for name in self.category_names if name in selected_categories]
         )
-        if not available_categories:
-            available_categories = set(self.categories.keys())
+        return available_categories or self.category_names
 
-        # Select random category
-        category_name: str = random.choice(list(available_categories))
-        category: Category = self.categories[category_name]
+    @timed("pharmq_generate_question_seconds", "Time to generate a random question")
+    def generate_question(
+        self,
+        selected_categories: set[str] | None = None,
+        rng: random.Random | None = None,
+    ) -> QuizQuestion:
+        """Generate a new question from available categories."""
+        rng = self.rng if rng is None else rng
+        with self.lock:
+            # Select random category
+            category_name: str = rng.choice(
+                self.available_categories(selected_categories)
+            )
 
-        # # Select random row
-        # answer_column: str = category.data.columns[0]
-        # df: pd.DataFrame = category.data
-        # row_idx: int = df.sample(n=1).index[0]
-        # row: pd.Series = df.iloc[row_idx]
-        # answer: str = str(row[answer_column])
-
-        # # Generate incorrect options
-        # other_indices: List[int] = df[df[answer_column] != answer].index.tolist()
-
-        # Select random row
-        data: list[dict[str, str]] = category.data
-        answer_field: str = category.answer_field
-        row_idx: int = random.randrange(len(data))
-        row: dict[str, str] = data[row_idx]
-        answer: str = row[answer_field]
-
-        # Generate incorrect options
-        other_indices: List[int] = [
-            idx
-            for idx, r in enumerate(data)
-            if idx != row_idx and r[answer_field] != answer
-        ]
+            # Select random row
+            row_idx: int = rng.randrange(len(self.categories[category_name].data))
+            return self.question_for(category_name, row_idx, rng)
+
+    @timed("pharmq_question_for_seconds", "Time to generate a scheduled question")
+    def question_for(
+        self, category_name: str, row_idx: int, rng: random.Random | None = None
+    ) -> QuizQuestion:
+        """Generate the question asking for the answer of a given row."""
+        with self.lock:
+            return self._question_for(category_name, row_idx, rng)
+
+    def _question_for(
+        self, category_name: str, row_idx: int, rng: random.Random | None
+    ) -> QuizQuestion:
+        rng = self.rng if rng is None else rng
+        category: Category = self.categories[category_name]
+        table = self.tables[category_name]
+        decode = table.decode
+        answer_code: int = table.columns[category.answer_field][row_idx]
+        answer = decode(answer_code)
+        assert answer is not None
 
         # Create options
         options: List[QuizOption] = [
@@ -85,40 +266,247 @@ class QuizGenerator:
         ]
 
         # Add incorrect options
-        if len(other_indices) >= 3:
-            selected_indices = random.sample(other_indices, 3)
-        else:
-            # If not enough unique options, allow duplicates
-            selected_indices = other_indices + random.choices(
-                other_indices or [row_idx], k=3 - len(other_indices)
+        n_others = len(self.answers[category_name]) - 1
+        if self.cross_category and n_others < 3:
+            # All other answers of this category, and the rest from others
+            codes = self.sample_distractors(category_name, answer_code, n_others, rng)
+            wrong = [(category_name, code) for code in codes]
+            exclude = {answer, *(decode(code) or "" for code in codes)}
+            wrong += self.sample_other_categories(exclude, 3 - n_others, rng)
+            # Too few answers in the whole dataset: repeat some
+            wrong += rng.choices(
+                wrong or [(category_name, answer_code)], k=3 - len(wrong)
             )
+        else:
+            codes = self.sample_distractors(category_name, answer_code, 3, rng)
+            wrong = [(category_name, code) for code in codes]
 
-        for idx in selected_indices:
+        for option_category, code in wrong:
+            option_table = self.tables[option_category]
             options.append(
                 QuizOption(
-                    # text=str(df.iloc[idx][answer_column]),
-                    text=str(data[row_idx][answer_field]),
-                    category_name=category_name,
-                    row_index=idx,
+                    text=option_table.decode(code),  # type: ignore[arg-type]
+                    category_name=option_category,
+                    row_index=rng.choice(self.answer_rows[option_category][code]),
                     is_correct=False,
                 )
             )
 
         # Shuffle options
-        random.shuffle(options)
+        rng.shuffle(options)
 
         answer_index = next(i for i, option in enumerate(options) if option.is_correct)
 
-        # Get characteristics for the question
-        characteristics = {
-            field: str(row[field]) for field in category.fields if row[field]
-        }
-
         return QuizQuestion(
             category_name=category_name,
             row_index=row_idx,
             answer=answer,
             answer_index=answer_index,
             options=options,
-            characteristics=characteristics,
+            characteristics=self.characteristics(category_name, row_idx),
         )
+
+    def characteristics(self, category_name: str, row_idx: int) -> dict[str, str]:
+        """The non-empty fields of a row, which the question asks about."""
+        category = self.categories[category_name]
+        table = self.tables[category_name]
+        characteristics = {}
+        for field in category.fields:
+            value = table.decode(table.columns[field][row_idx])
+            if value:
+                characteristics[field] = str(value)
+        return characteristics
+
+    def generate_batch(
+        self,
+        n: int,
+        seed: int | None = None,
+        categories: set[str] | None = None,
+    ) -> "QuestionBatch":
+        """Generate `n` questions at once with NumPy.
+
+        Rows, distractors and shuffles are drawn as arrays over integer-coded
+        answers, so this is much faster than calling `generate_question` in a
+        loop. Questions follow the same distribution, but the random streams
+        differ, so the same seed does not give the same questions.
+        """
+        import numpy as np
+
+        rng = np.random.default_rng(seed)
+
+        available_categories = self.available_categories(categories)
+
+        batch = np.zeros(n, dtype=QUESTION_DTYPE)
+        picked = rng.integers(len(available_categories), size=n)
+
+        for i, category_name in enumerate(available_categories):
+            (where,) = np.nonzero(picked == i)
+            if not len(where):
+                continue
+            index = self.batch_index(category_name)
+
+            rows = rng.integers(len(index.row_answers), size=len(where))
+            answers = index.row_answers[rows]
+            distractors = _sample_distractors(rng, answers, len(index.answer_counts))
+
+            options = np.empty((len(where), 4), dtype=np.int32)
+            options[:, 0] = answers
+            options[:, 1:] = distractors
+            option_rows = np.empty_like(options)
+            option_rows[:, 0] = rows
+            option_rows[:, 1:] = index.answer_order[
+                index.answer_starts[distractors]
+                + rng.integers(0, index.answer_counts[distractors])
+            ]
+
+            batch["category"][where] = self.category_names.index(category_name)
+            batch["row"][where] = rows
+            batch["options"][where] = options
+            batch["option_rows"][where] = option_rows
+
+        # Shuffle options: the correct answer starts in column 0
+        order = rng.random((n, 4)).argsort(axis=1)
+        batch["options"] = np.take_along_axis(batch["options"], order, axis=1)
+        batch["option_rows"] = np.take_along_axis(batch["option_rows"], order, axis=1)
+        batch["answer_index"] = np.argmin(order, axis=1)
+
+        return QuestionBatch(self, batch)
+
+    def batch_index(self, category_name: str) -> "BatchIndex":
+        """Integer-coded answer index of a category, built on first use."""
+        if category_name not in self._batch_index:
+            import numpy as np
+
+            answers = self.answers[category_name]
+            codes = {answer: code for code, answer in enumerate(answers)}
+            answer_rows = self.answer_rows[category_name]
+
+            row_answers = np.empty(
+                sum(len(rows) for rows in answer_rows.values()), dtype=np.int32
+            )
+            for answer, rows in answer_rows.items():
+                row_answers[rows] = codes[answer]
+
+            # Rows grouped by answer, so rows[starts[a]:starts[a] + counts[a]]
+            # are the rows whose answer is `a`
+            answer_order = np.argsort(row_answers, kind="stable").astype(np.int32)
+            answer_counts = np.bincount(row_answers, minlength=len(answers))
+            answer_starts = np.concatenate(([0], np.cumsum(answer_counts)[:-1]))
+
+            self._batch_index[category_name] = BatchIndex(
+                row_answers, answer_order, answer_starts, answer_counts
+            )
+        return self._batch_index[category_name]
+
+
+@dataclass
+class AnswerIndex:
+    """Distinct answer texts of all categories, each tagged with where it is."""
+
+    category_names: list[str]  # the categories indexed
+    texts: list[str]  # answer id -> text
+    ids: dict[str, int]  # text -> answer id
+    sources: list[list[tuple[str, int]]]  # answer id -> (category, answer code)
+
+
+@dataclass
+class BatchIndex:
+    """Integer-coded answers of one category, for `generate_batch`."""
+
+    row_answers: "np.ndarray"  # row -> answer code
+    answer_order: "np.ndarray"  # rows sorted by answer code
+    answer_starts: "np.ndarray"  # answer code -> offset into answer_order
+    answer_counts: "np.ndarray"  # answer code -> number of rows
+
+
+QUESTION_DTYPE = [
+    ("category", "i4"),  # index into QuizGenerator.category_names
+    ("row", "i4"),
+    ("answer_index", "i1"),
+    ("options", "i4", (4,)),  # answer codes, index into QuizGenerator.answers
+    ("option_rows", "i4", (4,)),
+]
+
+
+class QuestionBatch(Sequence[QuizQuestion]):
+    """A batch of questions stored as a structured array.
+
+    `array` holds one compact record per question; indexing the batch turns a
+    record into a `QuizQuestion` only when it is needed.
+    """
+
+    def __init__(self, generator: QuizGenerator, array: "np.ndarray") -> None:
+        self.generator = generator
+        self.array = array
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return QuestionBatch(self.generator, self.array[index])
+        return self.question(self.array[index])
+
+    def question(self, record) -> QuizQuestion:
+        """Build the `QuizQuestion` for one record of the array."""
+        generator = self.generator
+        category_name = generator.category_names[record["category"]]
+        category = generator.categories[category_name]
+        table = generator.tables[category_name]
+        answers = generator.answers[category_name]
+
+        row_idx = int(record["row"])
+        answer_index = int(record["answer_index"])
+        answer = table.decode(table.columns[category.answer_field][row_idx])
+
+        options = [
+            QuizOption(
+                text=table.decode(answers[code]),  # type: ignore[arg-type]
+                category_name=category_name,
+                row_index=int(option_row),
+                is_correct=i == answer_index,
+            )
+            for i, (code, option_row) in enumerate(
+                zip(record["options"], record["option_rows"])
+            )
+        ]
+
+        return QuizQuestion(
+            category_name=category_name,
+            row_index=row_idx,
+            answer=answer,  # type: ignore[arg-type]
+            answer_index=answer_index,
+            options=options,
+            characteristics=generator.characteristics(category_name, row_idx),
+        )
+
+
+def _sample_distractors(rng, answers: "np.ndarray", n_answers: int) -> "np.ndarray":
+    """Draw 3 wrong answer codes per correct answer, distinct if possible.
+
+    Each draw is uniform over the codes not taken yet, shifted past the taken
+    ones in ascending order, which is exact sampling without replacement.
+    Categories with fewer than 4 distinct answers repeat wrong answers, like
+    `QuizGenerator.sample_distractors`.
+    """
+    import numpy as np
+
+    m = len(answers)
+    if n_answers == 1:
+        return np.repeat(answers[:, None], 3, axis=1)
+
+    if n_answers < 4:
+        # Every other answer once, then random repeats
+        others = np.arange(n_answers - 1)[None, :]
+        others = others + (others >= answers[:, None])
+        extra = rng.integers(n_answers - 1, size=(m, 4 - n_answers))
+        extra += extra >= answers[:, None]
+        return np.concatenate([others, extra], axis=1).astype(np.int32)
+
+    taken = answers[:, None].astype(np.int64)
+    for k in range(3):
+        draw = rng.integers(n_answers - 1 - k, size=m)
+        for column in np.sort(taken, axis=1).T:
+            draw += draw >= column
+        taken = np.concatenate([taken, draw[:, None]], axis=1)
+    return taken[:, 1:].astype(np.int32)
@@ -0,0 +1,200 @@
+import heapq
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Iterable
+
+from .category import Category
+
+if TYPE_CHECKING:
+    from ..utils.progress import Answer
+
+DAY = 24 * 60 * 60
+
+
+@dataclass
+class CardState:
+    """SM-2 review state of one row."""
+
+    ease: float = 2.5
+    interval: float = 0.0  # days
+    repetitions: int = 0
+    due: float = 0.0  # timestamp
+
+
+class Scheduler:
+    """Spaced-repetition scheduling of rows with SM-2.
+
+    Every category keeps a heap of its seen rows ordered by due time, and
+    one of the rows never seen in random order, built the first time the
+    category is drawn from. `next_card` pops the most overdue row of the
+    selected categories, or a new row if none is due yet, and `review`
+    pushes it back with its next due time, so both are O(log n) in the deck
+    size. Once there are no new rows left, rows are asked ahead of time,
+    soonest due first.
+
+    Cards are popped while they wait to be answered, so questions can be
+    prepared ahead without handing out the same row twice; a card that is
+    dropped unanswered must be given back with `requeue`.
+    """
+
+    RELEARN_DELAY = 60.0
+    """Seconds before a missed card is asked again."""
+
+    def __init__(
+        self,
+        categories: dict[str, Category],
+        clock: Callable[[], float] = time.time,
+        rng: random.Random | None = None,
+    ) -> None:
+        self.categories = categories
+        self.clock = clock
+        self.rng = random.Random() if rng is None else rng  # order of new rows
+
+        self.states: dict[str, dict[int, CardState]] = {}
+        self._heaps: dict[str, list[tuple[float, int, int]]] = {}  # seen rows
+        self._new: dict[str, list[tuple[int, int]]] = {}  # rows never seen
+        self._order: dict[str, int] = {}  # tie-breaker for equal due times
+        self._taken: set[tuple[str, int]] = set()
+        self._lock = threading.Lock()
+
+    def seed(self, answers: Iterable["Answer"]) -> None:
+        """Take in answers given before, such as in earlier sessions, oldest first.
+
+        Must be called before cards are drawn. Answers to rows the categories
+        no longer have are left out.
+        """
+        with self._lock:
+            for answer in answers:
+                category = self.categories.get(answer.category)
+                if category is None or not 0 <= answer.row < len(category.data):
+                    continue
+                state = self.states.setdefault(answer.category, {}).setdefault(
+                    answer.row, CardState()
+                )
+                self._schedule(state, answer.correct, answer.answered_at)
+
+    def _heap(self, category_name: str) -> list[tuple[float, int, int]]:
+        heap = self._heaps.get(category_name)
+        if heap is None:
+            n_rows = len(self.categories[category_name].data)
+            states = self.states.get(category_name, {})
+            rows = self.rng.sample(range(n_rows), n_rows)
+            heap = [
+                (states[row].due, order, row)
+                for order, row in enumerate(rows)
+                if row in states
+            ]
+            heapq.heapify(heap)
+            self._heaps[category_name] = heap
+            # Sorted by order, so already a valid heap
+            self._new[category_name] = [
+                (order, row) for order, row in enumerate(rows) if row not in states
+            ]
+            self._order[category_name] = n_rows
+        return heap
+
+    def next_card(
+        self, category_names: Iterable[str]
+    ) -> tuple[str, int] | None:
+        """Take the most overdue card of the given categories.
+
+        Cards due by now come first, then new cards, taken from the
+        categories in turn, then the cards due soonest. Returns None if every
+        card of these categories is already taken.
+        """
+        now = self.clock()
+        with self._lock:
+            due_name = new_name = None
+            due_entry: tuple[float, int, int] | None = None
+            new_entry: tuple[int, int] | None = None
+            for category_name in category_names:
+                heap = self._heap(category_name)
+                if heap and (due_entry is None or heap[0] < due_entry):
+                    due_name, due_entry = category_name, heap[0]
+                new = self._new[category_name]
+                if new and (new_entry is None or new[0] < new_entry):
+                    new_name, new_entry = category_name, new[0]
+
+            if due_name is not None and (new_name is None or due_entry[0] <= now):
+                _, _, row = heapq.heappop(self._heaps[due_name])
+                card = due_name, row
+            elif new_name is not None:
+                _, row = heapq.heappop(self._new[new_name])
+                card = new_name, row
+            else:
+                return None
+            self._taken.add(card)
+            return card
+
+    def requeue(self, category_name: str, row: int) -> None:
+        """Give back a card that was taken but not answered."""
+        with self._lock:
+            if (category_name, row) not in self._taken:
+                return
+            state = self.states.get(category_name, {}).get(row)
+            if state is None:
+                # Still new, so back among the new cards, last
+                self._taken.discard((category_name, row))
+                self._order[category_name] += 1
+                heapq.heappush(
+                    self._new[category_name], (self._order[category_name], row)
+                )
+            else:
+                self._push(category_name, row, state.due)
+
+    def review(
+        self, category_name: str, row: int, correct: bool
+    ) -> CardState | None:
+        """Record an answer to a taken card and schedule it again.
+
+        Returns the card's new state, or None if the card's category was
+        forgotten since it was taken.
+        """
+        now = self.clock()
+        with self._lock:
+            if (category_name, row) not in self._taken:
+                return None
+            state = self.states.setdefault(category_name, {}).setdefault(
+                row, CardState()
+            )
+            self._schedule(state, correct, now)
+            self._push(category_name, row, state.due)
+            return state
+
+    def _schedule(self, state: CardState, correct: bool, now: float) -> None:
+        """Update a card's state for an answer given at `now`."""
+        quality = 4 if correct else 1
+        if correct:
+            state.repetitions += 1
+            if state.repetitions == 1:
+                state.interval = 1
+            elif state.repetitions == 2:
+                state.interval = 6
+            else:
+                state.interval = round(state.interval * state.ease)
+            state.due = now + state.interval * DAY
+        else:
+            state.repetitions = 0
+            state.interval = 0
+            state.due = now + self.RELEARN_DELAY
+
+        state.ease = max(
+            1.3, state.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)
+        )
+
+    def forget_category(self, category_name: str) -> None:
+        """Drop the schedule of a category, e.g. after its rows changed."""
+        with self._lock:
+            self.states.pop(category_name, None)
+            self._heaps.pop(category_name, None)
+            self._new.pop(category_name, None)
+            self._order.pop(category_name, None)
+            self._taken = {card for card in self._taken if card[0] != category_name}
+
+    def _push(self, category_name: str, row: int, due: float) -> None:
+        self._taken.discard((category_name, row))
+        self._order[category_name] += 1
+        entry = (due, self._order[category_name], row)
+        heapq.heappush(self._heaps[category_name], entry)
@@ -0,0 +1,384 @@
+"""Inverted full-text index over every cell of every category.
+
+The data mixes English and Chinese, so text is split two ways. Runs of
+Latin letters and digits become words, which a query matches by prefix, so
+results narrow as a word is typed. Runs of CJK characters have no spaces to
+split on, so they are indexed as single characters and as bigrams, and a
+query matches them as a substring.
+
+The index is built over distinct values rather than cells: each value is
+tokenized once however many rows repeat it. A query finds the matching
+values first, and only then the rows that hold them.
+"""
+
+import re
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Dict, Iterable, Iterator, NamedTuple, Sequence
+
+from .category import Category
+
+# Kana, CJK ideographs and Hangul
+CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+TOKEN_RE = re.compile(f"([{CJK}]+)|([^\\W_{CJK}]+)")
+CJK_RE = re.compile(f"[{CJK}]")
+
+
+def fold(text: str) -> str:
+    """Normalize text for matching: full-width forms and case are ignored."""
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+class Term(NamedTuple):
+    """One part of a query."""
+
+    text: str
+    cjk: bool  # a CJK run matched as a substring, or else a word prefix
+
+
+def parse_query(query: str) -> list[Term]:
+    """Split a query into terms, all of which a row has to match."""
+    terms = []
+    for cjk, word in TOKEN_RE.findall(fold(query)):
+        term = Term(cjk, True) if cjk else Term(word, False)
+        if term not in terms:
+            terms.append(term)
+    return terms
+
+
+def tokenize(text: str) -> Iterator[str]:
+    """Words, and CJK characters and bigrams, of already folded text."""
+    for cjk, word in TOKEN_RE.findall(text):
+        if word:
+            yield word
+            continue
+        yield from cjk
+        for i in range(len(cjk) - 1):
+            yield cjk[i : i + 2]
+
+
+class SearchResult(NamedTuple):
+    """Matching rows, by category, in data order."""
+
+    rows: dict[str, list[int]]
+    complete: bool  # False if there were more matches than the limit
+
+    def __len__(self) -> int:
+        return sum(len(rows) for rows in self.rows.values())
+
+
+class PrefixMatch:
+    """Values with a word that starts with a prefix, found as they are asked for."""
+
+    def __init__(self, prefix: str, folded: list[str]) -> None:
+        self.pattern = re.compile(rf"(?<![^\W_{CJK}]){re.escape(prefix)}")
+        self.folded = folded
+        self.matches: dict[int, bool] = {}
+
+    def __contains__(self, value_id: int) -> bool:
+        match = self.matches.get(value_id)
+        if match is None:
+            match = self.matches[value_id] = bool(
+                self.pattern.search(self.folded[value_id])
+            )
+        return match
+
+    def __bool__(self) -> bool:
+        return True
+
+
+class SearchIndex:
+    """Rows of all categories by the words and characters in their cells.
+
+    Building takes a while on large decks, so it is done by `build`, which
+    the app calls in a background thread; searching before then waits for
+    it. `apply_changes` marks the index stale after a reload, and the next
+    `build` or search indexes the new data. Sessions of a server can share
+    an index between threads.
+    """
+
+    SCAN_THRESHOLD = 20_000
+    """Rows a term may match before searching scans rows in order instead."""
+
+    PREFIX_VALUES = 20_000
+    """Values a prefix may match before it is matched lazily."""
+
+    def __init__(self, categories: Dict[str, Category]) -> None:
+        self.categories = categories
+        self._lock = threading.Lock()
+        self._version = 0  # bumped on every change to the data
+        self._built_version = -1
+
+    def apply_changes(
+        self, changed: Dict[str, Category], removed: Sequence[str] = ()
+    ) -> None:
+        """Re-index on next use; `categories` is already updated by then."""
+        self._version += 1
+
+    def build(self) -> None:
+        """Index all categories, if not indexed yet."""
+        with self._lock:
+            self._ensure_built()
+
+    def _ensure_built(self) -> None:
+        version = self._version
+        if self._built_version != version:
+            self._build()
+            # Changes made while building are picked up next time
+            self._built_version = version
+
+    def _build(self) -> None:
+        folded: list[str] = []  # value id -> folded text
+        value_ids: dict[str, int] = {}
+        value_rows: list[array] = []  # value id -> global row numbers
+        cells: dict[str, list[array]] = {}  # category -> value ids per field
+        offsets: dict[str, int] = {}  # category -> global number of row 0
+
+        n_rows = 0
+        for category_name, category in list(self.categories.items()):
+            offsets[category_name] = n_rows
+            data = category.data
+            header = [category.answer_field, *category.fields]
+            columns = getattr(data, "columns", None)
+            if columns is None:
+                column_values: Iterable[Iterable] = (
+                    (row[field] for row in data) for field in header
+                )
+                decode = None
+            else:
+                column_values = (columns[field] for field in header)
+                decode = data.decode  # type: ignore[attr-defined]
+
+            fields = []
+            for values in column_values:
+                # Interned tables repeat codes, so each is looked up once
+                local_ids: dict = {}
+                ids = array("I")
+                for row_idx, value in enumerate(values):
+                    value_id = local_ids.get(value)
+                    if value_id is None:
+                        text = value if decode is None else decode(value)
+                        text = fold(text) if text else ""
+                        value_id = value_ids.get(text)
+                        if value_id is None:
+                            value_id = value_ids[text] = len(folded)
+                            folded.append(text)
+                            value_rows.append(array("I"))
+                        local_ids[value] = value_id
+                    ids.append(value_id)
+                    rows = value_rows[value_id]
+                    row = n_rows + row_idx
+                    if not rows or rows[-1] != row:
+                        rows.append(row)
+                fields.append(ids)
+            cells[category_name] = fields
+            n_rows += len(data)
+
+        token_values: dict[str, list[int]] = {}
+        for value_id, text in enumerate(folded):
+            for token in set(tokenize(text)):
+                token_values.setdefault(token, []).append(value_id)
+
+        # Global row numbers come out of `value_rows` unsorted when a value
+        # is in several fields, so the postings of each value are sorted
+        for rows in value_rows:
+            if any(a > b for a, b in zip(rows, rows[1:])):
+                rows[:] = array("I", sorted(set(rows)))
+
+        self.folded = folded
+        self.value_rows = value_rows
+        self.cells = cells
+        self.offsets = offsets
+        self.n_rows = n_rows
+        self.token_values = token_values
+        self.words = sorted(token for token in token_values if not CJK_RE.match(token))
+        # Values of the words before each word, to count a prefix's values
+        self.word_starts = list(
+            accumulate((len(token_values[word]) for word in self.words), initial=0)
+        )
+        self._matches: dict[Term, frozenset[int] | PrefixMatch] = {}
+        self._estimates: dict[Term, int] = {}
+
+    def match_values(self, term: Term) -> "frozenset[int] | PrefixMatch":
+        """The values that contain a term, as a container of value ids.
+
+        Prefixes of many values, such as a single letter, would take long to
+        collect and match most rows anyway, so they are matched lazily value
+        by value instead.
+        """
+        cached = self._matches.get(term)
+        if cached is not None:
+            return cached
+
+        if term.cjk:
+            grams = (
+                [term.text]
+                if len(term.text) == 1
+                else [term.text[i : i + 2] for i in range(len(term.text) - 1)]
+            )
+            postings = sorted(
+                (self.token_values.get(gram, ()) for gram in grams), key=len
+            )
+            candidates = set(postings[0]).intersection(*postings[1:])
+            if len(term.text) > 2:
+                # The bigrams may be spread out, rather than in sequence
+                candidates = {v for v in candidates if term.text in self.folded[v]}
+            matches = frozenset(candidates)
+        else:
+            words = self.words
+            start = bisect_left(words, term.text)
+            end = bisect_left(words, term.text + "\U0010ffff", start)
+            if self.word_starts[end] - self.word_starts[start] > self.PREFIX_VALUES:
+                matches = PrefixMatch(term.text, self.folded)
+            else:
+                matches = frozenset().union(
+                    *(self.token_values[word] for word in words[start:end])
+                )
+
+        if len(self._matches) > 256:
+            self._matches.clear()
+            self._estimates.clear()
+        self._matches[term] = matches
+        return matches
+
+    def search(self, query: str, limit: int = 200) -> SearchResult:
+        """Rows matching every term of a query, at most `limit` of them."""
+        with self._lock:
+            self._ensure_built()
+            return self._search(query, limit)
+
+    def _search(self, query: str, limit: int) -> SearchResult:
+        terms = parse_query(query)
+        if not terms:
+            return SearchResult({}, True)
+
+        # Most selective first, so rows that do not match are ruled out early
+        estimates = {term: self._row_estimate(term) for term in terms}
+        terms.sort(key=estimates.__getitem__)
+        term_values = [self.match_values(term) for term in terms]
+        if not term_values[0]:
+            return SearchResult({}, True)
+
+        # Intersect the rows of the selective terms, and check the others row
+        # by row; a lazily matched prefix has no rows to intersect, however
+        # few the rows of the data
+        selective: list[frozenset[int]] = []
+        checked: list[frozenset[int] | PrefixMatch] = []
+        for term, values in zip(terms, term_values):
+            if estimates[term] <= self.SCAN_THRESHOLD and isinstance(values, frozenset):
+                selective.append(values)
+            else:
+                checked.append(values)
+        term_values = checked
+
+        candidates: Iterable[int]
+        if selective:
+            value_rows = self.value_rows
+            matched: set[int] | None = None
+            for values in selective:
+                term_rows = set().union(*(value_rows[v] for v in values))
+                matched = term_rows if matched is None else matched & term_rows
+            candidates = sorted(matched or ())
+        else:
+            # Every term matches many rows, so matches come early in data order
+            candidates = range(self.n_rows)
+
+        rows: dict[str, list[int]] = {}
+        found = 0
+        locate = self._locator()
+        for row in candidates:
+            category_name, row_idx = locate(row)
+            fields = self.cells[category_name]
+            if all(
+                any(ids[row_idx] in values for ids in fields) for values in term_values
+            ):
+                if found == limit:
+                    return SearchResult(rows, False)
+                rows.setdefault(category_name, []).append(row_idx)
+                found += 1
+        return SearchResult(rows, True)
+
+    def _row_estimate(self, term: Term) -> int:
+        """An upper bound on the rows matching a term, capped cheaply."""
+        estimate = self._estimates.get(term)
+        if estimate is not None:
+            return estimate
+
+        values = self.match_values(term)
+        if isinstance(values, PrefixMatch):
+            estimate = self.n_rows
+        else:
+            estimate = 0
+            value_rows = self.value_rows
+            for value_id in values:
+                estimate += len(value_rows[value_id])
+                if estimate > self.SCAN_THRESHOLD:
+                    break
+        self._estimates[term] = estimate
+        return estimate
+
+    def _locator(self):
+        """A function from global row numbers to (category, row) pairs."""
+        starts = sorted((offset, name) for name, offset in self.offsets.items())
+        offsets = [offset for offset, _ in starts]
+
+        def locate(row: int) -> tuple[str, int]:
+            offset, name = starts[bisect_left(offsets, row + 1) - 1]
+            return name, row - offset
+
+        return locate
+
+    def highlighter(self, query: str) -> re.Pattern | None:
+        """A pattern for the parts of cell text that matched a query.
+
+        The pattern matches folded text, as the index does; `match_spans`
+        finds where it matches in the text as shown.
+        """
+        terms = parse_query(query)
+        if not terms:
+            return None
+        parts = [
+            re.escape(term.text)
+            if term.cjk
+            else rf"(?<![^\W_{CJK}]){re.escape(term.text)}"
+            for term in sorted(terms, key=lambda term: -len(term.text))
+        ]
+        return re.compile("|".join(parts))
+
+
+def match_spans(pattern: re.Pattern, text: str) -> list[tuple[int, int]]:
+    """Where a `highlighter` pattern matches the folded form of `text`.
+
+    Folding can change the length of text, e.g. "\ufb01" becomes "fi", so
+    the text is folded a character at a time, along with any combining
+    marks after it, and each match is widened to the characters it was
+    folded from.
+    """
+    if text.isascii():
+        # Folding only lowers the case, so the offsets stay the same
+        return [
+            match.span()
+            for match in pattern.finditer(text.lower())
+            if match.end() > match.start()
+        ]
+
+    parts: list[str] = []
+    starts: list[int] = []  # folded offset -> offset in `text` it came from
+    ends: list[int] = []
+    start = 0
+    for end in range(1, len(text) + 1):
+        if end < len(text) and unicodedata.combining(text[end]):
+            continue
+        part = fold(text[start:end])
+        parts.append(part)
+        starts.extend([start] * len(part))
+        ends.extend([end] * len(part))
+        start = end
+    return [
+        (starts[match.start()], ends[match.end() - 1])
+        for match in pattern.finditer("".join(parts))
+        if match.end() > match.start()
+    ]
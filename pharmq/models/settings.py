@@ -1,7 +1,15 @@
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, replace
 from typing import Set, Optional
 import json
+import os
+import threading
 from pathlib import Path
+from urllib.parse import quote
+
+from ..utils.data_loader import state_dir
+
+SETTINGS_DIR = "settings"
+"""Name of the directory of settings files in `state_dir()`."""
 
 @dataclass
 class Settings:
@@ -9,27 +17,119 @@ class Settings:
     show_category: bool = True
     allow_duplicates: bool = False
     show_answer: bool = True
-    selected_categories: Set[str] = None  # None means all categories
-    
+    selected_categories: Optional[Set[str]] = None  # None means all categories
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Settings':
+        # Convert selected_categories back to set if it exists
+        if data.get('selected_categories') is not None:
+            data['selected_categories'] = set(data['selected_categories'])
+        return cls(**data)
+
+    def copy(self) -> 'Settings':
+        selected_categories = self.selected_categories
+        if selected_categories is not None:
+            selected_categories = set(selected_categories)
+        return replace(self, selected_categories=selected_categories)
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        # Convert set to list for JSON serialization
+        if data['selected_categories'] is not None:
+            data['selected_categories'] = sorted(data['selected_categories'])
+        return data
+
     @classmethod
     def load(cls, path: Path = Path("settings.json")) -> 'Settings':
         """Load settings from JSON file."""
         try:
             with open(path) as f:
-                data = json.load(f)
-                # Convert selected_categories back to set if it exists
-                if data.get('selected_categories'):
-                    data['selected_categories'] = set(data['selected_categories'])
-                return cls(**data)
-        except (FileNotFoundError, json.JSONDecodeError):
+                return cls.from_dict(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError, TypeError):
             return cls()  # Return default settings if file doesn't exist or is invalid
 
     def save(self, path: Path = Path("settings.json")) -> None:
-        """Save settings to JSON file."""
-        data = asdict(self)
-        # Convert set to list for JSON serialization
-        if data['selected_categories']:
-            data['selected_categories'] = list(data['selected_categories'])
-        
-        with open(path, 'w') as f:
-            json.dump(data, f, indent=2)
\ No newline at end of file
+        """Save settings to JSON file, replacing it atomically."""
+        path = Path(path)
+        # Unique per writer, so concurrent saves never share a temp file
+        tmp_path = path.with_name(
+            f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+
+
+class SettingsStore:
+    """Settings of every user, served from memory and saved in the background.
+
+    Each user's settings live in their own file under `directory`, by default
+    in `state_dir()` along with the answers. A change is only written once no
+    other change has come in for `DEBOUNCE` seconds, by a timer thread, so
+    toggling a few checkboxes costs one write and the UI never waits on the
+    disk. One file is written at a time, and `flush` waits for a write in
+    progress too.
+    """
+
+    DEBOUNCE = 1.0
+    """Seconds to wait for further changes before writing."""
+
+    def __init__(self, directory: str | Path | None = None) -> None:
+        self.directory = (
+            state_dir() / SETTINGS_DIR if directory is None else Path(directory)
+        )
+        self._settings: dict[str, Settings] = {}
+        self._timers: dict[str, threading.Timer] = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # held for a whole write
+
+    def path(self, user: str) -> Path:
+        return self.directory / f"{quote(user, safe='')}.json"
+
+    def get(self, user: str) -> Settings:
+        """Get a user's settings, reading their file only the first time."""
+        with self._lock:
+            settings = self._settings.get(user)
+        if settings is None:
+            settings = Settings.load(self.path(user))
+            with self._lock:
+                settings = self._settings.setdefault(user, settings)
+        return settings.copy()
+
+    def update(self, user: str, settings: Settings) -> None:
+        """Replace a user's settings, and save them after a short delay."""
+        with self._lock:
+            self._settings[user] = settings.copy()
+            timer = self._timers.pop(user, None)
+            if timer is not None:
+                timer.cancel()
+            timer = self._timers[user] = threading.Timer(
+                self.DEBOUNCE, self._write, (user,)
+            )
+            timer.daemon = True
+            timer.start()
+
+    def flush(self) -> None:
+        """Write all pending changes now, and wait for any being written."""
+        with self._lock:
+            users = list(self._timers)
+            for timer in self._timers.values():
+                timer.cancel()
+        for user in users:
+            self._write(user)
+        # A timer may have taken its change before `flush` looked
+        with self._write_lock:
+            pass
+
+    def _write(self, user: str) -> None:
+        with self._write_lock:
+            with self._lock:
+                if self._timers.pop(user, None) is None:
+                    # Already written by `flush`
+                    return
+                settings = self._settings[user]
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                settings.save(self.path(user))
+            except OSError as e:
+                print(f"Error saving settings of {user}: {e}")
@@ -0,0 +1,86 @@
+"""Session lifecycle metrics, and the `/metrics` endpoint that serves them.
+
+`instrument_server` is only called when metrics are enabled, so a server
+without `--metrics` runs the stock textual-serve code paths untouched.
+"""
+
+import time
+from functools import wraps
+
+from aiohttp import web
+from textual_serve.app_service import AppService
+from textual_serve.server import Server
+
+from ..utils.metrics import REGISTRY, collect
+
+SESSIONS_STARTED = REGISTRY.counter(
+    "pharmq_sessions_started_total", "Sessions started"
+)
+SESSIONS_ACTIVE = REGISTRY.gauge("pharmq_sessions_active", "Sessions connected now")
+SESSION_SPAWN = REGISTRY.histogram(
+    "pharmq_session_spawn_seconds", "Time from connecting to the first frame"
+)
+SESSION_DURATION = REGISTRY.histogram(
+    "pharmq_session_duration_seconds",
+    "How long sessions stay connected",
+    buckets=(1, 10, 30, 60, 300, 600, 1800, 3600, 7200, 14400),
+)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """Serve all metrics, including those of session processes."""
+    return web.Response(
+        text=REGISTRY.render(collect()),
+        content_type="text/plain",
+        headers={"X-Content-Type-Options": "nosniff"},
+    )
+
+
+def instrument_server(server: Server) -> None:
+    """Add the `/metrics` route and session lifecycle metrics to a server."""
+    make_app = server._make_app
+    handle_websocket = server.handle_websocket
+
+    async def _make_app() -> web.Application:
+        app = await make_app()
+        app.router.add_get("/metrics", handle_metrics, name="metrics")
+        return app
+
+    @wraps(handle_websocket)
+    async def metered_handle_websocket(request: web.Request) -> web.StreamResponse:
+        SESSIONS_STARTED.inc()
+        SESSIONS_ACTIVE.inc()
+        start = time.monotonic()
+        try:
+            return await handle_websocket(request)
+        finally:
+            SESSIONS_ACTIVE.dec()
+            SESSION_DURATION.observe(time.monotonic() - start)
+
+    server._make_app = _make_app  # type: ignore[method-assign]
+    server.handle_websocket = metered_handle_websocket  # type: ignore[method-assign]
+    instrument_app_service()
+
+
+def instrument_app_service() -> None:
+    """Time session processes from start to their first frame."""
+    if getattr(AppService, "_pharmq_metered", False):
+        return
+    start = AppService.start
+    on_data = AppService.on_data
+
+    @wraps(start)
+    async def metered_start(self: AppService, width: int, height: int) -> None:
+        self._pharmq_started = time.monotonic()
+        await start(self, width, height)
+
+    @wraps(on_data)
+    async def metered_on_data(self: AppService, payload: bytes) -> None:
+        started = self.__dict__.pop("_pharmq_started", None)
+        if started is not None:
+            SESSION_SPAWN.observe(time.monotonic() - started)
+        await on_data(self, payload)
+
+    AppService.start = metered_start  # type: ignore[method-assign]
+    AppService.on_data = metered_on_data  # type: ignore[method-assign]
+    AppService._pharmq_metered = True  # type: ignore[attr-defined]
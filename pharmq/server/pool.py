@@ -0,0 +1,338 @@
+"""A textual-serve server that attaches sessions to pre-started workers.
+
+The stock `Server` spawns `python3 -m pharmq.app` for every websocket, so each
+connection pays for a cold interpreter, the Textual import and the dataset
+load. `PooledServer` keeps a pool of warm `pharmq.server.worker` processes
+that have already done all of that, and hands one to each new session.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+from asyncio.subprocess import Process
+from collections import deque
+from importlib.metadata import version
+
+from aiohttp import web
+from textual_serve.app_service import AppService
+from textual_serve.server import Server, to_int
+
+from ..utils.progress import DEFAULT_USER
+from .users import request_user, set_user_cookie
+
+log = logging.getLogger("textual-serve")
+
+WORKER_COMMAND = "python3 -m pharmq.server.worker"
+
+
+class WorkerPool:
+    """A pool of warm worker processes, refilled in the background."""
+
+    CLOSE_TIMEOUT = 5.0
+    """Seconds to let workers exit when closing, before they are killed."""
+
+    def __init__(
+        self,
+        command: str = WORKER_COMMAND,
+        min_size: int = 4,
+        max_size: int = 128,
+        debug: bool = False,
+    ) -> None:
+        """
+        Args:
+            command: Shell command that starts a warm worker.
+            min_size: Number of idle workers to keep ready.
+            max_size: Maximum number of live workers, idle or attached.
+            debug: Enable Textual devtools in the workers.
+        """
+        if not 0 <= min_size <= max_size:
+            raise ValueError(f"Invalid pool size: min={min_size}, max={max_size}")
+
+        self.command = command
+        self.min_size = min_size
+        self.max_size = max_size
+        self.debug = debug
+
+        self._idle: deque[Process] = deque()
+        # Every live worker, idle or attached, and the tasks that reap them
+        self._processes: set[Process] = set()
+        self._reapers: set[asyncio.Task[None]] = set()
+        # Idle workers' stderr is read until they are attached, so a chatty
+        # worker cannot fill the pipe and block
+        self._drains: dict[Process, asyncio.Task[None]] = {}
+        self._live = 0
+        self._changed = asyncio.Condition()
+        self._refill_task: asyncio.Task[None] | None = None
+        self._closed = False
+
+    @property
+    def idle(self) -> int:
+        """Number of warm workers waiting for a session."""
+        return len(self._idle)
+
+    @property
+    def live(self) -> int:
+        """Number of worker processes alive, idle or attached."""
+        return self._live
+
+    def _build_environment(self) -> dict[str, str]:
+        """Build the environment for a worker process.
+
+        Mirrors `AppService._build_environment`, minus the terminal size,
+        which the worker only learns once it is attached to a session.
+        """
+        environment = dict(os.environ)
+        environment["TEXTUAL_DRIVER"] = "textual.drivers.web_driver:WebDriver"
+        environment["TEXTUAL_FPS"] = "60"
+        environment["TEXTUAL_COLOR_SYSTEM"] = "truecolor"
+        environment["TERM_PROGRAM"] = "textual"
+        environment["TERM_PROGRAM_VERSION"] = version("textual-serve")
+        if self.debug:
+            environment["TEXTUAL"] = "debug,devtools"
+            environment["TEXTUAL_LOG"] = "textual.log"
+        return environment
+
+    async def _spawn(self) -> Process:
+        """Start a new worker process."""
+        self._live += 1
+        try:
+            process = await asyncio.create_subprocess_shell(
+                self.command,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=self._build_environment(),
+                # A group of its own, to be stopped with the shell it runs in
+                start_new_session=True,
+            )
+        except BaseException:
+            self._live -= 1
+            raise
+
+        self._processes.add(process)
+        reaper = asyncio.create_task(self._reap(process))
+        self._reapers.add(reaper)
+        reaper.add_done_callback(self._reapers.discard)
+        return process
+
+    async def _reap(self, process: Process) -> None:
+        """Wait for a worker to exit and release its slot."""
+        await process.wait()
+        self._live -= 1
+        self._processes.discard(process)
+        try:
+            self._idle.remove(process)
+        except ValueError:
+            pass
+
+        await self._stop_draining(process)
+
+        async with self._changed:
+            self._changed.notify_all()
+        self._schedule_refill()
+
+    @staticmethod
+    def _signal(process: Process, signal_number: int) -> None:
+        """Send a signal to a worker and anything it started."""
+        try:
+            os.killpg(process.pid, signal_number)
+        except ProcessLookupError:
+            pass
+
+    async def _drain_stderr(self, process: Process) -> None:
+        """Log what an idle worker writes to stderr."""
+        assert process.stderr is not None
+        while data := await process.stderr.read(4096):
+            log.warning(
+                "Idle worker %s: %s",
+                process.pid,
+                data.decode("utf-8", "replace").rstrip(),
+            )
+
+    async def _stop_draining(self, process: Process) -> None:
+        """Stop reading a worker's stderr, leaving the rest to its session."""
+        drain = self._drains.pop(process, None)
+        if drain is not None:
+            drain.cancel()
+            try:
+                await drain
+            except asyncio.CancelledError:
+                pass
+
+    def _schedule_refill(self) -> None:
+        """Start refilling the pool unless a refill is already running."""
+        if self._closed:
+            return
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self) -> None:
+        """Spawn workers until the pool is back at its minimum size."""
+        while (
+            not self._closed
+            and len(self._idle) < self.min_size
+            and self._live < self.max_size
+        ):
+            try:
+                process = await self._spawn()
+            except Exception as error:
+                log.exception(error)
+                return
+
+            self._drains[process] = asyncio.create_task(self._drain_stderr(process))
+            async with self._changed:
+                self._idle.append(process)
+                self._changed.notify()
+
+    async def start(self) -> None:
+        """Start filling the pool."""
+        self._closed = False
+        self._schedule_refill()
+
+    async def acquire(self) -> Process:
+        """Take a warm worker from the pool.
+
+        Falls back to spawning a worker on demand if none is idle, and waits
+        for a free slot if the pool is already at its maximum size.
+        """
+        async with self._changed:
+            while True:
+                while self._idle:
+                    process = self._idle.popleft()
+                    if process.returncode is None:
+                        await self._stop_draining(process)
+                        self._schedule_refill()
+                        return process
+                if self._live < self.max_size:
+                    break
+                await self._changed.wait()
+
+        log.warning("Worker pool is empty, spawning a worker on demand")
+        process = await self._spawn()
+        self._schedule_refill()
+        return process
+
+    async def close(self) -> None:
+        """Stop refilling, and terminate all workers, idle or attached.
+
+        Waits until every worker has exited, so none is left to be cleaned
+        up after the event loop is gone. Workers still running after
+        `CLOSE_TIMEOUT` seconds are killed.
+        """
+        self._closed = True
+        tasks = [*self._drains.values()]
+        if self._refill_task is not None:
+            tasks.append(self._refill_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._drains.clear()
+        self._idle.clear()
+
+        processes = list(self._processes)
+        for process in processes:
+            self._signal(process, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(process.wait() for process in processes)),
+                self.CLOSE_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            for process in processes:
+                if process.returncode is None:
+                    log.warning("Worker %s did not exit, killing it", process.pid)
+                    self._signal(process, signal.SIGKILL)
+            await asyncio.gather(*(process.wait() for process in processes))
+        await asyncio.gather(*self._reapers)
+
+
+class PooledAppService(AppService):
+    """An app service that runs its session in a worker from the pool."""
+
+    def __init__(self, pool: WorkerPool, user: str = DEFAULT_USER, **kwargs) -> None:
+        super().__init__(pool.command, **kwargs)
+        self.pool = pool
+        self.user = user
+
+    async def _open_app_process(self, width: int = 80, height: int = 24) -> Process:
+        self._process = process = await self.pool.acquire()
+        assert process.stdin is not None
+        self._stdin = process.stdin
+
+        await self.send_meta(
+            {"type": "session", "width": width, "height": height, "user": self.user}
+        )
+        return process
+
+
+class PooledServer(Server):
+    """Serve the app from a pool of warm workers."""
+
+    def __init__(
+        self,
+        command: str = WORKER_COMMAND,
+        pool_min: int = 4,
+        pool_max: int = 128,
+        **kwargs,
+    ) -> None:
+        super().__init__(command, **kwargs)
+        self.pool = WorkerPool(command, min_size=pool_min, max_size=pool_max)
+
+    async def on_startup(self, app: web.Application) -> None:
+        await super().on_startup(app)
+        self.pool.debug = self.debug
+        await self.pool.start()
+        self.console.print(
+            f"Keeping {self.pool.min_size} warm workers "
+            f"(at most {self.pool.max_size} live)"
+        )
+
+    async def on_shutdown(self, app: web.Application) -> None:
+        await self.pool.close()
+        await super().on_shutdown(app)
+
+    async def handle_index(self, request: web.Request) -> web.StreamResponse:
+        response = await super().handle_index(request)
+        set_user_cookie(request, response)
+        return response
+
+    async def handle_websocket(self, request: web.Request) -> web.WebSocketResponse:
+        """Handle the websocket, attaching it to a pooled worker.
+
+        Same as `Server.handle_websocket`, but with a `PooledAppService`.
+        """
+        websocket = web.WebSocketResponse(heartbeat=15)
+
+        width = to_int(request.query.get("width", "80"), 80)
+        height = to_int(request.query.get("height", "24"), 24)
+
+        app_service: AppService | None = None
+        try:
+            await websocket.prepare(request)
+            app_service = PooledAppService(
+                self.pool,
+                user=request_user(request),
+                write_bytes=websocket.send_bytes,
+                write_str=websocket.send_str,
+                close=websocket.close,
+                download_manager=self.download_manager,
+                debug=self.debug,
+            )
+            await app_service.start(width, height)
+            try:
+                await self._process_messages(websocket, app_service)
+            finally:
+                await app_service.stop()
+
+        except asyncio.CancelledError:
+            await websocket.close()
+
+        except Exception as error:
+            log.exception(error)
+
+        finally:
+            if app_service is not None:
+                await app_service.stop()
+
+        return websocket
@@ -0,0 +1,87 @@
+"""The stock textual-serve server, telling each session process its user.
+
+`Server` starts `python3 -m pharmq.app` for every websocket without saying
+who connected, so every session would be the default user and share one
+settings file and one progress history. `ProcessServer` gives browsers a
+user cookie, like the other modes, and passes the user to the session
+process in its environment.
+"""
+
+import asyncio
+import logging
+
+from aiohttp import web
+from textual_serve.app_service import AppService
+from textual_serve.server import Server, to_int
+
+from ..utils.progress import DEFAULT_USER, USER_ENV
+from .users import request_user, set_user_cookie
+
+log = logging.getLogger("textual-serve")
+
+APP_COMMAND = "python3 -m pharmq.app"
+
+
+class UserAppService(AppService):
+    """An app service that starts its session process as a given user."""
+
+    def __init__(self, command: str, user: str = DEFAULT_USER, **kwargs) -> None:
+        super().__init__(command, **kwargs)
+        self.user = user
+
+    def _build_environment(self, width: int = 80, height: int = 24) -> dict[str, str]:
+        environment = super()._build_environment(width, height)
+        environment[USER_ENV] = self.user
+        return environment
+
+
+class ProcessServer(Server):
+    """Serve the app with one process per session, each as its own user."""
+
+    def __init__(self, command: str = APP_COMMAND, **kwargs) -> None:
+        super().__init__(command, **kwargs)
+
+    async def handle_index(self, request: web.Request) -> web.StreamResponse:
+        response = await super().handle_index(request)
+        set_user_cookie(request, response)
+        return response
+
+    async def handle_websocket(self, request: web.Request) -> web.WebSocketResponse:
+        """Handle the websocket, starting a session process for its user.
+
+        Same as `Server.handle_websocket`, but with a `UserAppService`.
+        """
+        websocket = web.WebSocketResponse(heartbeat=15)
+
+        width = to_int(request.query.get("width", "80"), 80)
+        height = to_int(request.query.get("height", "24"), 24)
+
+        app_service: AppService | None = None
+        try:
+            await websocket.prepare(request)
+            app_service = UserAppService(
+                self.command,
+                user=request_user(request),
+                write_bytes=websocket.send_bytes,
+                write_str=websocket.send_str,
+                close=websocket.close,
+                download_manager=self.download_manager,
+                debug=self.debug,
+            )
+            await app_service.start(width, height)
+            try:
+                await self._process_messages(websocket, app_service)
+            finally:
+                await app_service.stop()
+
+        except asyncio.CancelledError:
+            await websocket.close()
+
+        except Exception as error:
+            log.exception(error)
+
+        finally:
+            if app_service is not None:
+                await app_service.stop()
+
+        return websocket
@@ -0,0 +1,405 @@
+"""A server that runs every session as an asyncio task in one process.
+
+Under the stock textual-serve `Server`, every browser session is its own
+process with its own interpreter, Textual runtime and copy of the dataset.
+`SingleProcessServer` instead runs each `DrugQuizApp` in the server's event
+loop, talking to its websocket through a `SessionDriver`. All sessions share
+the categories and one `QuizGenerator`'s indexes; each keeps only its own
+widgets and state. Edited data files are reloaded once by the server and
+pushed into every session.
+
+Nothing of a session goes through the process's streams: its driver reads
+the browser's input and sends the app's output over the session's
+websocket, and what the app prints goes to the app, as in a session process.
+Started by `pharmq serve --single-process`, which also sets up metrics and
+the distractor options for it as for the other modes.
+"""
+
+import asyncio
+import json
+import logging
+import sys
+import time
+from contextvars import ContextVar
+from functools import partial
+from typing import Any, TextIO
+
+from aiohttp import WSMsgType, web
+from rich.console import Console
+from textual import constants, events
+from textual._xterm_parser import XTermParser
+from textual.app import App
+from textual.driver import Driver
+from textual.geometry import Size
+from textual_serve.server import Server, to_int
+
+from ..app import DrugQuizApp
+from ..models.distractors import distractor_options
+from ..models.quiz import QuizGenerator
+from ..models.search import SearchIndex
+from ..utils.data_loader import load_csv_data
+from ..utils.data_watcher import DataWatcher
+from ..models.settings import SettingsStore
+from ..utils import metrics
+from ..utils.progress import ProgressStore
+from .metrics import SESSION_SPAWN
+from .users import request_user, set_user_cookie
+
+log = logging.getLogger("textual-serve")
+
+STOP_TIMEOUT = 5.0
+"""Seconds a session's app, and then its output, get to finish on close."""
+
+TICK_MARGIN = 0.01
+"""Seconds past the escape delay to tick a session's input parser at."""
+
+# The session whose app is running in the current task, if any
+_current_session: ContextVar["Session | None"] = ContextVar(
+    "pharmq_session", default=None
+)
+
+
+class SessionOutput:
+    """Stands in for `sys.stdout` or `sys.stderr` while the server runs.
+
+    What a session's app prints while it runs goes to that app, and what it
+    prints to stdout before or after, like Textual's event log when there is
+    no active app, is dropped. Anything else goes to the stream this
+    replaced, errors from sessions included.
+    """
+
+    def __init__(self, stream: TextIO, stderr: bool = False) -> None:
+        self.stream = stream
+        self.stderr = stderr
+
+    def write(self, text: str) -> int:
+        session = _current_session.get()
+        if session is None or (session.driver is None and self.stderr):
+            return self.stream.write(text)
+        if session.driver is not None:
+            session.driver.print(text, stderr=self.stderr)
+        return len(text)
+
+    def flush(self) -> None:
+        if _current_session.get() is None:
+            self.stream.flush()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.stream, name)
+
+
+STDOUT = SessionOutput(sys.stdout)
+STDERR = SessionOutput(sys.stderr, stderr=True)
+
+
+class Session:
+    """The websocket side of a session: queues output for the browser."""
+
+    def __init__(self, websocket: web.WebSocketResponse, width: int, height: int):
+        self.websocket = websocket
+        self.size = (width, height)
+        self.driver: "SessionDriver | None" = None
+        # Typed before the app was ready for it
+        self.pending_input = ""
+        self.closed = False
+        self._outgoing: asyncio.Queue[bytes | str | None] = asyncio.Queue()
+        self._started: float | None = time.monotonic() if metrics.ENABLED else None
+
+    def send_bytes(self, data: bytes) -> None:
+        """Queue terminal output for the browser."""
+        if not self.closed:
+            self._outgoing.put_nowait(data)
+
+    def send_str(self, data: str) -> None:
+        """Queue a JSON message for the browser."""
+        if not self.closed:
+            self._outgoing.put_nowait(data)
+
+    def close(self) -> None:
+        """Stop sending once queued output has been sent."""
+        if not self.closed:
+            self._outgoing.put_nowait(None)
+            self.closed = True
+
+    async def run(self) -> None:
+        """Send queued output until the session is closed."""
+        outgoing = self._outgoing
+        websocket = self.websocket
+        while True:
+            item = await outgoing.get()
+
+            # Textual writes a frame in many small pieces; send them together
+            chunks = []
+            while isinstance(item, bytes):
+                chunks.append(item)
+                if outgoing.empty():
+                    item = b""
+                    break
+                item = outgoing.get_nowait()
+            if chunks and self._started is not None:
+                SESSION_SPAWN.observe(time.monotonic() - self._started)
+                self._started = None
+            try:
+                if chunks:
+                    await websocket.send_bytes(b"".join(chunks))
+                if isinstance(item, str):
+                    await websocket.send_str(item)
+                elif item is None:
+                    return
+            except ConnectionResetError:
+                # The browser went away; what is left has nowhere to go
+                self.closed = True
+                return
+
+
+class SessionDriver(Driver):
+    """A driver that runs an app in the server process, over a `Session`."""
+
+    if not hasattr(Driver, "process_message"):
+        # As older Textual releases name them
+        process_message = Driver.process_event  # type: ignore[attr-defined]
+        send_message = Driver.send_event  # type: ignore[attr-defined]
+
+    def __init__(
+        self,
+        app: App[Any],
+        *,
+        session: Session,
+        debug: bool = False,
+        mouse: bool = True,
+        size: tuple[int, int] | None = None,
+    ):
+        super().__init__(app, debug=debug, mouse=mouse, size=size or session.size)
+        self.session = session
+        self._parser = XTermParser(debug=debug)
+        self._flush_handle: asyncio.TimerHandle | None = None
+        # Textual points `sys.stdout` and `sys.stderr` at these while the app
+        # runs. Sessions do not stop in the order they started, so each would
+        # put back another's; the same `SessionOutput` for all keeps them in
+        # place, and it hands what this app prints to the app's own capture
+        self._print_stdout = app._capture_stdout
+        self._print_stderr = app._capture_stderr
+        app._capture_stdout = STDOUT  # type: ignore[assignment]
+        app._capture_stderr = STDERR  # type: ignore[assignment]
+
+    @property
+    def is_web(self) -> bool:
+        return True
+
+    def write(self, data: str) -> None:
+        self.session.send_bytes(data.encode("utf-8"))
+
+    def flush(self) -> None:
+        pass
+
+    def print(self, text: str, stderr: bool = False) -> None:
+        """Pass on what the app printed, as Textual would."""
+        (self._print_stderr if stderr else self._print_stdout).write(text)
+
+    def start_application_mode(self) -> None:
+        self.write("\x1b[?1049h")  # Alt screen
+        self.write("\x1b[?1000h")  # SET_VT200_MOUSE
+        self.write("\x1b[?1003h")  # SET_ANY_EVENT_MOUSE
+        self.write("\x1b[?1015h")  # SET_VT200_HIGHLIGHT_MOUSE
+        self.write("\x1b[?1006h")  # SET_SGR_EXT_MODE_MOUSE
+        self.write("\x1b[?25l")  # Hide cursor
+        self.write("\033[?2026$p")  # Query sync mode support
+        self.write("\x1b[?2004h")  # Bracketed paste
+
+        self._size = self.session.size
+        size = Size(*self._size)
+        self._app.post_message(events.Resize(size, size))
+        self._app.call_later(self._app.post_message, events.AppBlur())
+
+        self.session.driver = self
+        if self.session.pending_input:
+            self.feed(self.session.pending_input)
+            self.session.pending_input = ""
+
+    def disable_input(self) -> None:
+        self.session.driver = None
+
+    def stop_application_mode(self) -> None:
+        self.session.driver = None
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self.session.close()
+
+    def open_url(self, url: str, new_tab: bool = True) -> None:
+        self.session.send_str(json.dumps(["open_url", {"url": url, "new_tab": new_tab}]))
+
+    def feed(self, data: str) -> None:
+        """Process keyboard and mouse input from the browser."""
+        for event in self._parser.feed(data):
+            self.process_message(event)
+
+        # A lone escape is only known to be the escape key after a while, as
+        # the parser finds on a tick once `ESCAPE_DELAY` has passed
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush_handle = self._loop.call_later(
+            constants.ESCAPE_DELAY + TICK_MARGIN, self._tick
+        )
+
+    def _tick(self) -> None:
+        self._flush_handle = None
+        for event in self._parser.tick():
+            self.process_message(event)
+
+    def resize(self, width: int, height: int) -> None:
+        self._size = (width, height)
+        size = Size(width, height)
+        self._app.post_message(events.Resize(size, size))
+
+
+class SingleProcessServer(Server):
+    """Serve many app sessions from one process, sharing one dataset."""
+
+    def __init__(self, **kwargs) -> None:
+        kwargs.setdefault("title", "pharmq")
+        super().__init__("pharmq (single process)", **kwargs)
+        self.console = Console(file=sys.__stdout__)
+        # The app of every session, and the task running it
+        self.sessions: dict[DrugQuizApp, asyncio.Task] = {}
+
+    async def on_startup(self, app: web.Application) -> None:
+        await super().on_startup(app)
+        sys.stdout, sys.stderr = STDOUT, STDERR
+        # Built once; every session reads from these
+        self.categories = load_csv_data()
+        self.quiz_generator = QuizGenerator(self.categories, **distractor_options())
+        similar_answers = self.quiz_generator.similar_answers
+        if similar_answers is not None:
+            await asyncio.to_thread(similar_answers.prepare, self.quiz_generator)
+        self.search_index = SearchIndex(self.categories)
+        self.data_watcher = DataWatcher()
+        self.progress = ProgressStore()
+        self.settings_store = SettingsStore()
+        self._watch_task = asyncio.create_task(self.watch_data())
+
+    async def watch_data(self) -> None:
+        """Reload edited data files and push them into every session."""
+        while True:
+            await asyncio.sleep(DrugQuizApp.DATA_POLL_INTERVAL)
+            change = await asyncio.to_thread(self.data_watcher.poll)
+            if change is None:
+                continue
+            # The indexes are shared, so they are rebuilt once for everyone
+            self.quiz_generator.apply_changes(change.changed, change.removed)
+            self.search_index.apply_changes(change.changed, change.removed)
+            for quiz_app in self.sessions:
+                quiz_app.call_later(quiz_app.refresh_data, change)
+
+    async def on_shutdown(self, app: web.Application) -> None:
+        self._watch_task.cancel()
+        for quiz_app in list(self.sessions):
+            quiz_app.exit()
+        # Before the streams are put back, as apps print until they stop
+        if self.sessions:
+            await asyncio.wait(list(self.sessions.values()), timeout=STOP_TIMEOUT)
+        await asyncio.to_thread(self.progress.close)
+        await asyncio.to_thread(self.settings_store.flush)
+        sys.stdout, sys.stderr = STDOUT.stream, STDERR.stream
+        await super().on_shutdown(app)
+
+    async def handle_index(self, request: web.Request) -> web.StreamResponse:
+        response = await super().handle_index(request)
+        set_user_cookie(request, response)
+        return response
+
+    async def handle_websocket(self, request: web.Request) -> web.WebSocketResponse:
+        """Handle the websocket by running a new app session in this process.
+
+        The session ends when the browser goes away or the app exits, and the
+        websocket is closed either way.
+        """
+        websocket = web.WebSocketResponse(heartbeat=15)
+
+        width = to_int(request.query.get("width", "80"), 80)
+        height = to_int(request.query.get("height", "24"), 24)
+
+        await websocket.prepare(request)
+        session = Session(websocket, width, height)
+        quiz_app = DrugQuizApp(
+            categories=self.categories,
+            quiz_generator=self.quiz_generator,
+            search_index=self.search_index,
+            progress=self.progress,
+            settings_store=self.settings_store,
+            user=request_user(request),
+            driver_class=partial(SessionDriver, session=session),
+        )
+
+        output_task = asyncio.create_task(session.run())
+        app_task = asyncio.create_task(self._run_app(quiz_app, session))
+        self.sessions[quiz_app] = app_task
+        messages_task = asyncio.create_task(
+            self._process_session_messages(websocket, session)
+        )
+        try:
+            await asyncio.wait(
+                (app_task, messages_task), return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            if not app_task.done():
+                quiz_app.exit()
+            await stop_task(app_task, "The app")
+            session.close()
+            await stop_task(output_task, "Sending output")
+            # While messages are still being read, which ends that loop,
+            # rather than waiting here for the browser to answer
+            await websocket.close()
+            await stop_task(messages_task, "Reading the websocket")
+            self.sessions.pop(quiz_app, None)
+
+        return websocket
+
+    async def _run_app(self, quiz_app: DrugQuizApp, session: Session) -> None:
+        """Run a session's app, sending what it prints to the app."""
+        _current_session.set(session)
+        await quiz_app.run_async()
+
+    async def _process_session_messages(
+        self, websocket: web.WebSocketResponse, session: Session
+    ) -> None:
+        """Dispatch messages from the browser to the session's driver.
+
+        Same protocol as `Server._process_messages`.
+        """
+        async for message in websocket:
+            if message.type != WSMsgType.TEXT:
+                continue
+            envelope = message.json()
+            assert isinstance(envelope, list)
+            type_ = envelope[0]
+
+            if type_ == "ping":
+                await websocket.send_json(["pong", envelope[1]])
+                continue
+
+            driver = session.driver
+            if driver is None:
+                # Kept for the app, until it is ready for them
+                if type_ == "stdin":
+                    session.pending_input += envelope[1]
+                elif type_ == "resize":
+                    session.size = (envelope[1]["width"], envelope[1]["height"])
+            elif type_ == "stdin":
+                driver.feed(envelope[1])
+            elif type_ == "resize":
+                driver.resize(envelope[1]["width"], envelope[1]["height"])
+            elif type_ == "blur":
+                driver.send_message(events.AppBlur())
+            elif type_ == "focus":
+                driver.send_message(events.AppFocus())
+
+
+async def stop_task(task: asyncio.Task, what: str) -> None:
+    """Wait for a task to end, for up to `STOP_TIMEOUT`, then cancel it."""
+    done, _ = await asyncio.wait((task,), timeout=STOP_TIMEOUT)
+    if not done:
+        log.warning("%s did not stop within %s seconds", what, STOP_TIMEOUT)
+        task.cancel()
+        await asyncio.wait((task,), timeout=STOP_TIMEOUT)
+    elif not task.cancelled() and task.exception() is not None:
+        log.error("%s failed", what, exc_info=task.exception())
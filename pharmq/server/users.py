@@ -0,0 +1,38 @@
+"""Tell browsers apart across reconnects, with a cookie.
+
+Every websocket gets a new app session, so anything that should survive a
+reload, like saved settings, is keyed by a user id instead. The index page
+gives each browser a random id in a long-lived cookie, which the browser
+sends back with the websocket request.
+"""
+
+import re
+import uuid
+
+from aiohttp import web
+
+from ..utils.progress import DEFAULT_USER
+
+USER_COOKIE = "pharmq_user"
+USER_COOKIE_MAX_AGE = 365 * 24 * 60 * 60
+
+_USER_ID = re.compile(r"[0-9a-f]{32}")
+
+
+def set_user_cookie(request: web.Request, response: web.StreamResponse) -> None:
+    """Give the browser a user id, unless it already has one."""
+    if _USER_ID.fullmatch(request.cookies.get(USER_COOKIE, "")):
+        return
+    response.set_cookie(
+        USER_COOKIE,
+        uuid.uuid4().hex,
+        max_age=USER_COOKIE_MAX_AGE,
+        httponly=True,
+        samesite="Lax",
+    )
+
+
+def request_user(request: web.Request) -> str:
+    """The user id sent with a request, or the default user if none."""
+    user = request.cookies.get(USER_COOKIE, "")
+    return user if _USER_ID.fullmatch(user) else DEFAULT_USER
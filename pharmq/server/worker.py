@@ -0,0 +1,63 @@
+"""Warm session worker used by the pooled server.
+
+The worker imports the app and loads the dataset as soon as it is spawned,
+then blocks until the server hands it a session. Only then does it start
+Textual, so a new connection skips the cold start entirely.
+"""
+
+import json
+import os
+import sys
+
+from pharmq.app import DrugQuizApp
+from pharmq.utils.data_loader import load_csv_data
+
+# The app only imports this when the Categories tab is first opened, but a
+# warm worker should already have it
+import pharmq.widgets.categories  # noqa: F401
+
+
+def read_exactly(fd: int, size: int) -> bytes:
+    """Read exactly `size` bytes from a file descriptor."""
+    data = b""
+    while len(data) < size:
+        chunk = os.read(fd, size - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+def wait_for_session() -> dict:
+    """Block until the server sends the session meta packet."""
+    # Read the packet with raw `os.read` calls so nothing past it is
+    # buffered: the web driver reads the rest of stdin from the same fd.
+    fd = sys.__stdin__.fileno()
+    header = read_exactly(fd, 5)
+    packet_type, size = header[:1], int.from_bytes(header[1:], "big")
+    meta = json.loads(read_exactly(fd, size))
+
+    if packet_type != b"M" or meta.get("type") != "session":
+        raise ValueError(f"Expected a session packet, got {meta!r}")
+    return meta
+
+
+def main() -> None:
+    load_csv_data()
+    app = DrugQuizApp()
+
+    try:
+        session = wait_for_session()
+    except EOFError:
+        # The pool shut down before this worker was used
+        return
+
+    # The web driver picks the initial terminal size up from the environment
+    os.environ["COLUMNS"] = str(session["width"])
+    os.environ["ROWS"] = str(session["height"])
+    app.user = session.get("user", app.user)
+    app.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,35 @@
 import csv
+import os
 from functools import cache
 from pathlib import Path
-from typing import Dict
+from typing import IO, Dict
 
 from ..models.category import Category
+from ..models.columnar import ColumnarTable, StringPool
+from .snapshot import load_snapshot
+
+DATA_DIR = str(Path(__file__).parent / "../data")
+
+STATE_DIR_ENV = "PHARMQ_STATE_DIR"
+"""Where to keep answers and settings instead of the user's data directory."""
+
+
+def state_dir() -> Path:
+    """Where answers and settings are kept, whatever directory the server runs in.
+
+    Outside the package, so installing it again keeps them, and overridden
+    by `PHARMQ_STATE_DIR`, as the load test does to keep its answers apart.
+    """
+    directory = os.environ.get(STATE_DIR_ENV)
+    if directory:
+        return Path(directory)
+    from platformdirs import user_data_path
+
+    return user_data_path("pharmq", appauthor=False)
+
+# Every value parsed in this process, stored once however many rows and
+# categories repeat it, and reloaded files get the same codes
+STRINGS = StringPool()
 
 # @cache
 # def load_csv_data(
@@ -33,38 +59,69 @@ from ..models.category import Category
 
 
 @cache
-def load_csv_data(
-    data_dir: str = str(Path(__file__).parent / "../data"),
+def load_csv_data(data_dir: str = DATA_DIR) -> Dict[str, Category]:
+    """Load all categories from the data directory.
+
+    Attaches to the dataset shared by the launcher when there is one, then
+    tries the compiled snapshot when it is up to date with the CSV files, and
+    parses the CSV files otherwise.
+    """
+    # Brings in multiprocessing, which the app's import can do without
+    from .shared_dataset import load_shared_dataset
+
+    categories = load_shared_dataset(data_dir)
+    if categories is None:
+        categories = load_snapshot(data_dir)
+    if categories is None:
+        categories = read_csv_dir(data_dir)
+    return categories
+
+
+def read_csv_dir(
+    data_dir: str = DATA_DIR, pool: StringPool = STRINGS
 ) -> Dict[str, Category]:
     """Load all CSV files from the data directory using csv module."""
     categories = {}
     data_path = Path(data_dir)
 
-    for csv_file in data_path.glob("*.csv"):
+    # In name order, as `glob` order depends on the file system and the
+    # order of categories decides what a seed generates
+    for csv_file in sorted(data_path.glob("*.csv")):
         try:
             with open(csv_file, "r", encoding="utf-8", newline="") as f:
-                reader = csv.DictReader(f)
-
-                # Get field names
-                if not reader.fieldnames:
-                    continue
-
-                answer_field = reader.fieldnames[0]  # First column is answer
-                fields = [col for col in reader.fieldnames if col != answer_field]
-
-                # Read all rows
-                rows = list(reader)
-                if not rows:  # Skip empty files
-                    continue
-
-                category_name = csv_file.stem
-                categories[category_name] = Category(
-                    id=category_name,
-                    data=rows,
-                    fields=fields,
-                    answer_field=answer_field,
-                )
+                category = read_csv_file(csv_file.stem, f, pool)
+            if category is not None:
+                categories[category.id] = category
         except Exception as e:
             print(f"Error loading {csv_file}: {e}")
 
     return categories
+
+
+def read_csv_file(
+    category_name: str, f: IO[str], pool: StringPool = STRINGS
+) -> Category | None:
+    """Parse one CSV file into a category, or None if it has no rows.
+
+    Values are interned in `pool`.
+    """
+    reader = csv.DictReader(f)
+
+    # Get field names
+    if not reader.fieldnames:
+        return None
+
+    answer_field = reader.fieldnames[0]  # First column is answer
+    fields = [col for col in reader.fieldnames if col != answer_field]
+
+    # Read all rows, stored by column
+    rows = ColumnarTable.from_rows(reader.fieldnames, reader, pool)
+    if not rows:  # Skip empty files
+        return None
+
+    return Category(
+        id=category_name,
+        data=rows,
+        fields=fields,
+        answer_field=answer_field,
+    )
@@ -0,0 +1,103 @@
+"""Notice edits to the data directory and re-parse only what changed.
+
+`load_csv_data` is cached for the life of the process, so without this an
+edited CSV only shows up after a restart. `DataWatcher` remembers the mtime,
+size and content hash of every CSV file; `poll` stats them all, hashes only
+files whose stat changed, and parses only files whose content changed.
+"""
+
+import hashlib
+import io
+import os
+from pathlib import Path
+from typing import Dict, NamedTuple
+
+from ..models.category import Category
+from .data_loader import DATA_DIR, read_csv_file
+
+
+class FileState(NamedTuple):
+    """What a CSV file looked like when it was last read."""
+
+    mtime_ns: int
+    size: int
+    digest: bytes
+
+
+class DataChange(NamedTuple):
+    """Categories to swap in or drop after the data directory changed."""
+
+    changed: Dict[str, Category]
+    removed: list[str]
+
+    @property
+    def names(self) -> set[str]:
+        """Names of all affected categories."""
+        return {*self.changed, *self.removed}
+
+
+class DataWatcher:
+    """Polls a data directory for edited, added and removed CSV files."""
+
+    def __init__(self, data_dir: str | os.PathLike = DATA_DIR) -> None:
+        self.data_dir = Path(data_dir)
+        self.files: dict[Path, FileState] = {}
+        # The data was loaded as the files are now; only later edits count
+        for csv_file in self.data_dir.glob("*.csv"):
+            try:
+                self.files[csv_file], _ = read_file(csv_file)
+            except OSError:
+                pass
+
+    def poll(self) -> DataChange | None:
+        """Check every CSV file, returning what changed since the last poll."""
+        changed: Dict[str, Category] = {}
+        removed: list[str] = []
+        seen = set()
+
+        for csv_file in self.data_dir.glob("*.csv"):
+            seen.add(csv_file)
+            try:
+                stat = csv_file.stat()
+                state = self.files.get(csv_file)
+                if state is not None and (stat.st_mtime_ns, stat.st_size) == (
+                    state.mtime_ns,
+                    state.size,
+                ):
+                    continue
+
+                new_state, content = read_file(csv_file)
+                if state is not None and state.digest == new_state.digest:
+                    # Touched or rewritten, but the same data
+                    self.files[csv_file] = new_state
+                    continue
+
+                text = io.StringIO(content.decode("utf-8"), newline="")
+                category = read_csv_file(csv_file.stem, text)
+            except Exception as e:
+                # Possibly caught mid-save; the file is read again next poll,
+                # as its state is only kept once it parsed
+                print(f"Error reloading {csv_file}: {e}")
+                continue
+            self.files[csv_file] = new_state
+
+            if category is None:
+                removed.append(csv_file.stem)
+            else:
+                changed[category.id] = category
+
+        for csv_file in set(self.files) - seen:
+            del self.files[csv_file]
+            removed.append(csv_file.stem)
+
+        if not changed and not removed:
+            return None
+        return DataChange(changed, removed)
+
+
+def read_file(csv_file: Path) -> tuple[FileState, bytes]:
+    """Read a file along with its current state."""
+    stat = csv_file.stat()
+    content = csv_file.read_bytes()
+    digest = hashlib.sha256(content).digest()
+    return FileState(stat.st_mtime_ns, stat.st_size, digest), content
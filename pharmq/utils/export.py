@@ -0,0 +1,207 @@
+"""Export generated questions as an exam, for use outside the app.
+
+Questions are generated in chunks of `CHUNK_SIZE`, each seeded from the
+export seed and its own number only, so chunks can be generated in any
+order and by any process. Worker processes generate and format whole
+chunks, and the launcher writes them out in order as they come back, with
+at most a few chunks in flight, so memory stays flat however many
+questions are exported, and the output for a seed is the same byte for
+byte whatever the number of workers.
+
+Formats:
+
+    jsonl   one `QuizQuestion` per line, as JSON
+    csv     one question per row: the characteristics asked about, the
+            four options, and the letter and text of the answer
+    anki    a tab-separated file with Anki's import headers, one Basic
+            note per question, tagged with its category
+"""
+
+import csv
+import html
+import io
+import json
+import os
+import random
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import asdict
+from typing import BinaryIO, Callable, Iterable
+
+from ..models.distractors import SimilarAnswers
+from ..models.quiz import QuizGenerator, QuizQuestion
+from .data_loader import DATA_DIR, load_csv_data
+
+CHUNK_SIZE = 1000
+"""Questions per seed; changing it changes what a seed exports."""
+
+LETTERS = "ABCD"
+
+CSV_HEADER = [
+    "category",
+    "row",
+    "question",
+    "option_a",
+    "option_b",
+    "option_c",
+    "option_d",
+    "answer",
+    "answer_text",
+]
+
+ANKI_HEADER = (
+    "#separator:tab\n#html:true\n#notetype:Basic\n#deck:PharmQ\n#tags column:3\n"
+)
+
+# The generator of this process, set up by `init_worker`
+_generator: QuizGenerator | None = None
+
+
+def init_worker(data_dir: str, distractors: str, cross_category: bool) -> None:
+    """Load the data and build the generator once per worker process."""
+    global _generator
+    similar_answers = SimilarAnswers(data_dir) if distractors == "similar" else None
+    _generator = QuizGenerator(
+        load_csv_data(data_dir),
+        similar_answers=similar_answers,
+        cross_category=cross_category,
+    )
+
+
+def generate_chunk(
+    seed: int, chunk: int, count: int, categories: set[str] | None, fmt: str
+) -> bytes:
+    """Generate and format the questions of one chunk."""
+    assert _generator is not None, "init_worker was not called"
+    rng = random.Random(f"pharmq-export:{seed}:{chunk}")
+    questions = [
+        _generator.generate_question(categories, rng) for _ in range(count)
+    ]
+    return FORMATTERS[fmt](questions).encode("utf-8")
+
+
+def format_jsonl(questions: Iterable[QuizQuestion]) -> str:
+    return "".join(
+        json.dumps(asdict(question), ensure_ascii=False) + "\n"
+        for question in questions
+    )
+
+
+def format_csv(questions: Iterable[QuizQuestion]) -> str:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    for question in questions:
+        writer.writerow(
+            [
+                question.category_name,
+                question.row_index,
+                "\n".join(
+                    f"{field}: {value}"
+                    for field, value in question.characteristics.items()
+                ),
+                *(option.text for option in question.options),
+                LETTERS[question.answer_index],
+                question.answer,
+            ]
+        )
+    return out.getvalue()
+
+
+def format_anki(questions: Iterable[QuizQuestion]) -> str:
+    out = io.StringIO()
+    writer = csv.writer(out, delimiter="\t", lineterminator="\n")
+    for question in questions:
+        front = "<br>".join(
+            f"<b>{_html(field)}</b>: {_html(value)}"
+            for field, value in question.characteristics.items()
+        )
+        front += "<br><br>" + "<br>".join(
+            f"{letter}. {_html(option.text)}"
+            for letter, option in zip(LETTERS, question.options)
+        )
+        back = f"{LETTERS[question.answer_index]}. {_html(question.answer)}"
+        writer.writerow([front, back, question.category_name])
+    return out.getvalue()
+
+
+def _html(text: str) -> str:
+    return html.escape(text, quote=False).replace("\n", "<br>")
+
+
+FORMATTERS: dict[str, Callable[[Iterable[QuizQuestion]], str]] = {
+    "jsonl": format_jsonl,
+    "csv": format_csv,
+    "anki": format_anki,
+}
+
+
+def export_questions(
+    out: BinaryIO,
+    count: int,
+    seed: int,
+    fmt: str = "jsonl",
+    workers: int = 1,
+    categories: set[str] | None = None,
+    data_dir: str = DATA_DIR,
+    distractors: str = "random",
+    cross_category: bool = False,
+) -> None:
+    """Write `count` questions to `out`, generated by `workers` processes.
+
+    Raises ValueError if there is no data, or a category is not in it.
+    """
+    # Checks the data, and computes what workers would otherwise all compute
+    options = (data_dir, distractors, cross_category)
+    init_worker(*options)
+    assert _generator is not None
+    if not _generator.categories:
+        raise ValueError(f"No data files found in {data_dir}")
+    unknown = sorted((categories or set()) - set(_generator.categories))
+    if unknown:
+        raise ValueError(f"Unknown categories: {', '.join(unknown)}")
+    if _generator.similar_answers is not None:
+        _generator.similar_answers.prepare(_generator)
+
+    if fmt == "csv":
+        out.write(_csv_line(CSV_HEADER).encode("utf-8"))
+    elif fmt == "anki":
+        out.write(ANKI_HEADER.encode("utf-8"))
+
+    chunks = [
+        (seed, chunk, min(CHUNK_SIZE, count - start), categories, fmt)
+        for chunk, start in enumerate(range(0, count, CHUNK_SIZE))
+    ]
+
+    if workers <= 1:
+        for args in chunks:
+            out.write(generate_chunk(*args))
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_worker,
+        initargs=options,
+    ) as executor:
+        # Submitted a few at a time, so finished chunks do not pile up when
+        # writing is slower than generating
+        in_flight: deque[Future[bytes]] = deque()
+        for args in chunks:
+            in_flight.append(executor.submit(generate_chunk, *args))
+            if len(in_flight) >= 2 * workers:
+                out.write(in_flight.popleft().result())
+        while in_flight:
+            out.write(in_flight.popleft().result())
+
+
+def _csv_line(row: list[str]) -> str:
+    out = io.StringIO()
+    csv.writer(out).writerow(row)
+    return out.getvalue()
+
+
+def default_workers() -> int:
+    """One worker per CPU this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        return os.cpu_count() or 1
@@ -0,0 +1,293 @@
+"""Counters, gauges and histograms for the hot paths, in Prometheus format.
+
+Metrics are off unless `PHARMQ_METRICS` is set, or `enable` is called before
+the instrumented modules are imported. While off, `timed` returns functions
+unchanged, so instrumented code runs exactly as it would without it.
+
+Session processes cannot be scraped themselves. When `PHARMQ_METRICS_DIR`
+is set, each one writes its metrics to a file there with `dump`, and the
+server adds them up with `collect`.
+"""
+
+import bisect
+import functools
+import inspect
+import json
+import math
+import os
+import time
+from pathlib import Path
+from typing import Callable, Iterable, TypeVar
+
+METRICS_ENV = "PHARMQ_METRICS"
+METRICS_DIR_ENV = "PHARMQ_METRICS_DIR"
+
+ENABLED = bool(os.environ.get(METRICS_ENV))
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)  # fmt: skip
+
+F = TypeVar("F", bound=Callable)
+
+
+def enable(directory: str | os.PathLike | None = None) -> None:
+    """Turn metrics on, here and in processes started from now on."""
+    global ENABLED
+    ENABLED = True
+    os.environ[METRICS_ENV] = "1"
+    if directory is not None:
+        os.environ[METRICS_DIR_ENV] = str(directory)
+
+
+class Counter:
+    """A value that only goes up."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def samples(self) -> dict:
+        return {"kind": self.kind, "help": self.help, "value": self.value}
+
+    def merge(self, samples: dict) -> None:
+        self.value += samples["value"]
+
+    def render(self) -> Iterable[str]:
+        yield f"{self.name} {_number(self.value)}"
+
+
+class Gauge(Counter):
+    """A value that goes up and down."""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Histogram:
+    """Observations counted in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self) -> dict:
+        return {
+            "kind": self.kind,
+            "help": self.help,
+            "buckets": self.buckets,
+            "counts": self.counts,
+            "sum": self.sum,
+        }
+
+    def merge(self, samples: dict) -> None:
+        for index, count in enumerate(samples["counts"]):
+            self.counts[index] += count
+        self.sum += samples["sum"]
+
+    def render(self) -> Iterable[str]:
+        cumulative = 0
+        for bound, count in zip((*self.buckets, math.inf), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == math.inf else _number(bound)
+            yield f'{self.name}_bucket{{le="{le}"}} {cumulative}'
+        yield f"{self.name}_sum {_number(self.sum)}"
+        yield f"{self.name}_count {cumulative}"
+
+
+Metric = Counter | Gauge | Histogram
+
+
+class Registry:
+    """All metrics of a process, by name."""
+
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def _add(self, metric: Metric) -> Metric:
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._add(Counter(name, help))  # type: ignore[return-value]
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self._add(Gauge(name, help))  # type: ignore[return-value]
+
+    def histogram(
+        self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._add(Histogram(name, help, buckets))  # type: ignore[return-value]
+
+    def samples(self) -> dict:
+        return {name: metric.samples() for name, metric in self.metrics.items()}
+
+    def merge(self, samples: dict) -> None:
+        """Add in the samples of another registry."""
+        for name, values in samples.items():
+            metric = self.metrics.get(name)
+            if metric is None:
+                if values["kind"] == "histogram":
+                    buckets = tuple(values["buckets"])
+                    metric = self.histogram(name, values["help"], buckets)
+                elif values["kind"] == "gauge":
+                    metric = self.gauge(name, values["help"])
+                else:
+                    metric = self.counter(name, values["help"])
+            metric.merge(values)
+
+    def render(self, others: Iterable[dict] = ()) -> str:
+        """Prometheus text format, adding in samples from other processes."""
+        total = Registry()
+        total.merge(self.samples())
+        for samples in others:
+            total.merge(samples)
+
+        lines = []
+        for metric in total.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def timed(name: str, help: str) -> Callable[[F], F]:
+    """Time every call of a function in a histogram, when metrics are on.
+
+    Generator functions are timed until they are exhausted, and coroutine
+    functions until they return.
+    """
+
+    def decorator(func: F) -> F:
+        if not ENABLED:
+            return func
+        histogram = REGISTRY.histogram(name, help)
+
+        if inspect.isgeneratorfunction(func):
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return (yield from func(*args, **kwargs))
+                finally:
+                    histogram.observe(time.perf_counter() - start)
+
+        elif inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start)
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+def exporting() -> bool:
+    """Whether this process should `dump` its metrics for a server to collect."""
+    return ENABLED and bool(os.environ.get(METRICS_DIR_ENV))
+
+
+def dump() -> None:
+    """Write this process's metrics to the metrics directory, if there is one."""
+    if not exporting():
+        return
+    path = Path(os.environ[METRICS_DIR_ENV]) / f"{os.getpid()}.json"
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(REGISTRY.samples()), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def collect() -> list[dict]:
+    """Read the metrics written by other processes.
+
+    Files of processes that have exited are folded into one, so the
+    directory does not grow with every session ever served.
+    """
+    directory = os.environ.get(METRICS_DIR_ENV)
+    if not directory:
+        return []
+
+    retired_path = Path(directory) / "retired.json"
+    retired = Registry()
+    retired.merge(_read(retired_path) or {})
+    collected = []
+    folded = False
+    for path in Path(directory).glob("*.json"):
+        if path == retired_path or not path.stem.isdigit():
+            continue
+        samples = _read(path)
+        if samples is None:
+            continue
+        if _alive(int(path.stem)):
+            collected.append(samples)
+            continue
+        retired.merge(samples)
+        path.unlink(missing_ok=True)
+        folded = True
+
+    if folded:
+        tmp_path = retired_path.with_name(retired_path.name + ".tmp")
+        tmp_path.write_text(json.dumps(retired.samples()), encoding="utf-8")
+        os.replace(tmp_path, retired_path)
+    return [retired.samples(), *collected]
+
+
+def _read(path: Path) -> dict | None:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
@@ -0,0 +1,233 @@
+"""Persistent record of every answer, in SQLite.
+
+Answers are recorded from the Textual event loop, which must never wait on
+the disk. `ProgressStore.record` only puts the answer on a queue; a writer
+thread drains the queue and writes whatever has piled up in one
+transaction. Per-category totals are kept up to date in the same
+transaction, so accuracy queries read a handful of rows however many
+answers were given. Opening the database is left to the writer thread and
+to the first query too, so creating a store does not touch the disk.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from .data_loader import state_dir
+
+DEFAULT_USER = "local"
+
+USER_ENV = "PHARMQ_USER"
+"""Set for a session process by `ProcessServer`, to the user it serves."""
+
+PROGRESS_FILE = "progress.db"
+"""Name of the database in `state_dir()`."""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY,
+    user TEXT NOT NULL,
+    category TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    correct INTEGER NOT NULL,
+    answered_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_card ON answers (user, category, row);
+
+CREATE TABLE IF NOT EXISTS category_totals (
+    user TEXT NOT NULL,
+    category TEXT NOT NULL,
+    answered INTEGER NOT NULL,
+    correct INTEGER NOT NULL,
+    PRIMARY KEY (user, category)
+);
+"""
+
+UPDATE_TOTALS = """
+INSERT INTO category_totals (user, category, answered, correct)
+VALUES (?, ?, 1, ?)
+ON CONFLICT (user, category) DO UPDATE SET
+    answered = answered + 1,
+    correct = correct + excluded.correct
+"""
+
+
+class Answer(NamedTuple):
+    """One recorded answer."""
+
+    user: str
+    category: str
+    row: int
+    correct: bool
+    answered_at: float
+
+
+class Accuracy(NamedTuple):
+    """How many answers were given, and how many were correct."""
+
+    answered: int
+    correct: int
+
+    @property
+    def ratio(self) -> float:
+        return self.correct / self.answered if self.answered else 0.0
+
+
+class ProgressStore:
+    """Answers of all users, written behind by a background thread."""
+
+    BATCH_SIZE = 256
+    """Most answers written in one transaction."""
+
+    FLUSH_INTERVAL = 0.5
+    """Seconds to let answers pile up before writing them."""
+
+    def __init__(self, path: str | Path | None = None) -> None:
+        """
+        Args:
+            path: The database file, or None for `progress.db` in
+                `state_dir()`.
+        """
+        self.path = state_dir() / PROGRESS_FILE if path is None else Path(path)
+
+        self._reader: sqlite3.Connection | None = None  # opened on first query
+        self._read_lock = threading.Lock()
+
+        self._queue: queue.SimpleQueue[Answer | threading.Event | None] = (
+            queue.SimpleQueue()
+        )
+        self._writer = threading.Thread(
+            target=self._write_behind, name="progress-writer", daemon=True
+        )
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        # Readers do not block the writer, and commits skip most fsyncs
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        return connection
+
+    def _read(self, sql: str, parameters: tuple) -> list[tuple]:
+        with self._read_lock:
+            if self._reader is None:
+                self._reader = self._connect()
+            return self._reader.execute(sql, parameters).fetchall()
+
+    def record(self, user: str, category: str, row: int, correct: bool) -> None:
+        """Queue an answer to be written; never blocks."""
+        self._queue.put(Answer(user, category, row, correct, time.time()))
+
+    def flush(self) -> None:
+        """Block until every answer recorded so far is written."""
+        written = threading.Event()
+        self._queue.put(written)
+        written.wait()
+
+    def close(self) -> None:
+        """Write the remaining answers and stop the writer thread."""
+        self._queue.put(None)
+        self._writer.join()
+        with self._read_lock:
+            if self._reader is not None:
+                self._reader.close()
+
+    def _write_behind(self) -> None:
+        connection: sqlite3.Connection | None = None  # opened on first write
+        try:
+            while True:
+                batch: list[Answer] = []
+                waiting: list[threading.Event] = []
+                closing = False
+
+                item = self._queue.get()
+                deadline = time.monotonic() + self.FLUSH_INTERVAL
+                while True:
+                    if item is None:
+                        closing = True
+                        break
+                    if isinstance(item, threading.Event):
+                        waiting.append(item)
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.BATCH_SIZE:
+                        break
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+
+                if batch:
+                    try:
+                        if connection is None:
+                            connection = self._connect()
+                        self._write(connection, batch)
+                    except Exception as e:
+                        # Anything at all, as the thread has to live on to
+                        # wake those waiting in `flush` and `close`
+                        print(f"Error writing progress: {e}")
+                for event in waiting:
+                    event.set()
+                if closing:
+                    return
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def _write(self, connection: sqlite3.Connection, batch: list[Answer]) -> None:
+        with connection:
+            connection.executemany(
+                "INSERT INTO answers (user, category, row, correct, answered_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                batch,
+            )
+            connection.executemany(
+                UPDATE_TOTALS,
+                [(answer.user, answer.category, answer.correct) for answer in batch],
+            )
+
+    def answers(self, user: str) -> list[Answer]:
+        """Every answer a user gave, oldest first.
+
+        Answers still waiting in the queue are not included.
+        """
+        rows = self._read(
+            "SELECT category, row, correct, answered_at FROM answers"
+            " WHERE user = ? ORDER BY id",
+            (user,),
+        )
+        return [
+            Answer(user, category, row, bool(correct), answered_at)
+            for category, row, correct, answered_at in rows
+        ]
+
+    def category_accuracy(self, user: str) -> dict[str, Accuracy]:
+        """Answers given and answered correctly, per category.
+
+        Answers still waiting in the queue are not counted.
+        """
+        rows = self._read(
+            "SELECT category, answered, correct FROM category_totals WHERE user = ?",
+            (user,),
+        )
+        return {
+            category: Accuracy(answered, correct)
+            for category, answered, correct in rows
+        }
+
+    def row_accuracy(self, user: str, category: str) -> dict[int, Accuracy]:
+        """Answers given and answered correctly, per row of a category."""
+        rows = self._read(
+            "SELECT row, COUNT(*), SUM(correct) FROM answers"
+            " WHERE user = ? AND category = ? GROUP BY row",
+            (user, category),
+        )
+        return {row: Accuracy(answered, correct) for row, answered, correct in rows}
@@ -0,0 +1,80 @@
+"""Share one parsed copy of the dataset between session processes.
+
+With one process per session, every process would otherwise parse the CSV
+files and hold its own copy of every row. The launcher instead compiles the
+categories once, in the snapshot layout, into a `multiprocessing.shared_memory`
+block, and names it in the `PHARMQ_SHARED_DATASET` environment variable.
+Session processes inherit the variable and attach to the block: rows are
+read straight out of the shared pages, so data memory stays the same however
+many sessions are connected.
+"""
+
+import os
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict
+
+from ..models.category import Category
+from .snapshot import Snapshot, encode_snapshot, matches_data
+
+SHARED_DATASET_ENV = "PHARMQ_SHARED_DATASET"
+
+
+class AttachedMemory(SharedMemory):
+    """A shared memory block attached to by a session process."""
+
+    def __del__(self) -> None:
+        # Row views keep the buffer exported until the process exits, so it
+        # cannot be closed; the OS releases the mapping on exit
+        pass
+
+
+def publish_dataset(
+    data_dir: str | os.PathLike, categories: Dict[str, Category]
+) -> SharedMemory:
+    """Copy categories into a new shared memory block.
+
+    The caller owns the block, and should `close` and `unlink` it once no
+    session process needs it any more.
+    """
+    data = encode_snapshot(categories, data_dir)
+    shm = SharedMemory(create=True, size=len(data))
+    shm.buf[: len(data)] = data
+    return shm
+
+
+def attach_dataset(
+    name: str, data_dir: str | os.PathLike
+) -> Dict[str, Category] | None:
+    """Build categories backed by a shared memory block.
+
+    Returns None if the block does not exist, is unreadable, or no longer
+    matches the CSV files in `data_dir`, in which case the caller should load
+    the data itself.
+    """
+    try:
+        shm = AttachedMemory(name=name)
+    except (OSError, ValueError):
+        return None
+
+    # Before Python 3.13, attaching registers the block with this process's
+    # resource tracker, which would unlink it when the session exits
+    resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore[attr-defined]
+
+    try:
+        snapshot = Snapshot(shm.buf)
+    except ValueError:
+        return None
+    if not matches_data(snapshot, data_dir):
+        # The data was edited after the launcher published it
+        return None
+
+    return snapshot.categories()
+
+
+def load_shared_dataset(data_dir: str | os.PathLike) -> Dict[str, Category] | None:
+    """Attach to the block named in the environment, if there is one."""
+    name = os.environ.get(SHARED_DATASET_ENV)
+    if not name:
+        return None
+    return attach_dataset(name, data_dir)
@@ -0,0 +1,292 @@
+"""Compiled, memory-mappable snapshot of the data directory.
+
+Parsing every CSV with `csv.DictReader` in every session process is wasted
+work: the data only changes when someone edits it. `write_snapshot` compiles
+the parsed categories into one binary file, and `load_snapshot` maps it into
+memory and serves rows straight out of the mapped pages, so all processes on
+a machine share a single copy through the page cache.
+
+Layout (all integers are little-endian u32)::
+
+    header       magic, version, sha256 of the CSVs, sha256 of their names,
+                 sizes and modification times, string count, category
+                 count, and the offsets of the sections below
+    offsets      string count + 1 offsets into the string data
+    strings      UTF-8 string data, every distinct value stored once
+    categories   per category: name id, column count, row count, then the
+                 header string ids, then one absolute offset per column
+    columns      per column: one string id per row
+
+Column 0 of each category is its answer field. Missing cells are stored as
+`MISSING` and read back as `None`, as `csv.DictReader` would give them.
+
+A snapshot is only used while it matches the CSV files. When none of them
+was touched since it was written, that is told from their sizes and times
+alone; otherwise their contents are hashed and compared.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import Dict
+
+from ..models.category import Category
+from ..models.columnar import ColumnarTable
+
+SNAPSHOT_NAME = "dataset.snapshot"
+
+MAGIC = b"PHQS"
+VERSION = 2
+MISSING = 0xFFFFFFFF
+
+HEADER = struct.Struct("<4sI32s32sIIIII")
+
+
+def dataset_digest(data_dir: str | os.PathLike) -> bytes:
+    """Hash the names and contents of all CSV files in a directory."""
+    digest = hashlib.sha256()
+    for csv_file in sorted(Path(data_dir).glob("*.csv")):
+        digest.update(csv_file.name.encode("utf-8") + b"\0")
+        digest.update(csv_file.read_bytes() + b"\0")
+    return digest.digest()
+
+
+def dataset_stamp(data_dir: str | os.PathLike) -> bytes:
+    """Hash the names, sizes and modification times of all CSV files.
+
+    Cheap next to `dataset_digest`, as the files are not read.
+    """
+    digest = hashlib.sha256()
+    for csv_file in sorted(Path(data_dir).glob("*.csv")):
+        stat = csv_file.stat()
+        digest.update(
+            f"{csv_file.name}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode("utf-8")
+        )
+    return digest.digest()
+
+
+def matches_data(snapshot: "Snapshot", data_dir: str | os.PathLike) -> bool:
+    """Whether a snapshot was compiled from the CSV files as they are now."""
+    try:
+        if snapshot.stamp == dataset_stamp(data_dir):
+            return True
+        # Touched, but maybe not changed, e.g. by a checkout
+        return snapshot.digest == dataset_digest(data_dir)
+    except OSError:
+        return False
+
+
+def write_snapshot(
+    data_dir: str | os.PathLike,
+    categories: Dict[str, Category],
+    path: str | os.PathLike | None = None,
+) -> Path:
+    """Compile parsed categories into a snapshot file.
+
+    The file is written next to the data by default, and replaced atomically
+    so processes that still map the old snapshot are not disturbed.
+    """
+    path = Path(data_dir) / SNAPSHOT_NAME if path is None else Path(path)
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(encode_snapshot(categories, data_dir))
+    os.replace(tmp_path, path)
+
+    return path
+
+
+def encode_snapshot(
+    categories: Dict[str, Category], data_dir: str | os.PathLike
+) -> bytes:
+    """Compile categories parsed from `data_dir` into the bytes of a snapshot."""
+    # Stamped before hashing, so a file edited in between makes the stamp
+    # stale rather than the digest
+    stamp = dataset_stamp(data_dir)
+    digest = dataset_digest(data_dir)
+
+    strings: dict[str, int] = {}
+
+    def intern(value: str | None) -> int:
+        if value is None:
+            return MISSING
+        return strings.setdefault(value, len(strings))
+
+    tables = []
+    for name, category in categories.items():
+        header = [category.answer_field, *category.fields]
+        columns = [
+            array("I", (intern(row.get(column)) for row in category.data))
+            for column in header
+        ]
+        tables.append(
+            (intern(name), [intern(column) for column in header], columns, len(category.data))
+        )
+
+    encoded = [value.encode("utf-8") for value in strings]
+    offsets = array("I", [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    blob = b"".join(encoded)
+
+    offsets_pos = HEADER.size
+    strings_pos = offsets_pos + 4 * len(offsets)
+    categories_pos = _align(strings_pos + len(blob))
+
+    # Lay out the category directory first, so column offsets are known
+    directory = array("I")
+    column_data = []
+    columns_pos = categories_pos + sum(4 * (3 + 2 * len(t[1])) for t in tables)
+    for name_id, header_ids, columns, n_rows in tables:
+        directory.extend([name_id, len(header_ids), n_rows, *header_ids])
+        for column in columns:
+            directory.append(columns_pos)
+            column_data.append(column)
+            columns_pos += 4 * n_rows
+
+    header = HEADER.pack(
+        MAGIC,
+        VERSION,
+        digest,
+        stamp,
+        len(encoded),
+        len(tables),
+        offsets_pos,
+        strings_pos,
+        categories_pos,
+    )
+
+    return b"".join(
+        [
+            header,
+            _le_bytes(offsets),
+            blob,
+            b"\0" * (categories_pos - strings_pos - len(blob)),
+            _le_bytes(directory),
+            *(_le_bytes(column) for column in column_data),
+        ]
+    )
+
+
+def load_snapshot(
+    data_dir: str | os.PathLike,
+    path: str | os.PathLike | None = None,
+) -> Dict[str, Category] | None:
+    """Map a snapshot and build categories backed by it.
+
+    Returns None if there is no snapshot, or if it is stale or unreadable,
+    in which case the caller should parse the CSV files instead.
+    """
+    path = Path(data_dir) / SNAPSHOT_NAME if path is None else Path(path)
+    if sys.byteorder != "little":
+        # Columns are read with native `memoryview.cast`
+        return None
+
+    try:
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        snapshot = Snapshot(buffer)
+    except ValueError:
+        return None
+    if not matches_data(snapshot, data_dir):
+        return None
+
+    return snapshot.categories()
+
+
+class Snapshot:
+    """Read-only view over the bytes of a snapshot."""
+
+    def __init__(self, buffer) -> None:
+        self.view = view = memoryview(buffer)
+        if len(view) < HEADER.size:
+            raise ValueError("Snapshot is truncated")
+
+        (
+            magic,
+            version,
+            self.digest,
+            self.stamp,
+            n_strings,
+            self.n_categories,
+            offsets_pos,
+            strings_pos,
+            self.categories_pos,
+        ) = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a snapshot, or written by another version")
+
+        self.offsets = view[offsets_pos : offsets_pos + 4 * (n_strings + 1)].cast("I")
+        self.strings = view[strings_pos : strings_pos + self.offsets[-1]]
+
+    def string(self, string_id: int) -> str | None:
+        """Decode a string from the string table."""
+        if string_id == MISSING:
+            return None
+        offsets = self.offsets
+        return str(self.strings[offsets[string_id] : offsets[string_id + 1]], "utf-8")
+
+    def categories(self) -> Dict[str, Category]:
+        """Build a `Category` for every table in the snapshot."""
+        categories = {}
+        words = self.view[self.categories_pos :]
+        pos = 0
+
+        for _ in range(self.n_categories):
+            name_id, n_columns, n_rows = words[pos : pos + 12].cast("I")
+            pos += 12
+            header = [
+                self.string(string_id)
+                for string_id in words[pos : pos + 4 * n_columns].cast("I")
+            ]
+            pos += 4 * n_columns
+            columns = [
+                self.view[offset : offset + 4 * n_rows].cast("I")
+                for offset in words[pos : pos + 4 * n_columns].cast("I")
+            ]
+            pos += 4 * n_columns
+
+            name = self.string(name_id)
+            assert name is not None
+            categories[name] = Category(
+                id=name,
+                data=SnapshotTable(self, header, columns),
+                fields=header[1:],
+                answer_field=header[0],
+            )
+
+        return categories
+
+
+class SnapshotTable(ColumnarTable):
+    """The rows of one category, read from a snapshot on access.
+
+    Codes are the snapshot's string ids, shared by all of its categories.
+    """
+
+    def __init__(
+        self, snapshot: Snapshot, header: list[str], columns: list[memoryview]
+    ) -> None:
+        super().__init__(header, columns, snapshot.string)
+        self.snapshot = snapshot
+
+
+def _align(pos: int) -> int:
+    """Round up to a multiple of 4, so columns can be cast to u32."""
+    return (pos + 3) & ~3
+
+
+def _le_bytes(values: array) -> bytes:
+    """Little-endian bytes of a u32 array."""
+    if sys.byteorder != "little":
+        values = array("I", values)
+        values.byteswap()
+    return values.tobytes()
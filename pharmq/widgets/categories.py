@@ -1,10 +1,17 @@
-from typing import Dict, Unpack
+import asyncio
+import re
+from typing import Dict
 
+from rich.text import Text
+from textual import on, work
 from textual.app import ComposeResult
-from textual.containers import Container, Horizontal, ScrollableContainer, Vertical
-from textual.widgets import DataTable, Label, Static, Tree
+from textual.containers import Horizontal, ScrollableContainer, Vertical
+from textual.widgets import DataTable, Input, Label, Static, Tree
+from textual.widgets.data_table import RowKey
 
 from ..models.category import Category
+from ..models.search import SearchIndex, match_spans
+from ..utils.metrics import timed
 
 
 class SimpleTOC(Tree):
@@ -14,22 +21,48 @@ class SimpleTOC(Tree):
     #     # super().__init__("Categories")
     #     self.show_root = False
 
-    def on_tree_node_selected(self, event: Tree.NodeSelected) -> None:
-        """Handle node selection."""
-        if table_id := event.node.data:
-            table = self.app.query_one(f"#{table_id}", DataTable)
-            table.scroll_visible()
-
 
 class CategoryTable(Static):
-    """A widget to display category data tables with navigation."""
+    """A widget to display category data tables with navigation.
+
+    Tables are only built when they are needed: when their section scrolls
+    into view, when they are picked in the table of contents, or when a quiz
+    option links to them. Rows are added a page at a time as the bottom of a
+    table comes into view.
+
+    A table holds a window of its category's rows, which starts at row 0
+    unless a link jumped far ahead: the window then starts at the linked
+    row's page, so a jump costs the same however far down the row is, and
+    it grows upwards when its top is scrolled into view.
+
+    Typing in the search box replaces the tables with the matching rows of
+    every category, with the matches highlighted. Selecting a match shows it
+    in its full table.
+    """
 
-    def __init__(self, categories: Dict[str, Category]) -> None:
+    PAGE_SIZE = 50
+    """Number of rows added to a table at a time."""
+
+    SEARCH_LIMIT = 200
+    """Most matching rows shown for a search."""
+
+    def __init__(
+        self, categories: Dict[str, Category], search_index: SearchIndex | None = None
+    ) -> None:
         super().__init__()
         self.categories = categories
+        self.search_index = (
+            SearchIndex(categories) if search_index is None else search_index
+        )
+        self.tables: Dict[str, DataTable] = {}
+        self.first_rows: Dict[str, int] = {}  # category -> first row in table
+        self.loaded_rows: Dict[str, int] = {}  # category -> end of rows in table
+        # (category, row) -> where the row is, for rows in a table
+        self.row_keys: Dict[tuple[str, int], tuple[DataTable, RowKey]] = {}
 
+    @timed("pharmq_category_table_compose_seconds", "Time to compose CategoryTable")
     def compose(self) -> ComposeResult:
-        """Create tables for all categories with TOC"""
+        """Create the TOC, and a placeholder for each category table"""
         with Horizontal():
             # Left side: Table of Contents
             with Vertical() as left_side:
@@ -43,59 +76,250 @@ class CategoryTable(Static):
                 toc.show_root = False
 
                 for category in self.categories.values():
-                    toc.root.add_leaf(
-                        category.title, data=f"category-table-{category.id}"
-                    )
+                    toc.root.add_leaf(category.title, data=category.id)
                 yield toc
 
             # Right side: Tables
-            with ScrollableContainer():
-                for category_name, category in self.categories.items():
-                    yield Static(
-                        f"\n{category_name.upper()}\n", classes="category-header"
-                    )
-                    table = DataTable(
-                        id=f"category-table-{category_name}",
-                        zebra_stripes=True,
-                        header_height=2,
-                    )
-                    self.table = table
-
-                    # # Add columns
-                    # answer_column = category.data.columns[0]
-                    # table.add_columns(answer_column, *category.fields)
-
-                    # # Add rows with multi-line support
-                    # row_keys = []
-                    # for _, row in category.data.iterrows():
-                    #     table_row = [self.format_cell_content(row[answer_column])]
-                    #     table_row.extend(
-                    #         self.format_cell_content(row[field])
-                    #         for field in category.fields
-                    #     )
-                    #     key = table.add_row(*table_row, height=2)
-                    #     row_keys.append(key)
-
-                    # Add columns
-                    table.add_columns(category.answer_field, *category.fields)
-
-                    # Add rows with multi-line support
-                    row_keys = []
-                    for row in category.data:
-                        table_row = [
-                            self.format_cell_content(row[category.answer_field])
-                        ]
-                        table_row.extend(
-                            self.format_cell_content(row[field])
-                            for field in category.fields
+            with Vertical():
+                yield Input(placeholder="Search all categories", id="category-search")
+                with ScrollableContainer(id="category-tables"):
+                    for category_name in self.categories:
+                        yield Static(
+                            f"\n{category_name.upper()}\n", classes="category-header"
                         )
-                        key = table.add_row(*table_row, height=2)
-                        row_keys.append(key)
+                        yield Static(
+                            "Loading...",
+                            id=f"category-placeholder-{category_name}",
+                            classes="category-placeholder",
+                        )
+                        yield Static("\n")  # Spacing between tables
+                yield ScrollableContainer(id="search-results")
+
+    def on_mount(self) -> None:
+        container = self.query_one("#category-tables", ScrollableContainer)
+        self.watch(container, "scroll_y", self.build_visible_tables, init=False)
+        self.call_after_refresh(self.build_visible_tables)
+
+    def on_resize(self) -> None:
+        self.call_after_refresh(self.build_visible_tables)
+
+    @on(Tree.NodeSelected)
+    async def on_toc_selected(self, event: Tree.NodeSelected) -> None:
+        """Jump to the table picked in the TOC."""
+        if category_name := event.node.data:
+            table = await self.build_table(category_name)
+            table.scroll_visible()
+
+    async def build_visible_tables(self) -> None:
+        """Build the tables in view, and page in rows near the edges of view."""
+        container = self.query_one("#category-tables", ScrollableContainer)
+        top = container.scroll_y
+        bottom = top + container.scrollable_content_region.height
+
+        for category_name, category in self.categories.items():
+            table = self.tables.get(category_name)
+            if table is None:
+                placeholder = self.query_one(f"#category-placeholder-{category_name}")
+                region = placeholder.virtual_region
+                if region.y < bottom and region.bottom > top:
+                    await self.build_table(category_name)
+                continue
+
+            region = table.virtual_region
+            if self.loaded_rows[category_name] < len(category.data):
+                # Keep a screen of rows ready below the visible area
+                if region.bottom < bottom + container.size.height:
+                    self.load_rows(category_name, self.PAGE_SIZE)
+            if self.first_rows[category_name] > 0 and top < region.y < bottom:
+                # The top of a table that starts further down is in view
+                self.load_earlier_rows(category_name)
+
+    async def build_table(self, category_name: str, start: int = 0) -> DataTable:
+        """Build and mount the table of a category, if not built already.
+
+        A new table starts at row `start`, which should begin a page.
+        """
+        if category_name in self.tables:
+            return self.tables[category_name]
 
-                    yield table
-                    yield Static("\n")  # Spacing between tables
+        category = self.categories[category_name]
+        table = DataTable(
+            id=f"category-table-{category_name}",
+            zebra_stripes=True,
+            header_height=2,
+        )
+        self.tables[category_name] = table
+        self.first_rows[category_name] = self.loaded_rows[category_name] = start
 
-        self.row_keys = row_keys
+        # Add columns
+        table.add_columns(category.answer_field, *category.fields)
+        self.load_rows(category_name, self.PAGE_SIZE)
+
+        placeholder = self.query_one(f"#category-placeholder-{category_name}")
+        container = self.query_one("#category-tables", ScrollableContainer)
+        await container.mount(table, after=placeholder)
+        await placeholder.remove()
+        return table
+
+    def load_rows(self, category_name: str, count: int) -> None:
+        """Add the next `count` rows of a category to its table."""
+        category = self.categories[category_name]
+        table = self.tables[category_name]
+        start = self.loaded_rows[category_name]
+        end = min(start + count, len(category.data))
+
+        # Add rows with multi-line support
+        for row_idx in range(start, end):
+            row = category.data[row_idx]
+            table_row = [self.format_cell_content(row[category.answer_field])]
+            table_row.extend(
+                self.format_cell_content(row[field]) for field in category.fields
+            )
+            row_key = table.add_row(*table_row, height=2)
+            self.row_keys[category_name, row_idx] = (table, row_key)
+
+        self.loaded_rows[category_name] = end
+
+    def clear_rows(self, category_name: str, start: int) -> None:
+        """Empty a table, to refill it from row `start`."""
+        for row_idx in range(
+            self.first_rows[category_name], self.loaded_rows[category_name]
+        ):
+            del self.row_keys[category_name, row_idx]
+        self.tables[category_name].clear()
+        self.first_rows[category_name] = self.loaded_rows[category_name] = start
+
+    def load_earlier_rows(self, category_name: str) -> None:
+        """Add the page of rows before the first row in a table."""
+        table = self.tables[category_name]
+        first = self.first_rows[category_name]
+        end = self.loaded_rows[category_name]
+        start = max(0, first - self.PAGE_SIZE)
+        cursor = table.cursor_row
+
+        # Rows cannot be inserted at the top, so the table is refilled
+        self.clear_rows(category_name, start)
+        self.load_rows(category_name, end - start)
+        table.move_cursor(row=cursor + first - start, scroll=False)
+        # Keep the rows that were in view where they were
+        container = self.query_one("#category-tables", ScrollableContainer)
+        container.scroll_relative(y=2 * (first - start), animate=False)
+
+    @on(Input.Changed, "#category-search")
+    def on_search_changed(self, event: Input.Changed) -> None:
+        self.search(event.value)
+
+    @work(exclusive=True, group="search")
+    async def search(self, query: str) -> None:
+        """Show the rows matching a query instead of the tables."""
+        if not query.strip():
+            await self.clear_search()
+            return
+
+        # Waits for the index if it is still being built
+        found = await asyncio.to_thread(
+            self.search_index.search, query, self.SEARCH_LIMIT
+        )
+        pattern = self.search_index.highlighter(query)
+
+        widgets: list[Static | DataTable] = []
+        if not found.rows:
+            widgets.append(Static("No matches", classes="category-placeholder"))
+        for category_name, rows in found.rows.items():
+            category = self.categories[category_name]
+            widgets.append(
+                Static(
+                    f"\n{category_name.upper()} ({len(rows)})\n",
+                    classes="category-header",
+                )
+            )
+            table = DataTable(
+                id=f"search-table-{category_name}",
+                zebra_stripes=True,
+                header_height=2,
+            )
+            table.add_columns(category.answer_field, *category.fields)
+            for row_idx in rows:
+                row = category.data[row_idx]
+                table.add_row(
+                    *(
+                        self.highlight(row[field], pattern)
+                        for field in (category.answer_field, *category.fields)
+                    ),
+                    height=2,
+                    key=str(row_idx),
+                )
+            widgets.append(table)
+        if not found.complete:
+            widgets.append(
+                Static(
+                    f"Showing the first {self.SEARCH_LIMIT} matches",
+                    classes="category-placeholder",
+                )
+            )
+
+        results = self.query_one("#search-results", ScrollableContainer)
+        with self.app.batch_update():
+            await results.remove_children()
+            await results.mount_all(widgets)
+            self.query_one("#category-tables").display = False
+            results.display = True
+        results.scroll_home(animate=False)
+
+    async def clear_search(self) -> None:
+        """Show the tables again, instead of search results."""
+        results = self.query_one("#search-results", ScrollableContainer)
+        await results.remove_children()
+        results.display = False
+        self.query_one("#category-tables").display = True
+
+    def highlight(self, content: str, pattern: re.Pattern | None) -> Text:
+        """Format cell content, with the parts matching a search highlighted."""
+        text = Text(self.format_cell_content(content))
+        if pattern is not None:
+            for start, end in match_spans(pattern, text.plain):
+                text.stylize("bold reverse", start, end)
+        return text
+
+    @on(DataTable.RowSelected, "#search-results DataTable")
+    async def on_search_result_selected(self, event: DataTable.RowSelected) -> None:
+        """Leave the search, and show the selected row in its table."""
+        assert event.data_table.id is not None and event.row_key.value is not None
+        category_name = event.data_table.id.removeprefix("search-table-")
+        self.query_one("#category-search", Input).value = ""
+        await self.clear_search()
+        await self.show_row(category_name, int(event.row_key.value))
+
+    async def show_row(self, category_name: str, row_index: int) -> DataTable:
+        """Build a table if needed, and move its cursor to a row.
+
+        Only the target table is built, and at most a few pages of rows are
+        added, so this takes the same time for any row of any category.
+        """
+        location = self.row_keys.get((category_name, row_index))
+        if location is None:
+            page_start = row_index - row_index % self.PAGE_SIZE
+            if category_name not in self.tables:
+                await self.build_table(category_name, start=page_start)
+            else:
+                missing = row_index + 1 - self.loaded_rows[category_name]
+                if (
+                    row_index < self.first_rows[category_name]
+                    or missing > 2 * self.PAGE_SIZE
+                ):
+                    self.clear_rows(category_name, page_start)
+                    self.load_rows(category_name, self.PAGE_SIZE)
+                else:
+                    # Round up to whole pages
+                    self.load_rows(
+                        category_name, -(-missing // self.PAGE_SIZE) * self.PAGE_SIZE
+                    )
+            location = self.row_keys[category_name, row_index]
+
+        table, row_key = location
+        table.scroll_visible(duration=0.75)
+        table.move_cursor(row=table.get_row_index(row_key), scroll=True)
+        return table
 
     def format_cell_content(self, content: str) -> str:
         """Format cell content with proper line breaks."""
@@ -103,4 +327,3 @@ class CategoryTable(Static):
         # if pd.isna(content):
             return "-"
         return str(content).replace(";", "\n")
-        return str(content).replace(";", "\n")
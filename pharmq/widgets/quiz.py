@@ -1,5 +1,9 @@
-from typing import Mapping
+from collections import OrderedDict
+from typing import Hashable, Mapping
 
+from rich.console import Console, ConsoleOptions, RenderResult
+from rich.measure import Measurement
+from rich.segment import Segment
 from rich.table import Table
 from rich.text import Text
 from textual import on
@@ -16,6 +20,7 @@ from textual.widget import Widget
 from textual.widgets import Button, Label, Static
 
 from pharmq.models.quiz import QuizQuestion
+from pharmq.utils.metrics import timed
 from pharmq.widgets.quiz_option import QuizOptionWidget
 from pharmq.widgets.settings import SettingsButton
 
@@ -24,9 +29,16 @@ class QuizQuestionWidget(Static):
     """A widget to display the current question."""
 
     question: QuizQuestion | None = None
+    chosen: int | None = None
+    """Index of the option chosen for the current question, if any."""
 
     class Answered(Message):
-        pass
+        """Posted when an option is chosen."""
+
+        def __init__(self, question: QuizQuestion, correct: bool) -> None:
+            super().__init__()
+            self.question = question
+            self.correct = correct
 
     def compose(self) -> ComposeResult:
         # with Vertical(id="quiz-content"):
@@ -59,8 +71,10 @@ class QuizQuestionWidget(Static):
                             disabled=True,
                         )
 
+    @timed("pharmq_set_question_seconds", "Time to show a question's options")
     def set_question(self, question: QuizQuestion):
         self.question = question
+        self.chosen = None
 
         for button, option in zip(self.query(QuizOptionWidget), question.options):
             # assert False, (button, option)
@@ -72,25 +86,46 @@ class QuizQuestionWidget(Static):
 
     @on(QuizOptionWidget.Answered)
     def option_clicked(self, event: QuizOptionWidget.Answered):
-        assert self.question
+        if self.question is None:
+            # Clicked before the first question was shown
+            return
+
+        correct = self.choose(event.option_index)
+        if correct is not None:
+            self.post_message(self.Answered(self.question, correct))
+
+    def choose(self, option_index: int) -> bool | None:
+        """Show an option as chosen, and whether it was the answer.
 
-        assert event.button.option
+        Returns whether it was, or None if an option was chosen already.
+        """
+        assert self.question
+        if self.chosen is not None:
+            return None
+        self.chosen = option_index
 
-        for button in self.query(QuizOptionWidget):
+        buttons = self.query(QuizOptionWidget)
+        for button in buttons:
             button.btn_disabled = True
+        # Along with the feedback, so Next can be clicked as soon as it shows
+        self.query_one("#next", Button).disabled = False
+
+        button = buttons[option_index]
+        assert button.option
 
-        if event.button.option.text == self.question.answer:
+        correct = button.option.text == self.question.answer
+        if correct:
             self.query_one("#feedback", Static).update("✓ Correct!")
-            event.button.add_class("correct")
+            button.add_class("correct")
         else:
             self.query_one("#feedback", Static).update("✗ Incorrect!")
-            event.button.add_class("incorrect")
+            button.add_class("incorrect")
 
             correct_index = self.question.answer_index
-            correct_button = self.query(QuizOptionWidget)[correct_index]
+            correct_button = buttons[correct_index]
             correct_button.add_class("correct")
 
-        self.post_message(self.Answered())
+        return correct
 
 
 # def create_characteristics_table(row: pd.Series, fields: list[str]) -> Table:
@@ -112,3 +147,116 @@ def create_characteristics_table(fields: Mapping[str, str]) -> Table:
             table.add_row(f"● {field}", str(fields[field]))
 
     return table
+
+
+class CharacteristicsTableCache:
+    """Bounded LRU cache of rendered characteristics tables.
+
+    Entries are keyed by (category, row, width) and hold the rendered lines,
+    so a question that comes back is drawn without building or laying out
+    its table again. Measurements are kept the same way, with "measure"
+    added to the key, and counted apart, as every render measures first.
+    """
+
+    def __init__(self, maxsize: int = 512) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.measure_hits = 0
+        self.measure_misses = 0
+        self._entries: OrderedDict[tuple[Hashable, ...], object] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple[Hashable, ...]) -> object | None:
+        """Get an entry and mark it as recently used."""
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def get_measurement(self, key: tuple[Hashable, ...]) -> Measurement | None:
+        """Get the measurement kept for a key, counting it apart."""
+        measurement = self._get((*key, "measure"))
+        if measurement is None:
+            self.measure_misses += 1
+        else:
+            self.measure_hits += 1
+        return measurement  # type: ignore[return-value]
+
+    def put_measurement(
+        self, key: tuple[Hashable, ...], measurement: Measurement
+    ) -> None:
+        self.put((*key, "measure"), measurement)
+
+    def _get(self, key: tuple[Hashable, ...]) -> object | None:
+        try:
+            value = self._entries[key]
+        except KeyError:
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: tuple[Hashable, ...], value: object) -> None:
+        """Add an entry, evicting the least recently used if full."""
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def discard_category(self, category_name: str) -> None:
+        """Drop the entries of a category whose rows were reloaded."""
+        for key in [key for key in self._entries if key[0] == category_name]:
+            del self._entries[key]
+
+
+characteristics_table_cache = CharacteristicsTableCache()
+
+
+class CachedCharacteristicsTable:
+    """The characteristics table of a question, rendered through the cache."""
+
+    def __init__(
+        self,
+        question: QuizQuestion,
+        cache: CharacteristicsTableCache = characteristics_table_cache,
+    ) -> None:
+        self.question = question
+        self.cache = cache
+
+    def __rich_console__(
+        self, console: Console, options: ConsoleOptions
+    ) -> RenderResult:
+        question = self.question
+        key = (question.category_name, question.row_index, options.max_width)
+
+        lines = self.cache.get(key)
+        if lines is None:
+            table = create_characteristics_table(question.characteristics)
+            lines = console.render_lines(table, options.update(height=None), pad=False)
+            self.cache.put(key, lines)
+
+        new_line = Segment.line()
+        for line in lines:
+            yield from line
+            yield new_line
+
+    def __rich_measure__(
+        self, console: Console, options: ConsoleOptions
+    ) -> Measurement:
+        question = self.question
+        # Measurements depend on the width too
+        key = (question.category_name, question.row_index, options.max_width)
+
+        measurement = self.cache.get_measurement(key)
+        if measurement is None:
+            table = create_characteristics_table(question.characteristics)
+            measurement = Measurement.get(console, options, table)
+            self.cache.put_measurement(key, measurement)
+        return measurement
@@ -1,20 +1,9 @@
-from pathlib import Path
-
 from textual import on
 from textual.app import ComposeResult
-from textual.containers import Container, Grid, Horizontal, Vertical
+from textual.containers import Horizontal, Vertical
 from textual.message import Message
-from textual.reactive import reactive
 from textual.screen import ModalScreen
-from textual.widgets import (
-    Button,
-    Checkbox,
-    Label,
-    ListView,
-    RadioButton,
-    RadioSet,
-    Static,
-)
+from textual.widgets import Button, Checkbox, Label, Static
 
 from pharmq.utils.data_loader import load_csv_data
 
@@ -51,19 +40,29 @@ class CategorySelect(Static):  # Changed from Vertical to Grid
 
     # selected_categories: reactive[set[str] | None] = reactive(None)
 
-    def __init__(self) -> None:
+    def __init__(self, selected_categories: set[str] | None = None) -> None:
         super().__init__()
         self.categories = get_categories()
-        self.selected_categories = set(cat.id for cat in self.categories)
+        if selected_categories is None:
+            self.selected_categories = set(cat.id for cat in self.categories)
+        else:
+            self.selected_categories = set(selected_categories)
 
     def compose(self) -> ComposeResult:
         """Create checkboxes in a grid layout."""
         # "All Categories" takes full width
         # with Horizontal(classes="all-categories-row"):
-        yield Checkbox("All Categories", id="cat-all", value=True)
+        all_selected = all(
+            category.id in self.selected_categories for category in self.categories
+        )
+        yield Checkbox("All Categories", id="cat-all", value=all_selected)
 
         for category in self.categories:
-            yield Checkbox(category.title, id=f"cat-{category.id}", value=True)
+            yield Checkbox(
+                category.title,
+                id=f"cat-{category.id}",
+                value=category.id in self.selected_categories,
+            )
 
     def sync_selected(self, selected_categories: set[str]) -> None:
         """Sync selected categories with the given set."""
@@ -176,7 +175,7 @@ class SettingsModal(ModalScreen):
                 yield Label("Quiz Categories", classes="settings-section-title")
                 # with Container() as con:
                 # con.styles.height = '60'
-                yield CategorySelect()
+                yield CategorySelect(getattr(self.app, "selected_categories", None))
 
             with Horizontal(id="settings-buttons"):
                 yield Button("Save", variant="primary", id="save-button")
@@ -192,8 +191,6 @@ class SettingsModal(ModalScreen):
             select = self.query_one(CategorySelect)
             self.post_message(CategorySelect.Updated(select.selected_categories))
 
-            # TODO: Save settings and update app state
-
         self.app.pop_screen()
         event.stop()
 
@@ -0,0 +1,46 @@
+import os
+import shutil
+
+import pytest
+
+from pharmq.utils.data_loader import DATA_DIR
+from pharmq.utils.data_watcher import DataWatcher
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    for name in ("gout.csv", "nsaid.csv"):
+        shutil.copy(os.path.join(DATA_DIR, name), tmp_path)
+    return tmp_path
+
+
+def test_edit_is_reported(data_dir):
+    watcher = DataWatcher(data_dir)
+    assert watcher.poll() is None
+
+    gout = data_dir / "gout.csv"
+    gout.write_text(gout.read_text(encoding="utf-8") + "new drug,w,x,y\r\n", "utf-8")
+    change = watcher.poll()
+    assert change is not None and change.names == {"gout"}
+    assert change.changed["gout"].data[-1]["Drug"] == "new drug"
+    assert watcher.poll() is None
+
+
+def test_failed_parse_keeps_last_good_state(data_dir, capsys):
+    watcher = DataWatcher(data_dir)
+    gout = data_dir / "gout.csv"
+    good = gout.read_bytes()
+    before = dict(watcher.files)
+
+    # Caught mid-save, cut off inside a multi-byte character
+    gout.write_bytes(good + "é".encode("utf-8")[:1])
+    assert watcher.poll() is None
+    assert watcher.poll() is None  # still broken, still nothing to swap in
+    assert watcher.files == before
+    assert "Error reloading" in capsys.readouterr().out
+
+    # Once saved in full the edit is picked up, as the bad read was not kept
+    gout.write_bytes(good + b"new drug,w,x,y\r\n")
+    change = watcher.poll()
+    assert change is not None and change.names == {"gout"}
+    assert watcher.files[gout] != before[gout]
@@ -0,0 +1,43 @@
+import argparse
+import io
+
+import pytest
+
+from pharmq.__main__ import export
+from pharmq.utils import export as export_module
+from pharmq.utils.data_loader import DATA_DIR
+from pharmq.utils.export import export_questions
+
+
+@pytest.mark.parametrize("fmt", ["jsonl", "csv", "anki"])
+def test_output_is_the_same_for_any_number_of_workers(monkeypatch, fmt):
+    monkeypatch.setattr(export_module, "CHUNK_SIZE", 10)
+    outputs = []
+    for workers in (1, 3):
+        out = io.BytesIO()
+        export_questions(out, 45, seed=7, fmt=fmt, workers=workers)
+        outputs.append(out.getvalue())
+
+    assert outputs[0] == outputs[1]
+    assert outputs[0]
+
+
+def test_failed_export_leaves_the_file_alone(tmp_path):
+    path = tmp_path / "exam.jsonl"
+    path.write_text("kept\n")
+    args = argparse.Namespace(
+        seed=1,
+        category=["no such category"],
+        output=str(path),
+        count=5,
+        format="jsonl",
+        workers=1,
+        data_dir=DATA_DIR,
+        distractors="random",
+        cross_category=False,
+    )
+
+    with pytest.raises(SystemExit):
+        export(args)
+    assert path.read_text() == "kept\n"
+    assert [p.name for p in tmp_path.iterdir()] == ["exam.jsonl"]
@@ -0,0 +1,60 @@
+import threading
+
+from pharmq.utils.progress import Accuracy, ProgressStore
+
+
+def test_answers_are_written_behind(tmp_path):
+    store = ProgressStore(tmp_path / "progress.db")
+    store.FLUSH_INTERVAL = 60  # nothing is written unless flushed
+    try:
+        assert not (tmp_path / "progress.db").exists()
+
+        store.record("ann", "nsaid", 1, True)
+        store.record("ann", "nsaid", 1, False)
+        store.record("ann", "gout", 2, True)
+        store.record("bob", "nsaid", 3, True)
+        store.flush()
+
+        assert store.category_accuracy("ann") == {
+            "nsaid": Accuracy(2, 1),
+            "gout": Accuracy(1, 1),
+        }
+        assert store.row_accuracy("ann", "nsaid") == {1: Accuracy(2, 1)}
+    finally:
+        store.close()
+
+    reopened = ProgressStore(tmp_path / "progress.db")
+    try:
+        assert reopened.category_accuracy("bob") == {"nsaid": Accuracy(1, 1)}
+    finally:
+        reopened.close()
+
+
+def test_close_writes_what_is_left(tmp_path):
+    store = ProgressStore(tmp_path / "progress.db")
+    store.FLUSH_INTERVAL = 60
+    store.record("ann", "nsaid", 1, True)
+    store.close()
+
+    reopened = ProgressStore(tmp_path / "progress.db")
+    try:
+        assert reopened.category_accuracy("ann") == {"nsaid": Accuracy(1, 1)}
+    finally:
+        reopened.close()
+
+
+def test_flush_returns_after_a_failed_write(tmp_path):
+    store = ProgressStore(tmp_path / "progress.db")
+
+    def fail(connection, batch):
+        raise ValueError("not a database error")
+
+    store._write = fail  # type: ignore[method-assign]
+    store.record("ann", "nsaid", 1, True)
+
+    flushed = threading.Thread(target=store.flush)
+    flushed.start()
+    flushed.join(timeout=5)
+    assert not flushed.is_alive()
+
+    store.close()
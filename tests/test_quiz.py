@@ -0,0 +1,48 @@
+from pharmq.models.category import Category
+from pharmq.models.quiz import QuizGenerator
+from pharmq.utils.data_loader import load_csv_data
+
+
+def check_question(generator, question, distinct):
+    category = generator.categories[question.category_name]
+    texts = [option.text for option in question.options]
+
+    assert question.answer == category.data[question.row_index][category.answer_field]
+    assert texts[question.answer_index] == question.answer
+    assert [option.is_correct for option in question.options] == [
+        i == question.answer_index for i in range(4)
+    ]
+    for option in question.options:
+        row = generator.categories[option.category_name].data[option.row_index]
+        assert row[category.answer_field] == option.text
+    if distinct:
+        assert len(set(texts)) == 4
+
+
+def test_batch_options_are_distinct_and_answered_right():
+    generator = QuizGenerator(load_csv_data())
+    batch = generator.generate_batch(2000, seed=1)
+
+    assert len(batch) == 2000
+    for question in batch:
+        category = generator.categories[question.category_name]
+        distinct_answers = {row[category.answer_field] for row in category.data}
+        check_question(generator, question, distinct=len(distinct_answers) >= 4)
+    # The shuffle puts the answer everywhere
+    assert set(batch.array["answer_index"]) == {0, 1, 2, 3}
+
+
+def test_batch_of_many_rows_with_few_answers():
+    rows = [{"drug": f"drug {i % 5}", "effect": str(i)} for i in range(200)]
+    generator = QuizGenerator(
+        {"tiny": Category("tiny", rows, ["effect"], "drug")}
+    )
+    for question in generator.generate_batch(500, seed=2):
+        check_question(generator, question, distinct=True)
+
+
+def test_batch_is_seeded():
+    generator = QuizGenerator(load_csv_data())
+    first = generator.generate_batch(100, seed=3).array
+    second = generator.generate_batch(100, seed=3).array
+    assert (first == second).all()
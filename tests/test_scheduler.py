@@ -0,0 +1,92 @@
+import random
+
+from pharmq.models.category import Category
+from pharmq.models.scheduler import DAY, Scheduler
+from pharmq.utils.progress import Answer
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def deck(n_rows: int) -> dict[str, Category]:
+    rows = [{"drug": f"drug {row}"} for row in range(n_rows)]
+    return {"nsaid": Category("nsaid", rows, ["drug"], "drug")}
+
+
+def test_intervals_follow_sm2():
+    clock = Clock()
+    scheduler = Scheduler(deck(1), clock=clock, rng=random.Random(0))
+
+    intervals = []
+    for _ in range(4):
+        assert scheduler.next_card(["nsaid"]) == ("nsaid", 0)
+        intervals.append(scheduler.review("nsaid", 0, True).interval)
+    assert intervals == [1, 6, 15, 38]
+
+    assert scheduler.next_card(["nsaid"]) == ("nsaid", 0)
+    state = scheduler.review("nsaid", 0, False)
+    assert (state.repetitions, state.interval) == (0, 0)
+    assert state.due == clock.now + Scheduler.RELEARN_DELAY
+
+
+def test_overdue_cards_come_before_new_cards():
+    clock = Clock()
+    scheduler = Scheduler(deck(5), clock=clock, rng=random.Random(0))
+
+    missed = scheduler.next_card(["nsaid"])
+    scheduler.review(*missed, False)
+    learned = scheduler.next_card(["nsaid"])
+    scheduler.review(*learned, True)
+
+    # Not due yet, so new cards come first
+    card = scheduler.next_card(["nsaid"])
+    assert card not in (missed, learned)
+    scheduler.requeue(*card)
+
+    clock.now += Scheduler.RELEARN_DELAY
+    assert scheduler.next_card(["nsaid"]) == missed
+
+    clock.now += DAY
+    assert scheduler.next_card(["nsaid"]) == learned
+
+
+def test_seen_cards_are_asked_early_once_no_new_cards_are_left():
+    clock = Clock()
+    scheduler = Scheduler(deck(2), clock=clock, rng=random.Random(0))
+
+    first = scheduler.next_card(["nsaid"])
+    scheduler.review(*first, True)
+    second = scheduler.next_card(["nsaid"])
+    scheduler.review(*second, False)
+
+    assert scheduler.next_card(["nsaid"]) == second
+    assert scheduler.next_card(["nsaid"]) == first
+    assert scheduler.next_card(["nsaid"]) is None
+
+
+def test_seeded_answers_carry_over():
+    clock = Clock()
+    answers = [
+        Answer("ann", "nsaid", 2, True, clock.now - 2 * DAY),
+        Answer("ann", "nsaid", 2, True, clock.now - DAY),
+        Answer("ann", "nsaid", 3, False, clock.now - DAY),
+        Answer("ann", "nsaid", 9, True, clock.now),  # no such row any more
+        Answer("ann", "gout", 0, True, clock.now),  # nor such category
+    ]
+    scheduler = Scheduler(deck(5), clock=clock, rng=random.Random(0))
+    scheduler.seed(answers)
+
+    assert scheduler.states["nsaid"][2].interval == 6
+    assert scheduler.states["nsaid"][2].due == clock.now + 5 * DAY
+    assert set(scheduler.states["nsaid"]) == {2, 3}
+
+    # The missed card is overdue, the learned one only comes after new ones
+    assert scheduler.next_card(["nsaid"]) == ("nsaid", 3)
+    cards = [scheduler.next_card(["nsaid"]) for _ in range(4)]
+    assert cards[-1] == ("nsaid", 2)
+    assert sorted(row for _, row in cards[:3]) == [0, 1, 4]
@@ -0,0 +1,43 @@
+from pharmq.models.search import PrefixMatch, SearchIndex, Term, match_spans
+from pharmq.utils.data_loader import load_csv_data
+
+
+def test_lazy_prefix_in_small_catalogue():
+    categories = load_csv_data()
+    expected = SearchIndex(categories).search("a")
+
+    index = SearchIndex(categories)
+    index.PREFIX_VALUES = 3
+    index.build()
+    assert index.n_rows <= index.SCAN_THRESHOLD
+    assert isinstance(index.match_values(Term("a", False)), PrefixMatch)
+
+    assert index.search("a") == expected
+    assert len(index.search("a")) > 0
+
+
+def test_lazy_prefix_with_selective_term():
+    categories = load_csv_data()
+    expected = SearchIndex(categories).search("aspirin a")
+
+    index = SearchIndex(categories)
+    index.PREFIX_VALUES = 3
+    assert index.search("aspirin a") == expected
+    assert len(expected) > 0
+
+
+def test_highlight_spans_of_folded_text():
+    index = SearchIndex(load_csv_data())
+
+    pattern = index.highlighter("ＡＳＰＩＲＩＮ")
+    assert match_spans(pattern, "Low-dose Aspirin") == [(9, 16)]
+    # Full-width text, and text that folds to more characters
+    assert match_spans(pattern, "ＡＳＰＩＲＩＮ ok") == [(0, 7)]
+    pattern = index.highlighter("fi")
+    assert match_spans(pattern, "ﬁbrate") == [(0, 1)]
+    # A combining mark is highlighted with the letter before it
+    pattern = index.highlighter("café")
+    assert match_spans(pattern, "Cafe\u0301 au lait") == [(0, 5)]
+    # Words only match at their start
+    pattern = index.highlighter("pirin")
+    assert match_spans(pattern, "aspirin") == []
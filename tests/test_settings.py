@@ -0,0 +1,59 @@
+import threading
+import time
+
+from pharmq.models.settings import Settings, SettingsStore
+
+
+def test_changes_are_debounced(tmp_path, monkeypatch):
+    store = SettingsStore(tmp_path)
+    store.DEBOUNCE = 0.2
+    saved = []
+    save = Settings.save
+
+    def counted(settings, path):
+        saved.append(settings.selected_categories)
+        save(settings, path)
+
+    monkeypatch.setattr(Settings, "save", counted)
+
+    for categories in ({"nsaid"}, {"nsaid", "gout"}, {"gout"}):
+        store.update("ann", Settings(selected_categories=categories))
+    assert not store.path("ann").exists()
+
+    time.sleep(0.5)
+    assert saved == [{"gout"}]
+    assert Settings.load(store.path("ann")).selected_categories == {"gout"}
+
+
+def test_flush_waits_for_a_write_in_progress(tmp_path, monkeypatch):
+    store = SettingsStore(tmp_path)
+    store.DEBOUNCE = 0
+    started = threading.Event()
+    save = Settings.save
+
+    def slow(settings, path):
+        started.set()
+        time.sleep(0.3)
+        save(settings, path)
+
+    monkeypatch.setattr(Settings, "save", slow)
+
+    store.update("ann", Settings(show_answer=False))
+    assert started.wait(timeout=5)
+    store.flush()
+    assert Settings.load(store.path("ann")).show_answer is False
+
+
+def test_save_replaces_the_file_whole(tmp_path):
+    path = tmp_path / "ann.json"
+    Settings(selected_categories={"nsaid"}).save(path)
+    Settings(selected_categories={"gout"}).save(path)
+
+    assert Settings.load(path).selected_categories == {"gout"}
+    assert [p.name for p in tmp_path.iterdir()] == ["ann.json"]
+
+
+def test_default_directory_follows_state_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("PHARMQ_STATE_DIR", str(tmp_path))
+    store = SettingsStore()
+    assert store.directory == tmp_path / "settings"
@@ -0,0 +1,68 @@
+import os
+import shutil
+
+import pytest
+
+from pharmq.utils import snapshot as snapshot_module
+from pharmq.utils.data_loader import DATA_DIR, read_csv_dir
+from pharmq.utils.snapshot import load_snapshot, write_snapshot
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    for name in ("gout.csv", "nsaid.csv"):
+        shutil.copy(os.path.join(DATA_DIR, name), tmp_path)
+    return tmp_path
+
+
+def rows(categories):
+    return {
+        name: (
+            category.answer_field,
+            category.fields,
+            [dict(row) for row in category.data],
+        )
+        for name, category in categories.items()
+    }
+
+
+def test_round_trip(data_dir):
+    categories = read_csv_dir(data_dir)
+    write_snapshot(data_dir, categories)
+
+    loaded = load_snapshot(data_dir)
+    assert loaded is not None
+    assert rows(loaded) == rows(categories)
+
+
+def test_untouched_files_are_not_hashed(data_dir, monkeypatch):
+    write_snapshot(data_dir, read_csv_dir(data_dir))
+
+    def fail(data_dir):
+        raise AssertionError("hashed the CSV files")
+
+    monkeypatch.setattr(snapshot_module, "dataset_digest", fail)
+    assert load_snapshot(data_dir) is not None
+
+
+def test_touched_but_unchanged_files_are_hashed(data_dir):
+    write_snapshot(data_dir, read_csv_dir(data_dir))
+    csv_file = data_dir / "gout.csv"
+    stat = csv_file.stat()
+    os.utime(csv_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert load_snapshot(data_dir) is not None
+
+
+@pytest.mark.parametrize("edit", ["change", "add", "remove"])
+def test_stale_snapshot_is_not_used(data_dir, edit):
+    write_snapshot(data_dir, read_csv_dir(data_dir))
+    if edit == "change":
+        with open(data_dir / "gout.csv", "a", encoding="utf-8") as f:
+            f.write("\n")
+    elif edit == "add":
+        shutil.copy(os.path.join(DATA_DIR, "serotonin.csv"), data_dir)
+    else:
+        (data_dir / "nsaid.csv").unlink()
+
+    assert load_snapshot(data_dir) is None